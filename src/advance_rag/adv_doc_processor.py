@@ -1,71 +1,167 @@
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers.json import JsonOutputParser
-from typing import List
+from typing import List, Optional
 import asyncio
+import logging
 
-from src.models import ExpandKeywords, ExpandQA
+from src.config import CHUNK_CONFIG, EXPANSION_CONFIG
+from src.models import ExpandKeywords, ExpandQA, ExpandKeywordsQA, ExpandPackedKeywordsQA
 from src.prompts import DocPrompt
 from src.utils import llm
 
+logger = logging.getLogger(__name__)
+
+## one concurrency limit per event loop, shared by every section (and processor) expanding on it
+_expansion_semaphores = {}
+
+
+def get_expansion_semaphore(max_concurrency: int = EXPANSION_CONFIG["MAX_CONCURRENCY"]) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _expansion_semaphores:
+        _expansion_semaphores.clear()
+        _expansion_semaphores[loop] = asyncio.Semaphore(max_concurrency)
+    return _expansion_semaphores[loop]
+
+
 class AdvanceDocProcessor:
 
     def __init__(self):
         self.llm = llm
 
+    def _chain(self, template: str, pydantic_object, input_variable: str = "chunk_text"):
+        parser = JsonOutputParser(pydantic_object=pydantic_object)
+        prompt = PromptTemplate(
+        template=template,
+        input_variables=[input_variable],
+        partial_variables={"format_instructions": parser.get_format_instructions()})
+        return prompt | self.llm | parser
+
+    @staticmethod
+    async def _expand_all(chain, chunks: List[str]) -> List[Optional[dict]]:
+        """One bounded `ainvoke` per chunk, results in chunk order; None for the chunks whose request failed"""
+        semaphore = get_expansion_semaphore()
+
+        async def expand(chunk):
+            async with semaphore:
+                try:
+                    return await chain.ainvoke({'chunk_text': chunk})
+                except Exception as e:
+                    ## one failed chunk must not fail the section: it is embedded without its expansion
+                    logger.warning(f"Expansion of a chunk failed, embedding it unexpanded: {e}")
+                    return None
+
+        return await asyncio.gather(*[expand(chunk) for chunk in chunks])
+
+    @staticmethod
+    def _pack(chunks: List[str]) -> str:
+        return '\n'.join(f'<Chunk index="{i}">\n{chunk}\n</Chunk>' for i, chunk in enumerate(chunks))
+
+    @staticmethod
+    def _unpack(result, n_chunks: int) -> List[Optional[dict]]:
+        """Expansions of a packed response in chunk order, None for every chunk missing or malformed in it"""
+        expansions: List[Optional[dict]] = [None] * n_chunks
+        items = result.get('expansions') if isinstance(result, dict) else None
+        for item in items if isinstance(items, list) else []:
+            try:
+                index = int(item['chunk_index'])
+                expansion = ExpandKeywordsQA(keywords=item['keywords'], qa_session=item['qa_session'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= index < n_chunks and expansions[index] is None:
+                expansions[index] = {'keywords': expansion.keywords, 'qa_session': expansion.qa_session}
+        return expansions
+
+    async def _expand_packed(self, chunks: List[str], pack_size: int) -> List[Optional[dict]]:
+        """
+        Keywords and QA for `pack_size` chunks per request, so the instructions are sent once per pack instead of
+        once per chunk. Chunks missing from or malformed in a packed response are re-requested on their own.
+        """
+        packed_chain = self._chain(DocPrompt.PACKED_KEYWORD_QA_PROMPT, ExpandPackedKeywordsQA, "chunks_text")
+        semaphore = get_expansion_semaphore()
+
+        async def expand_pack(pack):
+            async with semaphore:
+                try:
+                    result = await packed_chain.ainvoke({'chunks_text': self._pack(pack)})
+                except Exception as e:
+                    logger.warning(f"Packed expansion of {len(pack)} chunks failed, expanding them one by one: {e}")
+                    result = None
+            return self._unpack(result, len(pack))
+
+        packs = [chunks[i:i + pack_size] for i in range(0, len(chunks), pack_size)]
+        expansions = [expansion for pack in await asyncio.gather(*[expand_pack(pack) for pack in packs])
+                      for expansion in pack]
+
+        missing = [i for i, expansion in enumerate(expansions) if expansion is None]
+        if missing:
+            logger.info(f"Re-requesting {len(missing)}/{len(chunks)} chunks missing from packed expansion responses")
+            retried = await self._expand_all(self._chain(DocPrompt.KEYWORD_QA_PROMPT, ExpandKeywordsQA),
+                                             [chunks[i] for i in missing])
+            for i, expansion in zip(missing, retried):
+                expansions[i] = expansion
+        return expansions
+
+    async def _expand_batch(self, chunks: List[str]) -> List[Optional[dict]]:
+        """
+        Keywords and QA from the offline Batch API pass (`PDFProcessor.run_batch_expansion`), nothing is waited
+        for here; chunks the pass did not expand are expanded online
+        """
+        from src.advance_rag.batch_expansion import chunk_key, load_batch_expansions
+
+        batch_expansions = await asyncio.to_thread(load_batch_expansions)
+        expansions = [batch_expansions.get(chunk_key(chunk)) for chunk in chunks]
+        missing = [i for i, expansion in enumerate(expansions) if expansion is None]
+        if missing:
+            logger.info(f"Re-requesting {len(missing)}/{len(chunks)} chunks missing from batch expansion results")
+            retried = await self._expand_all(self._chain(DocPrompt.KEYWORD_QA_PROMPT, ExpandKeywordsQA),
+                                             [chunks[i] for i in missing])
+            for i, expansion in zip(missing, retried):
+                expansions[i] = expansion
+        return expansions
+
     async def document_expansion(self, chunks: List[str],
                            expand_headers: str=False,
                            expand_keywords: str=True,
-                           expand_qa_session: str=True) -> List[str]:
+                           expand_qa_session: str=True,
+                           mode: Optional[str]=None) -> List[str]:
+        """
+        Returns (original_chunks, modified_chunks): each modified chunk is the original with its keywords and
+        QA session appended, a chunk whose expansion failed is left as it is. mode "packed" (EXPANSION_CONFIG
+        default) asks for keywords and QA of CHUNK_CONFIG["BATCH_SIZE"] chunks per call, "fused" for one chunk
+        per call, "separate" runs one pass per expansion, "batch" takes the results of the offline Batch API pass
+        and runs the fused requests online for the chunks it did not cover.
+        """
 
         if expand_headers:
             #Todo: To be added
             raise NotImplementedError
 
-        if expand_keywords:
-
-            parser = JsonOutputParser(pydantic_object=ExpandKeywords)
-            prompt = PromptTemplate(
-            template=DocPrompt.KEYWORD_PROMPT,
-            input_variables=["chunk_text"],
-            partial_variables={"format_instructions": parser.get_format_instructions()})
-
-            chain = prompt | self.llm | parser
-            # keywords = []
-            # for chunk in chunks:
-            #     keyword = chain.invoke({'chunk_text': chunk})
-            #     keywords.append(keyword)
-
-            tasks = [chain.ainvoke({'chunk_text': chunk}) for chunk in chunks]
-            keywords = await asyncio.gather(*tasks)
-
-
-        if expand_qa_session:
-
-            parser = JsonOutputParser(pydantic_object=ExpandQA)
-            prompt = PromptTemplate(
-            template=DocPrompt.QA_GENERATION_PROMPT,
-            input_variables=["chunk_text"],
-            partial_variables={"format_instructions": parser.get_format_instructions()})
-
-            chain = prompt | self.llm | parser
-            # qas = []
-            # for chunk in chunks:
-            #     qa = chain.invoke({'chunk_text': chunk})
-            #     qas.append(qa)
+        mode = mode or EXPANSION_CONFIG["MODE"]
+        if mode == "packed" and expand_keywords and expand_qa_session:
+            expansions = await self._expand_packed(chunks, CHUNK_CONFIG["BATCH_SIZE"])
+            keywords = qas = expansions
+        elif mode == "batch" and expand_keywords and expand_qa_session:
+            expansions = await self._expand_batch(chunks)
+            keywords = qas = expansions
+        elif mode == "fused" and expand_keywords and expand_qa_session:
+            expansions = await self._expand_all(self._chain(DocPrompt.KEYWORD_QA_PROMPT, ExpandKeywordsQA), chunks)
+            keywords = qas = expansions
+        else:
+            if expand_keywords:
+                keywords = await self._expand_all(self._chain(DocPrompt.KEYWORD_PROMPT, ExpandKeywords), chunks)
 
-            tasks = [chain.ainvoke({'chunk_text': chunk}) for chunk in chunks]
-            qas = await asyncio.gather(*tasks)
+            if expand_qa_session:
+                qas = await self._expand_all(self._chain(DocPrompt.QA_GENERATION_PROMPT, ExpandQA), chunks)
 
         original_chunks = []
         modified_chunks = []
         for i in range(len(chunks)):
             original_chunk = chunks[i]
-            if expand_keywords:
-                modified_chunk = original_chunk + '\n\n keywords: \n' + keywords[i]['keywords']
-            else:
-                modified_chunk = original_chunk.copy()
+            modified_chunk = original_chunk
+            if expand_keywords and keywords[i] is not None:
+                modified_chunk = modified_chunk + '\n\n keywords: \n' + keywords[i]['keywords']
 
-            if expand_qa_session:
+            if expand_qa_session and qas[i] is not None:
                 qas_string = '\n'.join(qas[i]['qa_session'])
                 modified_chunk = modified_chunk + '\n\n qa session: \n' + qas_string
 
@@ -79,4 +175,3 @@ class AdvanceDocProcessor:
             # modified_chunks.append(t_dict)
 
         return original_chunks, modified_chunks
-
@@ -0,0 +1,305 @@
+"""
+OpenAI Batch API backend for document expansion (EXPANSION_CONFIG["MODE"] = "batch").
+
+Expansion through the Batch API is a separate offline pass (`PDFProcessor.run_batch_expansion`) run before
+ingestion. The chunks of every new or changed section of the corpus become `/v1/chat/completions` request
+lines with their chunk id as custom_id, unique across documents and sections. The lines are packed into
+shared JSONL files of MODEL_CONFIGS["batch_processing"]["batch_size"] requests, and all batches are submitted
+together and polled every "poll_interval" seconds. The whole pass waits for one turnaround (the
+"completion_window"). The expansions are saved by chunk text to EXPANSION_CONFIG["BATCH_RESULTS_PATH"];
+ingestion with EXPANSION_CONFIG["ENABLED"] in "batch" mode reads them and expands online only the chunks
+the pass did not return.
+
+For local runs the module also serves a stand-in for the files and batches endpoints, which executes
+each batch line against an OpenAI-compatible chat endpoint (LiteLLM by default):
+
+    python -m src.advance_rag.batch_expansion --port 8002 --model openai/gpt-4.1-nano
+
+with OPENAI_BATCH_BASE_URL=http://127.0.0.1:8002/v1 for the ingestion process.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers.json import JsonOutputParser
+from openai import AsyncOpenAI
+
+from src.config import EXPANSION_CONFIG, LITE_LLM_BASE_URL, LITE_LLM_KEY, MODEL_CONFIGS
+from src.models import ExpandKeywordsQA
+from src.prompts import DocPrompt
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+
+class BatchExpansionClient:
+
+    def __init__(self,
+                 model: str = MODEL_CONFIGS["batch_processing"]["model"],
+                 api_key: str = MODEL_CONFIGS["batch_processing"]["api_key"],
+                 base_url: Optional[str] = MODEL_CONFIGS["batch_processing"]["base_url"],
+                 batch_size: int = MODEL_CONFIGS["batch_processing"]["batch_size"],
+                 completion_window: str = MODEL_CONFIGS["batch_processing"]["completion_window"],
+                 poll_interval: float = MODEL_CONFIGS["batch_processing"]["poll_interval"],
+                 http_client=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        self.parser = JsonOutputParser(pydantic_object=ExpandKeywordsQA)
+        self.prompt = PromptTemplate(
+            template=DocPrompt.KEYWORD_QA_PROMPT,
+            input_variables=["chunk_text"],
+            partial_variables={"format_instructions": self.parser.get_format_instructions()})
+
+    def build_requests(self, requests: List[Tuple[str, str]]) -> str:
+        """JSONL body of a batch input file, one chat completion request per (custom_id, chunk)"""
+        lines = []
+        for custom_id, chunk in requests:
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": self.model,
+                    "temperature": 0,
+                    "messages": [{"role": "user", "content": self.prompt.format(chunk_text=chunk)}],
+                },
+            }, ensure_ascii=False))
+        return "\n".join(lines) + "\n"
+
+    async def submit(self, requests: List[Tuple[str, str]]) -> str:
+        """Upload one JSONL input file and start its batch, returns the batch id"""
+        input_file = await self.client.files.create(
+            file=("expansion.jsonl", self.build_requests(requests).encode("utf-8")),
+            purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+            metadata={"task": "document_expansion"})
+        return batch.id
+
+    async def wait(self, batch_id: str):
+        started = time.perf_counter()
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                counts = batch.request_counts
+                logger.info(f"Batch {batch_id} {batch.status} after {time.perf_counter() - started:.0f}s"
+                            + (f": {counts.completed}/{counts.total} requests completed" if counts else ""))
+                return batch
+            await asyncio.sleep(self.poll_interval)
+
+    def parse_output_line(self, line: str):
+        """(custom_id, expansion) of one output line; expansion is None for a failed or malformed response"""
+        record = json.loads(line)
+        custom_id = record["custom_id"]
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            return custom_id, None
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            expansion = ExpandKeywordsQA(**self.parser.parse(content))
+        except Exception:
+            return custom_id, None
+        return custom_id, {"keywords": expansion.keywords, "qa_session": expansion.qa_session}
+
+    async def _run_batch(self, requests: List[Tuple[str, str]]) -> Dict[str, dict]:
+        batch = await self.wait(await self.submit(requests))
+        if not batch.output_file_id:
+            return {}
+        content = await self.client.files.content(batch.output_file_id)
+        expansions = {}
+        for line in content.text.splitlines():
+            if line.strip():
+                custom_id, expansion = self.parse_output_line(line)
+                if expansion is not None:
+                    expansions[custom_id] = expansion
+        return expansions
+
+    async def expand(self, requests: Dict[str, str]) -> Dict[str, dict]:
+        """
+        Keywords and QA per custom_id of {custom_id: chunk}. Every batch is submitted before any is waited
+        for, so all of them complete within one turnaround; custom_ids the batches did not return are missing.
+        """
+        items = list(requests.items())
+        results = await asyncio.gather(*[self._run_batch(items[i:i + self.batch_size])
+                                         for i in range(0, len(items), self.batch_size)])
+        return {custom_id: expansion for result in results for custom_id, expansion in result.items()}
+
+
+_batch_client: Optional[BatchExpansionClient] = None
+
+
+def get_batch_expansion_client() -> BatchExpansionClient:
+    global _batch_client
+    if _batch_client is None:
+        _batch_client = BatchExpansionClient()
+    return _batch_client
+
+
+def chunk_key(chunk: str) -> str:
+    """Key of a chunk's expansion in the results file"""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def save_batch_expansions(expansions: Dict[str, dict], path: str = EXPANSION_CONFIG["BATCH_RESULTS_PATH"]):
+    """Replace the results file with {chunk_key: expansion}"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key, expansion in expansions.items():
+            f.write(json.dumps({"key": key, **expansion}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+_batch_expansions: Dict[str, Tuple[float, Dict[str, dict]]] = {}  # path -> (mtime, expansions)
+
+
+def load_batch_expansions(path: str = EXPANSION_CONFIG["BATCH_RESULTS_PATH"]) -> Dict[str, dict]:
+    """{chunk_key: expansion} of the last offline pass, read again once the file changes; empty without one"""
+    if not os.path.exists(path):
+        return {}
+    mtime = os.path.getmtime(path)
+    if path not in _batch_expansions or _batch_expansions[path][0] != mtime:
+        expansions = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    expansions[record.pop("key")] = record
+        _batch_expansions[path] = (mtime, expansions)
+    return _batch_expansions[path][1]
+
+
+def create_app(upstream_base_url: str = LITE_LLM_BASE_URL,
+               upstream_api_key: Optional[str] = LITE_LLM_KEY,
+               model: Optional[str] = None,
+               max_concurrency: int = 8,
+               batch_timeout: Optional[float] = None,
+               upstream_transport=None):
+    """
+    FastAPI stand-in for the OpenAI files and batches endpoints. Batches run in the background, each request
+    line sent to `upstream_base_url`/chat/completions (with its model replaced by `model` if given).
+    A batch whose input file has a malformed line fails, one still running after `batch_timeout` seconds
+    expires without an output file. `upstream_transport` (an httpx transport) replaces the network upstream.
+    """
+    import httpx
+    from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+    from fastapi.responses import PlainTextResponse
+
+    app = FastAPI(title="Batch API stand-in")
+    files: Dict[str, Dict] = {}
+    batches: Dict[str, Dict] = {}
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    def new_file(content: str, purpose: str, filename: str) -> Dict:
+        file_id = f"file-{uuid.uuid4().hex}"
+        files[file_id] = {"id": file_id, "object": "file", "bytes": len(content.encode("utf-8")),
+                          "created_at": int(time.time()), "filename": filename, "purpose": purpose,
+                          "status": "processed", "content": content}
+        return files[file_id]
+
+    def file_object(file: Dict) -> Dict:
+        return {key: value for key, value in file.items() if key != "content"}
+
+    async def call(client: httpx.AsyncClient, request: Dict) -> Dict:
+        body = dict(request["body"], model=model or request["body"]["model"])
+        async with semaphore:
+            try:
+                response = await client.post("/chat/completions", json=body)
+                result = {"status_code": response.status_code, "request_id": uuid.uuid4().hex,
+                          "body": response.json()}
+            except Exception as e:
+                result = {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {"error": str(e)}}
+        return {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": result,
+                "error": None}
+
+    async def run(batch: Dict):
+        try:
+            await asyncio.wait_for(execute(batch), batch_timeout)
+        except asyncio.TimeoutError:
+            batch["status"] = "expired"
+            batch["expired_at"] = int(time.time())
+        except Exception as e:
+            batch["status"] = "failed"
+            batch["errors"] = {"object": "list", "data": [{"code": "stand_in_error", "message": str(e)}]}
+
+    async def execute(batch: Dict):
+        requests = [json.loads(line) for line in files[batch["input_file_id"]]["content"].splitlines() if line.strip()]
+        for request in requests:
+            if (request.get("method") != "POST" or request.get("url") != batch["endpoint"]
+                    or "custom_id" not in request or "messages" not in request.get("body", {})):
+                raise ValueError(f"Invalid batch request line: {json.dumps(request)[:200]}")
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(requests)
+        headers = {"Authorization": f"Bearer {upstream_api_key}"} if upstream_api_key else {}
+        async with httpx.AsyncClient(base_url=upstream_base_url, headers=headers, timeout=None,
+                                     transport=upstream_transport) as client:
+            outputs = await asyncio.gather(*[call(client, request) for request in requests])
+        succeeded = [output for output in outputs if output["response"]["status_code"] == 200]
+        batch["request_counts"].update(completed=len(succeeded), failed=len(outputs) - len(succeeded))
+        batch["output_file_id"] = new_file("".join(json.dumps(output) + "\n" for output in outputs),
+                                           "batch_output", "output.jsonl")["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    @app.post("/v1/files")
+    async def upload(file: UploadFile = File(...), purpose: str = Form(...)):
+        return file_object(new_file((await file.read()).decode("utf-8"), purpose, file.filename))
+
+    @app.get("/v1/files/{file_id}/content", response_class=PlainTextResponse)
+    async def file_content(file_id: str):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail=f"No such file: {file_id}")
+        return files[file_id]["content"]
+
+    @app.post("/v1/batches")
+    async def create_batch(payload: dict):
+        if payload.get("input_file_id") not in files:
+            raise HTTPException(status_code=400, detail="Unknown input_file_id")
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": payload.get("endpoint", BATCH_ENDPOINT),
+            "input_file_id": payload["input_file_id"], "completion_window": payload.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "completed_at": None, "metadata": payload.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        batches[batch_id]["task"] = asyncio.create_task(run(batches[batch_id]))
+        return {key: value for key, value in batches[batch_id].items() if key != "task"}
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail=f"No such batch: {batch_id}")
+        return {key: value for key, value in batches[batch_id].items() if key != "task"}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI files and batches endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--upstream", default=LITE_LLM_BASE_URL, help="OpenAI-compatible endpoint running the requests")
+    parser.add_argument("--model", default=None, help="Model name used upstream instead of the requested one")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.upstream, LITE_LLM_KEY, args.model, args.max_concurrency),
+                host=args.host, port=args.port)
@@ -17,13 +17,95 @@ if LITE_LLM_KEY is None:
     raise ValueError("LITE_LLM_KEY is not set")
 
 CHUNK_CONFIG = {
+      "SPLITTER": os.getenv("CHUNK_SPLITTER", "token"),  # "token" (tiktoken budget) | "nltk" (legacy 1500/500 characters)
+      "STRUCTURE_AWARE": True,  # Pack whole MinerU blocks under their headings (no overlap); falls back to SPLITTER
       "CHUNK_MAX_TOK": 1000,    # Maximum tokens per chunk
       "OVERLAP": 200,           # Overlap tokens between chunks
-      "BATCH_SIZE": 10          # Number of chunks per batch
+      "CHUNK_MAX_CHARS": 3000,  # Hard cap per chunk; Milvus `content` is VARCHAR(10000) bytes and CJK takes 3 bytes/char
+      "ENCODING": "cl100k_base",  # tiktoken encoding used to count tokens
+      "STREAM_BATCH_SIZE": 64,  # Chunks split ahead and sent to expansion/embedding together
+      "STREAM_MAX_IN_FLIGHT": 2,  # Chunk batches being embedded while the next one is split
+      "BATCH_SIZE": 10          # Chunks packed into one expansion request (EXPANSION_CONFIG["MODE"] = "packed")
+  }
+
+PARSE_CONFIG = {
+      "CACHE_ENABLED": True,    # Reuse per-page MinerU output across section extractions
+      "CACHE_DIR": os.getenv("PARSE_CACHE_DIR", None),  # Defaults to <output_dir>/parse_cache
+      "WRITE_ARTIFACTS": False, # Write markdown/images under <output_dir>; ingestion only needs the text
+      "TEXT_LAYER_FAST_PATH": True,  # Read clean born-digital pages from the text layer, pipeline only the rest
+      "USE_OUTLINE": True,      # Take section page ranges from PDF bookmarks, ask the LLM only without them
+  }
+
+INGEST_CONFIG = {
+      "NUM_WORKERS": int(os.getenv("INGEST_WORKERS", 1)),  # Documents ingested in parallel (1 = sequential)
+      "QUEUE_SIZE": 2,          # Parsed documents/sections buffered ahead of the embedding stage
+  }
+
+EMBEDDING_CONFIG = {
+      "BACKEND": os.getenv("EMBEDDING_BACKEND", "remote"),  # "remote" (EMB_URL service) | "local" (in-process CPU model)
+      "MAX_BATCH_SIZE": 32,     # Texts per embedding request
+      "MAX_BATCH_CHARS": 48000, # Total characters per embedding request
+      "MAX_CONCURRENCY": 4,     # Embedding requests in flight (shared by all callers)
+      "MAX_RETRIES": 3,         # Retries per batch, with exponential backoff
+      "BACKOFF_SECONDS": 1.0,
+      "TIMEOUT": 120,           # Seconds per request
+      "RESPONSE_ENCODING": os.getenv("EMBEDDING_RESPONSE_ENCODING", "base64"),  # "base64" (binary vectors, if the service supports it) | "json"
+      "MODEL_ID": os.getenv("EMBEDDING_MODEL_ID", "default"),  # Part of the cache key, change it when the model changes
+      "CACHE_ENABLED": True,    # Persistent content-addressed embedding cache
+      "CACHE_PATH": os.getenv("EMBEDDING_CACHE_PATH", os.path.join("../../data", "cache", "embeddings.sqlite")),
+      "CACHE_DTYPE": "float16", # float16 halves the cache size; use float32 for exact vectors
+      "CACHE_MAX_BYTES": 2 * 1024 ** 3,  # Least recently used entries are evicted beyond this
+      "QUERY_CACHE_SIZE": 1024, # In-process LRU of query embeddings
+      "QUERY_CACHE_TTL": 3600,  # Seconds before a cached query embedding is refreshed
+      "LOCAL_ENGINE": os.getenv("LOCAL_EMBEDDING_ENGINE", "fastembed"),  # fastembed (ONNX) | sentence-transformers
+      "LOCAL_MODEL": os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"),
+      "LOCAL_BATCH_SIZE": 32,   # Texts per local model call
+      "LOCAL_BATCH_WAIT_MS": 5, # How long to wait for concurrent requests to fill a batch
+      "LOCAL_THREADS": None,    # Model calls in parallel; None = one per CPU core
+  }
+
+VECTOR_CONFIG = {
+      "DIM": int(os.getenv("VECTOR_DIM", 4096)),  # Dense embedding dimension, must match the embedding model (bge-small: 384)
+      "DTYPE": os.getenv("VECTOR_DTYPE", "FLOAT16_VECTOR"),  # FLOAT_VECTOR | FLOAT16_VECTOR | BFLOAT16_VECTOR
+  }
+
+DEDUP_CONFIG = {
+      "ENABLED": True,          # Link near-duplicate chunks to a canonical chunk instead of embedding/expanding them
+      "CROSS_CORPUS": True,     # Also match against chunks already stored (not only within the document)
+      "THRESHOLD": 0.85,        # Estimated Jaccard similarity of word 5-gram shingles to count as a duplicate
+      "NUM_PERM": 128,          # MinHash permutations
+      "SHINGLE_SIZE": 5,        # Words (or CJK characters) per shingle
+      "MIN_SHINGLES": 10,       # Shorter chunks are never deduplicated
+      "INDEX_PATH": os.getenv("DEDUP_INDEX_PATH", os.path.join("../../data", "cache", "minhash.sqlite")),
+  }
+
+EXPANSION_CONFIG = {
+      "ENABLED": os.getenv("EXPANSION_ENABLED", "false").lower() == "true",  # Embed chunks with LLM keywords + QA appended (document expansion)
+      "MODE": os.getenv("EXPANSION_MODE", "packed"),  # "packed" (CHUNK_CONFIG["BATCH_SIZE"] chunks per call) | "fused" (keywords + QA in one call per chunk) | "separate" | "batch" (OpenAI Batch API, offline)
+      "MAX_CONCURRENCY": 8,     # Expansion LLM calls in flight, shared by all sections of the process
+      "BATCH_RESULTS_PATH": os.getenv("EXPANSION_BATCH_RESULTS_PATH", os.path.join("../../data", "cache", "batch_expansions.jsonl")),  # Written by the offline batch pass, read by "batch" mode
+  }
+
+LLM_CACHE_CONFIG = {
+      "ENABLED": os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true",  # Persistent cache of chain LLM responses
+      "PATH": os.getenv("LLM_CACHE_PATH", os.path.join("../../data", "cache", "llm_responses.sqlite")),
+      "MAX_BYTES": 512 * 1024 ** 2,  # Least recently used responses are evicted beyond this
+  }
+
+RATE_LIMIT_CONFIG = {
+      "ENABLED": os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true",  # Client-side RPM/TPM + AIMD concurrency
+      "DEFAULT": {              # For models without a "rate_limit" entry; None = learned from x-ratelimit-* headers
+          "rpm": None,
+          "tpm": None,
+          "max_concurrency": 16,
+          "min_concurrency": 1,
+      },
   }
 
 # Model configurations for different tasks
 MODEL_CONFIGS: Dict[str, Dict[str, Any]] = {
+    ## "rate_limit": requests/tokens per minute of the key on LiteLLM (None = learned from its x-ratelimit-* headers)
+    ## and the AIMD concurrency bounds; tasks using the same model share one limiter
     "notes_extraction": {
         "class": ChatOpenAI,
         "kwargs": {
@@ -34,7 +116,8 @@ MODEL_CONFIGS: Dict[str, Dict[str, Any]] = {
             "model": "ollama/deepseek-r1:8b",
             "api_key": LITE_LLM_KEY,
             "base_url": LITE_LLM_BASE_URL,
-        }
+        },
+        "rate_limit": {"rpm": None, "tpm": None, "max_concurrency": 4, "min_concurrency": 1}
     },
     "table_analysis": {
         "class": ChatOpenAI,
@@ -46,7 +129,8 @@ MODEL_CONFIGS: Dict[str, Dict[str, Any]] = {
             "model": "ollama/deepseek-r1:8b",
             "api_key": LITE_LLM_KEY,
             "base_url": LITE_LLM_BASE_URL,
-        }
+        },
+        "rate_limit": {"rpm": None, "tpm": None, "max_concurrency": 4, "min_concurrency": 1}
     },
     "content_cleaning": {
         "class": ChatOpenAI,
@@ -58,7 +142,8 @@ MODEL_CONFIGS: Dict[str, Dict[str, Any]] = {
             "model": "openai/gpt-4.1-nano",
             "api_key": LITE_LLM_KEY,
             "base_url": LITE_LLM_BASE_URL,
-        }
+        },
+        "rate_limit": {"rpm": None, "tpm": None, "max_concurrency": 16, "min_concurrency": 1}
     },
     "Agents": {
         "class": ChatOpenAI,
@@ -70,12 +155,13 @@ MODEL_CONFIGS: Dict[str, Dict[str, Any]] = {
             "model": "openai/gpt-4.1-nano",
             "api_key": LITE_LLM_KEY,
             "base_url": LITE_LLM_BASE_URL,
-        }
+        },
+        "rate_limit": {"rpm": None, "tpm": None, "max_concurrency": 16, "min_concurrency": 1}
     },
     "batch_processing": {
         "model": "gpt-4.1-nano",  # OpenAI model for batch API (cost-effective)
         "api_key": os.getenv("OPENAI_API_KEY", LITE_LLM_KEY),  # Direct OpenAI API key
-        "base_url": None,  # Use direct OpenAI API for batch processing
+        "base_url": os.getenv("OPENAI_BATCH_BASE_URL", None),  # None = OpenAI API; or a stand-in (src.advance_rag.batch_expansion)
         "batch_size": 50,  # Number of requests per batch
         "completion_window": "24h",  # 24-hour processing window
         "poll_interval": 60  # Check status every 60 seconds
@@ -86,7 +172,14 @@ def get_llm_model(task: str):
     """Get the appropriate LLM model for a given task"""
     if task not in MODEL_CONFIGS:
         raise ValueError(f"Invalid task: {task}")
-    return MODEL_CONFIGS[task]["class"](**MODEL_CONFIGS[task]["kwargs"])
+    kwargs = dict(MODEL_CONFIGS[task]["kwargs"])
+    if RATE_LIMIT_CONFIG["ENABLED"]:
+        from src.utils.rate_limiter import rate_limited_http_clients
+
+        ## one limiter per model, shared by every task (and chain) using it
+        limits = MODEL_CONFIGS[task].get("rate_limit", RATE_LIMIT_CONFIG["DEFAULT"])
+        kwargs["http_client"], kwargs["http_async_client"] = rate_limited_http_clients(kwargs["model"], **limits)
+    return MODEL_CONFIGS[task]["class"](**kwargs)
 
 
 
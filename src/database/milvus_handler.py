@@ -6,24 +6,73 @@ Handles storage and retrieval of document chunks with embeddings.
 """
 
 import json
+import hashlib
 from typing import List, Dict, Any, Optional, Tuple
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
 import logging
 from datetime import datetime
+import numpy as np
 from pymilvus import MilvusClient, DataType, Function, FunctionType
 from pymilvus import AnnSearchRequest
 from pymilvus import RRFRanker
 
+from src.config import VECTOR_CONFIG
+
+try:
+    ## numpy dtype pymilvus recognises as a bfloat16 vector, for inserts as well as search requests
+    from ml_dtypes import bfloat16
+except ImportError:
+    bfloat16 = None
+
+VECTOR_DTYPES = {
+    "FLOAT_VECTOR": DataType.FLOAT_VECTOR,        # 4 bytes per dim
+    "FLOAT16_VECTOR": DataType.FLOAT16_VECTOR,    # 2 bytes per dim
+    "BFLOAT16_VECTOR": DataType.BFLOAT16_VECTOR,  # 2 bytes per dim, float32 exponent range
+}
+
+
+def to_storage_vector(vector, vector_dtype: str):
+    """Convert a float vector to the representation pymilvus expects for `vector_dtype`"""
+    if vector_dtype == "FLOAT16_VECTOR":
+        return np.asarray(vector, dtype=np.float16)
+    if vector_dtype == "BFLOAT16_VECTOR":
+        ## raw bytes would be sent as a binary vector in search requests, so use a typed array
+        if bfloat16 is None:
+            raise ImportError("BFLOAT16_VECTOR needs the ml_dtypes package (pip install ml-dtypes)")
+        return np.asarray(vector, dtype=np.float32).astype(bfloat16)
+    return vector
+
+
+def from_storage_vector(vector, vector_dtype: str) -> np.ndarray:
+    """Inverse of `to_storage_vector`: float32 array from a vector returned by Milvus"""
+    if isinstance(vector, list) and len(vector) == 1 and isinstance(vector[0], bytes):
+        vector = vector[0]
+    if bfloat16 is not None and isinstance(vector, np.ndarray) and vector.dtype == bfloat16:
+        return vector.astype(np.float32)
+    if isinstance(vector, bytes):
+        if vector_dtype == "BFLOAT16_VECTOR":
+            return (np.frombuffer(vector, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+        return np.frombuffer(vector, dtype=np.float16).astype(np.float32)
+    return np.asarray(vector, dtype=np.float32)
+
 class MilvusHandler:
     """Milvus vector database client for annual report content"""
 
-    def __init__(self, host: str, port: str = "19530", db_name: str = "default", password: str = None, collection_name: str='annual_report_0821'):
+    def __init__(self, host: str, port: str = "19530", db_name: str = "default", password: str = None, collection_name: str='annual_report_0821',
+                 vector_dtype: str = VECTOR_CONFIG["DTYPE"]):
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Invalid vector dtype: {vector_dtype}, expected one of {list(VECTOR_DTYPES)}")
+        if vector_dtype == "BFLOAT16_VECTOR" and bfloat16 is None:
+            raise ImportError("BFLOAT16_VECTOR needs the ml_dtypes package (pip install ml-dtypes)")
         self.host = host
         self.port = port
         self.db_name = db_name
         self.password = password
         self.collection_name = collection_name # Changed from documents_chunks
         self.collection = None
+        self.vector_dtype = vector_dtype # storage precision of dense_embedding, callers always pass float vectors
+        self._collection_dtype = None # dense_embedding dtype of `collection_name`, read from its schema once
+        self.row_fields = None # fields of the collection, so rows can be fitted to collections created before a field existed
 
         self.client = MilvusClient(uri=self.host, token=f"root:{self.password}", db_name=self.db_name)
         # Configure logging
@@ -37,9 +86,25 @@ class MilvusHandler:
             if self.client.has_collection(self.collection_name):
                 # self.collection = Collection(self.collection_name)
                 self.logger.info(f"📚 Using existing collection: {self.collection_name}")
+                if not self._collection_has_chunk_ids(self.collection_name):
+                    ## make_chunk_id ids cannot be written to (or looked up in) the original INT64 auto_id key
+                    raise ValueError(f"{self.collection_name} is keyed by the original INT64 auto_id; copy it with "
+                                     f"migrate_collection() and point collection_name at the copy before ingesting")
+                existing_dtype = self._collection_vector_dtype(self.collection_name)
+                if existing_dtype != self.vector_dtype:
+                    ## keep writing in the collection's own format until it is migrated
+                    self.logger.warning(f"⚠️ {self.collection_name} stores {existing_dtype}, not {self.vector_dtype}; "
+                                        f"use migrate_collection() to convert it")
+                    self.vector_dtype = existing_dtype
+                self._collection_dtype = existing_dtype
+                self.row_fields = self._collection_field_names(self.collection_name)
+                if "heading_path" not in self.row_fields:
+                    self.logger.warning(f"⚠️ {self.collection_name} has no heading_path field; heading paths are not "
+                                        f"stored until it is migrated (migrate_collection)")
             else:
                 # Create new collection
                 self._create_collection()
+                self._collection_dtype = self.vector_dtype
 
             # Load collection into memory
             # self.collection.load()
@@ -49,8 +114,10 @@ class MilvusHandler:
             self.logger.error(f"❌ Failed to initialize collection: {e}")
             raise
 
-    def _create_collection(self):
+    def _create_collection(self, collection_name: str = None, vector_dtype: str = None):
         """Create the annual report collection"""
+        collection_name = collection_name or self.collection_name
+        vector_dtype = vector_dtype or self.vector_dtype
         schema = self.client.create_schema()
 
         # schema.add_field(field_name="chunk_id", datatype=DataType.INT64, is_primary=True, auto_id=True)
@@ -67,7 +134,8 @@ class MilvusHandler:
         # schema.add_field(field_name="created_at", datatype=DataType.VARCHAR, max_length=50)
         # schema.add_field(field_name="sparse_embedding", datatype=DataType.SPARSE_FLOAT_VECTOR)
 
-        schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True, auto_id=True)
+        ## primary key derived from doc_id/session_name/chunk_index, see make_chunk_id
+        schema.add_field(field_name="id", datatype=DataType.VARCHAR, max_length=64, is_primary=True, auto_id=False)
         schema.add_field(field_name="session_name", datatype=DataType.VARCHAR, max_length=100)
         schema.add_field(field_name="company", datatype=DataType.VARCHAR, max_length=100)
         schema.add_field(field_name="date", datatype=DataType.VARCHAR, max_length=10)
@@ -77,9 +145,11 @@ class MilvusHandler:
         # schema.add_field(field_name="item_type", datatype=DataType.VARCHAR, max_length=50)
         # schema.add_field(field_name="item_title", datatype=DataType.VARCHAR, max_length=200)
         schema.add_field(field_name="content", datatype=DataType.VARCHAR, max_length=10000, enable_analyzer=True) ## Chinese character required more bytes to store
+        schema.add_field(field_name="heading_path", datatype=DataType.VARCHAR, max_length=1000) ## "Report > Section > Subsection" of the chunk
+        schema.add_field(field_name="canonical_id", datatype=DataType.VARCHAR, max_length=64) ## near-duplicate of this chunk, "" if none
         schema.add_field(field_name="chunk_index", datatype=DataType.INT64)
         schema.add_field(field_name="chunk_length", datatype=DataType.INT64)
-        schema.add_field(field_name="dense_embedding", datatype=DataType.FLOAT_VECTOR, dim=4096)  # Updated to 4096
+        schema.add_field(field_name="dense_embedding", datatype=VECTOR_DTYPES[vector_dtype], dim=VECTOR_CONFIG["DIM"])
         # schema.add_field(field_name="metadata", datatype=DataType.VARCHAR, max_length=1000)
         schema.add_field(field_name="created_at", datatype=DataType.VARCHAR, max_length=50)
         schema.add_field(field_name="sparse_embedding", datatype=DataType.SPARSE_FLOAT_VECTOR)
@@ -95,7 +165,7 @@ class MilvusHandler:
         index_params = self.client.prepare_index_params()
 
         index_params.add_index(
-            field_name="embedding",
+            field_name="dense_embedding",
             index_name="text_dense_index",
             index_type="IVF_FLAT",
             metric_type="COSINE"
@@ -110,10 +180,91 @@ class MilvusHandler:
         )
 
         self.client.create_collection(
-            collection_name=self.collection_name,
+            collection_name=collection_name,
             schema=schema,
             index_params=index_params
         )
+        self.logger.info(f"🆕 Created collection {collection_name} ({vector_dtype})")
+
+    def _collection_vector_dtype(self, collection_name: str) -> str:
+        fields = self.client.describe_collection(collection_name)["fields"]
+        dense_type = next(field["type"] for field in fields if field["name"] == "dense_embedding")
+        return next((name for name, dtype in VECTOR_DTYPES.items() if dtype == dense_type), "FLOAT_VECTOR")
+
+    def _storage_dtype(self) -> str:
+        """
+        dense_embedding dtype of the collection, also without `_initialize_collection`: read lazily and cached,
+        the configured dtype while the collection does not exist
+        """
+        if self._collection_dtype is None:
+            if not self.client.has_collection(self.collection_name):
+                return self.vector_dtype
+            self._collection_dtype = self._collection_vector_dtype(self.collection_name)
+        return self._collection_dtype
+
+    def _collection_field_names(self, collection_name: str) -> List[str]:
+        return [field["name"] for field in self.client.describe_collection(collection_name)["fields"]]
+
+    def _collection_has_chunk_ids(self, collection_name: str) -> bool:
+        """True when the primary key holds `make_chunk_id` ids, False for the original INT64 auto_id key"""
+        fields = self.client.describe_collection(collection_name)["fields"]
+        primary = next(field for field in fields if field.get("is_primary"))
+        return primary["type"] == DataType.VARCHAR
+
+    def _to_storage_rows(self, chunks: List[Dict[str, Any]], vector_dtype: str = None,
+                         row_fields: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Copies of `chunks` with dense_embedding converted to the collection's vector dtype; with `row_fields`,
+        keys the collection lacks are dropped and a missing heading_path/canonical_id is stored empty
+        """
+        vector_dtype = vector_dtype or self._storage_dtype()
+        row_fields = row_fields or self.row_fields
+        rows = chunks
+        if vector_dtype != "FLOAT_VECTOR":
+            rows = [{**chunk, "dense_embedding": to_storage_vector(chunk["dense_embedding"], vector_dtype)}
+                    for chunk in rows]
+        if row_fields is not None:
+            defaults = {field: "" for field in ("heading_path", "canonical_id") if field in row_fields}
+            rows = [{**defaults, **{key: value for key, value in row.items() if key in row_fields}} for row in rows]
+        return rows
+
+    def migrate_collection(self, target_collection_name: str, vector_dtype: str = None, batch_size: int = 500) -> int:
+        """
+        Copy the current collection into a new collection stored as `vector_dtype` (default: this handler's),
+        with the current schema (fields added since, like heading_path, start empty).
+        The sparse BM25 field is regenerated by the target's function. Collections keyed by the original INT64
+        auto_id get `make_chunk_id` ids, and rows of a section ingested more than once collapse into one.
+        Point `collection_name` at the target (or drop the source and rename the target) once the copy is verified.
+        """
+        vector_dtype = vector_dtype or self.vector_dtype
+        source_dtype = self._collection_vector_dtype(self.collection_name)
+        regenerate_ids = not self._collection_has_chunk_ids(self.collection_name)
+        output_fields = [field["name"] for field in self.client.describe_collection(self.collection_name)["fields"]
+                         if field["name"] != "sparse_embedding"]
+
+        if not self.client.has_collection(target_collection_name):
+            self._create_collection(collection_name=target_collection_name, vector_dtype=vector_dtype)
+
+        target_fields = self._collection_field_names(target_collection_name)
+        iterator = self.client.query_iterator(collection_name=self.collection_name, batch_size=batch_size,
+                                              filter="", output_fields=output_fields)
+        copied = 0
+        try:
+            while rows := iterator.next():
+                for row in rows:
+                    row["dense_embedding"] = from_storage_vector(row["dense_embedding"], source_dtype)
+                    if regenerate_ids:
+                        row["id"] = self.make_chunk_id(row["doc_id"], row["session_name"], row["chunk_index"])
+                ## upsert: regenerated ids of duplicated ingestions overwrite each other instead of piling up
+                self.client.upsert(collection_name=target_collection_name,
+                                   data=self._to_storage_rows(rows, vector_dtype, target_fields))
+                copied += len(rows)
+                self.logger.info(f"   🔁 Migrated {copied} chunks to {target_collection_name}")
+        finally:
+            iterator.close()
+        self.logger.info(f"✅ Migrated {copied} chunks from {self.collection_name} ({source_dtype}) "
+                         f"to {target_collection_name} ({vector_dtype})")
+        return copied
 
     def store_chunks(self, chunks: List[Dict[str, Any]]) -> int:
         """Store document chunks in Milvus with enhanced metadata"""
@@ -123,10 +274,7 @@ class MilvusHandler:
             return 0
 
         try:
-            try:
-                self.client.insert(collection_name=self.collection_name, data=chunks)
-            except Exception as e:
-                print(e)
+            self.client.insert(collection_name=self.collection_name, data=self._to_storage_rows(chunks))
             inserted_count = len(chunks)
             self.logger.info(f"✅ Inserted {inserted_count} chunks into Milvus")
             return inserted_count
@@ -135,6 +283,54 @@ class MilvusHandler:
             self.logger.error(f"❌ Failed to insert chunks: {e}")
             raise
 
+    @staticmethod
+    def make_chunk_id(doc_id: str, session_name: str, chunk_index: int) -> str:
+        """Deterministic primary key, so re-ingesting a section overwrites its chunks instead of duplicating them"""
+        return hashlib.sha256(f"{doc_id}|{session_name}|{chunk_index}".encode("utf-8")).hexdigest()
+
+    def get_dense_vectors(self, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        """{id: float32 vector} for the chunks of `chunk_ids` that are in the collection"""
+        if not chunk_ids:
+            return {}
+        vector_dtype = self._storage_dtype()
+        rows = self.client.get(collection_name=self.collection_name, ids=list(chunk_ids),
+                               output_fields=["dense_embedding"])
+        return {row["id"]: from_storage_vector(row["dense_embedding"], vector_dtype) for row in rows}
+
+    def delete_sections(self, doc_id: str, session_names: List[str]) -> None:
+        """Delete every chunk of the given sections of a document"""
+        if not session_names:
+            return
+        names = ", ".join(json.dumps(name, ensure_ascii=False) for name in session_names)
+        self.client.delete(collection_name=self.collection_name,
+                           filter=f'doc_id == {json.dumps(doc_id, ensure_ascii=False)} and session_name in [{names}]')
+        self.logger.info(f"🗑️ Deleted chunks of {len(session_names)} sections of {doc_id}")
+
+    def replace_chunks(self, chunks: List[Dict[str, Any]]) -> int:
+        """
+        Idempotent insert: the sections present in `chunks` are deleted first, then re-inserted,
+        so stale chunks of a section that shrank do not survive.
+        """
+        if not chunks:
+            self.logger.warning("No chunks to store")
+            return 0
+
+        sections: Dict[str, List[str]] = {}
+        for chunk in chunks:
+            doc_sections = sections.setdefault(chunk["doc_id"], [])
+            if chunk["session_name"] not in doc_sections:
+                doc_sections.append(chunk["session_name"])
+
+        try:
+            for doc_id, session_names in sections.items():
+                self.delete_sections(doc_id, session_names)
+            self.client.insert(collection_name=self.collection_name, data=self._to_storage_rows(chunks))
+            self.logger.info(f"✅ Replaced {len(chunks)} chunks in Milvus")
+            return len(chunks)
+        except Exception as e:
+            self.logger.error(f"❌ Failed to replace chunks: {e}")
+            raise
+
     def hybrid_search_similar_chunks(self,
                                      query_embedding: List[float],
                                      query_text: str,
@@ -173,8 +369,8 @@ class MilvusHandler:
             }
 
             search_param_1 = {
-                "data": [query_embedding],
-                "anns_field": "embedding",
+                "data": [to_storage_vector(query_embedding, self._storage_dtype())],
+                "anns_field": "dense_embedding",
                 "param": {"nprobe": 10},
                 "limit": top_k,
                 "expr": final_filter,
@@ -12,6 +12,21 @@ class ExpandQA(BaseModel):
 
     qa_session: List[str] = Field(..., description="QA session base on chunk text")
 
+class ExpandKeywordsQA(BaseModel):
+
+    keywords: str = Field(..., description="Keywords extracted from chunk text")
+    qa_session: List[str] = Field(..., description="QA session base on chunk text")
+
+class PackedChunkExpansion(BaseModel):
+
+    chunk_index: int = Field(..., description="Index of the chunk, as given in its <Chunk> tag")
+    keywords: str = Field(..., description="Keywords extracted from chunk text")
+    qa_session: List[str] = Field(..., description="QA session base on chunk text")
+
+class ExpandPackedKeywordsQA(BaseModel):
+
+    expansions: List[PackedChunkExpansion] = Field(..., description="One entry per input chunk")
+
 class RewriteQuery(BaseModel):
 
     prompt: str = Field(..., description="Rewritten Prompt")
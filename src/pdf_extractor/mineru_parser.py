@@ -5,11 +5,14 @@ This script directly from MinerU: https://github.com/opendatalab/MinerU/blob/mas
 """
 
 import copy
+import io
 import json
 import os
+from collections.abc import Iterator
 from pathlib import Path
 
 from loguru import logger
+import pypdfium2 as pdfium
 
 from mineru.cli.common import convert_pdf_bytes_to_bytes_by_pypdfium2, prepare_env, read_fn
 from mineru.data.data_reader_writer import FileBasedDataWriter
@@ -22,10 +25,233 @@ from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_j
 from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
 from mineru.utils.models_download_utils import auto_download_and_get_model_root_path
 
+from src.pdf_extractor.parse_cache import ParseCache, get_parse_cache
+from src.pdf_extractor.parse_worker import WORKER_ERRORS, ParseWorkerClient, get_worker_address
+from src.pdf_extractor.text_layer import HEADING_DETECTION, route_pages
+
+
+def get_page_count(pdf_bytes: bytes) -> int:
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def extract_pages_bytes(pdf_bytes: bytes, page_ids: list[int]) -> bytes:
+    """New PDF holding only `page_ids` (not necessarily contiguous) of the source PDF"""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    output_pdf = pdfium.PdfDocument.new()
+    try:
+        output_pdf.import_pages(pdf, list(page_ids))
+        output_buffer = io.BytesIO()
+        output_pdf.save(output_buffer)
+        return output_buffer.getvalue()
+    finally:
+        output_pdf.close()
+        pdf.close()
+
+
+def resolve_page_range(page_count: int, start_page_id=0, end_page_id=None) -> tuple[int, int]:
+    """Clamp a (start, end) page request to the document, end inclusive as in MinerU"""
+    start_page_id = max(start_page_id or 0, 0)
+    if end_page_id is None or end_page_id < 0 or end_page_id > page_count - 1:
+        end_page_id = page_count - 1
+    return start_page_id, end_page_id
+
+
+def pipeline_analyze_pages(
+    pdf_bytes_list: list[bytes],
+    p_lang_list: list[str],
+    image_writer_list: list,
+    image_dir_list: list[str],
+    parse_method="auto",
+    formula_enable=False,
+    table_enable=False,
+    f_make_md_mode=MakeMode.MM_MD,
+) -> list[list[dict]]:
+    """
+    Run the pipeline backend once over all PDFs and return, for each PDF, one record per page
+    (in page order, page index relative to the bytes that were passed in).
+    """
+    infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(
+        pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=formula_enable, table_enable=table_enable)
+
+    all_page_records = []
+    for idx, model_list in enumerate(infer_results):
+        middle_json = pipeline_result_to_middle_json(model_list, all_image_lists[idx], all_pdf_docs[idx],
+                                                     image_writer_list[idx], lang_list[idx], ocr_enabled_list[idx],
+                                                     formula_enable)
+        ## union_make joins pages with a blank line, so per-page output stitches back to the same markdown;
+        ## the content list keeps the block structure (titles with their level, text, tables) for chunking
+        page_records = [{"md": pipeline_union_make([page_info], f_make_md_mode, image_dir_list[idx]),
+                         "content_list": pipeline_union_make([page_info], MakeMode.CONTENT_LIST, image_dir_list[idx])}
+                        for page_info in middle_json["pdf_info"]]
+        all_page_records.append(page_records)
+    return all_page_records
+
+
+def stitch_markdown(page_records: list[dict]) -> str:
+    return "\n\n".join(record["md"] for record in page_records if record["md"])
+
+
+def slice_pages(pages: list[dict], start_page_id=0, end_page_id=None) -> str:
+    """Markdown of pages[start_page_id..end_page_id] (inclusive) from a `parse_doc_pages` result, image lines dropped"""
+    return "".join(iter_slice_pages(pages, start_page_id, end_page_id))
+
+
+def iter_slice_pages(pages: list[dict], start_page_id=0, end_page_id=None) -> Iterator[str]:
+    """`slice_pages` as a stream of one piece per page, so a section is never held as a single string"""
+    start_page_id, end_page_id = resolve_page_range(len(pages), start_page_id, end_page_id)
+    first_page = first_line = True
+    for page in pages:
+        if not (start_page_id <= page["page_idx"] <= end_page_id) or not page["md"]:
+            continue
+        ## pages are stitched with a blank line, see `stitch_markdown`
+        lines = ([] if first_page else [""]) + page["md"].split('\n')
+        first_page = False
+        lines = [line for line in lines if '.jpg' not in line]
+        if lines:
+            yield ("" if first_line else "\n") + '\n'.join(lines)
+            first_line = False
+
+
+def slice_blocks(pages: list[dict], start_page_id=0, end_page_id=None) -> list[dict] | None:
+    """
+    MinerU content-list blocks of pages[start_page_id..end_page_id] (inclusive), tagged with their absolute
+    page index; None if any of those pages was parsed without a content list.
+    """
+    start_page_id, end_page_id = resolve_page_range(len(pages), start_page_id, end_page_id)
+    blocks = []
+    for page in pages:
+        if start_page_id <= page["page_idx"] <= end_page_id:
+            if "content_list" not in page:
+                return None
+            blocks.extend({**block, "page_idx": page["page_idx"]} for block in page["content_list"])
+    return blocks
+
+
+def analyze_page_spans(
+        span_list: list[dict],
+        method="auto",
+        formula_enable=False,
+        table_enable=False,
+        use_worker=True,
+) -> list[dict[int, dict]]:
+    """
+    Analyse several page spans in one batched pipeline call. Each span is a dict with
+    `pdf_bytes`, `page_count`, `page_ids` (sorted absolute page indices), `lang` and `local_image_dir`
+    (None to skip cropping and writing images); returns, per span, absolute page index -> page record.
+    If a parse worker is configured (MINERU_PARSE_WORKER), the job runs there on warm models.
+    """
+    worker_address = get_worker_address() if use_worker else None
+    if worker_address is not None:
+        try:
+            return ParseWorkerClient(worker_address).analyze_page_spans(
+                span_list, method=method, formula_enable=formula_enable, table_enable=table_enable)
+        except WORKER_ERRORS as e:
+            logger.warning(f"Parse worker at {worker_address} failed ({e!r}), parsing in-process")
+
+    span_bytes_list = []
+    for span in span_list:
+        if len(span["page_ids"]) == span["page_count"]:
+            span_bytes_list.append(span["pdf_bytes"])  ## whole document, no need to copy the pages into a new PDF
+        else:
+            span_bytes_list.append(extract_pages_bytes(span["pdf_bytes"], span["page_ids"]))
+
+    all_page_records = pipeline_analyze_pages(
+        span_bytes_list, [span["lang"] for span in span_list],
+        image_writer_list=[FileBasedDataWriter(span["local_image_dir"]) if span["local_image_dir"] else None
+                           for span in span_list],
+        image_dir_list=[str(os.path.basename(span["local_image_dir"] or "")) for span in span_list],
+        parse_method=method,
+        formula_enable=formula_enable,
+        table_enable=table_enable,
+    )
+    return [{span["page_ids"][i]: {**record, "source": "pipeline"} for i, record in enumerate(page_records)}
+            for span, page_records in zip(span_list, all_page_records)]
+
+
+def parse_pdfs_pages(
+        pdf_bytes_list: list[bytes],
+        file_name_list: list[str],
+        lang_list: list[str],
+        output_dir,
+        method="auto",
+        formula_enable=False,
+        table_enable=False,
+        start_page_id=0,
+        end_page_id=None,
+        cache_dir=None,
+        write_artifacts=True,
+        text_layer_fast_path=False
+) -> list[list[dict]]:
+    """
+    Per-page markdown for several PDFs. Every PDF that still has pages to parse goes into the same
+    `pipeline_doc_analyze` call, so pages are batched across documents. Returns, per PDF,
+    `[{"page_idx": i, "md": "..."}, ...]` for pages start_page_id..end_page_id.
+    With write_artifacts=False everything stays in memory: no output folders, and images are
+    neither cropped, encoded nor written.
+    With text_layer_fast_path=True, pages with a clean text layer are read directly and only the
+    remaining pages (scans, image/table-heavy pages, garbled encodings) go through the pipeline.
+    """
+    cache = get_parse_cache(cache_dir) if cache_dir is not None else None
+
+    doc_states = []
+    span_list = []
+    for pdf_bytes, file_name, lang in zip(pdf_bytes_list, file_name_list, lang_list):
+        page_count = get_page_count(pdf_bytes)
+        start, end = resolve_page_range(page_count, start_page_id, end_page_id)
+        local_image_dir = prepare_env(output_dir, file_name, method)[0] if write_artifacts else None
+        state = {"start": start, "end": end, "span": None, "cache_key": None}
+
+        missing = list(range(start, end + 1))
+        if cache is not None:
+            state["cache_key"] = ParseCache.make_key(pdf_bytes, lang, method, formula_enable, table_enable,
+                                                     text_layer_fast_path=text_layer_fast_path)
+            missing = cache.missing(state["cache_key"], missing, fields=("md", "content_list"))
+            if text_layer_fast_path:
+                ## text-layer pages cached before heading detection are read again (cheap, no pipeline run)
+                stale = [i for i, record in cache.get_pages(state["cache_key"], range(start, end + 1)).items()
+                         if record.get("source") == "text_layer"
+                         and record.get("heading_detection") != HEADING_DETECTION]
+                missing = sorted(set(missing) | set(stale))
+        if not missing:
+            logger.info(f"Pages {start}-{end} of {file_name} served from parse cache")
+
+        state["text_pages"] = {}
+        if missing and text_layer_fast_path:
+            state["text_pages"], missing = route_pages(pdf_bytes, missing, file_name)
+            logger.info(f"{file_name}: {len(state['text_pages'])} pages from text layer, {len(missing)} need the pipeline")
+        if missing:
+            logger.info(f"Parsing {len(missing)} pages of {file_name} between {min(missing)} and {max(missing)}")
+            state["span"] = len(span_list)
+            span_list.append({"pdf_bytes": pdf_bytes, "page_count": page_count, "page_ids": missing,
+                              "lang": lang, "local_image_dir": local_image_dir})
+        doc_states.append(state)
+
+    span_results = analyze_page_spans(span_list, method=method, formula_enable=formula_enable,
+                                      table_enable=table_enable) if span_list else []
+
+    all_pages = []
+    for state in doc_states:
+        page_ids = range(state["start"], state["end"] + 1)
+        new_records = dict(state["text_pages"])
+        if state["span"] is not None:
+            new_records.update(span_results[state["span"]])
+        if cache is not None:
+            if new_records:
+                cache.put_pages(state["cache_key"], new_records)
+            page_records = cache.get_pages(state["cache_key"], page_ids)
+        else:
+            page_records = new_records
+        all_pages.append([{"page_idx": i, **page_records[i]} for i in page_ids])
+    return all_pages
+
 
 def do_parse(
     output_dir,  # Output directory for storing parsing results
-    pdf_file_names: str,  # List of PDF file names to be parsed
+    pdf_file_names: str | list[str],  # PDF file name, or list of file names (one per entry of pdf_bytes_list)
     pdf_bytes_list: list[bytes],  # List of PDF bytes to be parsed
     p_lang_list: list[str],  # List of languages for each PDF, default is 'ch' (Chinese)
     backend="pipeline",  # The backend for parsing PDF, default is 'pipeline'
@@ -47,77 +273,34 @@ def do_parse(
 ):
 
     if backend == "pipeline":
-        # for idx, pdf_bytes in enumerate(pdf_bytes_list):
-        #     new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-        #     pdf_bytes_list[idx] = new_pdf_bytes
+        single_pdf = isinstance(pdf_file_names, str)
+        file_name_list = [pdf_file_names] if single_pdf else list(pdf_file_names)
 
-        infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=formula_enable,table_enable=table_enable)
-        ## assuming only one pdf
-        ## IMPORTANT
-        ## Todo: may change later
+        env_list = [prepare_env(output_dir, pdf_file_name, parse_method) for pdf_file_name in file_name_list]
+        all_page_records = pipeline_analyze_pages(
+            pdf_bytes_list, p_lang_list,
+            image_writer_list=[FileBasedDataWriter(local_image_dir) for local_image_dir, _ in env_list],
+            image_dir_list=[str(os.path.basename(local_image_dir)) for local_image_dir, _ in env_list],
+            parse_method=parse_method,
+            formula_enable=formula_enable,
+            table_enable=table_enable,
+            f_make_md_mode=f_make_md_mode,
+        )
 
         md_content_str_list = []
+        for idx, page_records in enumerate(all_page_records):
+            pdf_file_name = file_name_list[idx]
+            _, local_md_dir = env_list[idx]
+            md_content_str = stitch_markdown(page_records)
+            if f_dump_md:
+                FileBasedDataWriter(local_md_dir).write_string(
+                    f"{pdf_file_name}_{md_name}.md",
+                    md_content_str,
+                )
+                logger.info(f"local output dir is {local_md_dir}")
+            md_content_str_list.append(md_content_str)
 
-        # for idx, model_list in enumerate(infer_results):
-        idx = 0
-        model_list = infer_results[idx]
-        model_json = copy.deepcopy(infer_results[idx])
-        pdf_file_name = pdf_file_names
-        local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-        image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-
-        images_list = all_image_lists[idx]
-        pdf_doc = all_pdf_docs[idx]
-        _lang = lang_list[idx]
-        _ocr_enable = ocr_enabled_list[idx]
-        middle_json = pipeline_result_to_middle_json(model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, formula_enable)
-
-        pdf_info = middle_json["pdf_info"]
-
-        pdf_bytes = pdf_bytes_list[idx]
-        # if f_draw_layout_bbox:
-        #     draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
-        #
-        # if f_draw_span_bbox:
-        #     draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
-
-        # if f_dump_orig_pdf:
-        #     md_writer.write(
-        #         f"{pdf_file_name}_origin.pdf",
-        #         pdf_bytes,
-        #     )
-
-        if f_dump_md:
-            image_dir = str(os.path.basename(local_image_dir))
-            md_content_str = pipeline_union_make(pdf_info, f_make_md_mode, image_dir)
-            md_writer.write_string(
-                f"{pdf_file_name}_{md_name}.md",
-                md_content_str,
-            )
-            # temp_dict = {f'{pdf_file_name}_{md_name}': md_content_str}
-            # md_content_str_list.append(temp_dict)
-            # if f_dump_content_list:
-            #     image_dir = str(os.path.basename(local_image_dir))
-            #     content_list = pipeline_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-            #     md_writer.write_string(
-            #         f"{pdf_file_name}_content_list.json",
-            #         json.dumps(content_list, ensure_ascii=False, indent=4),
-            #     )
-            #
-            # if f_dump_middle_json:
-            #     md_writer.write_string(
-            #         f"{pdf_file_name}_middle.json",
-            #         json.dumps(middle_json, ensure_ascii=False, indent=4),
-            #     )
-            #
-            # if f_dump_model_output:
-            #     md_writer.write_string(
-            #         f"{pdf_file_name}_model.json",
-            #         json.dumps(model_json, ensure_ascii=False, indent=4),
-            #     )
-
-            logger.info(f"local output dir is {local_md_dir}")
-        return md_content_str
+        return md_content_str_list[0] if single_pdf else md_content_str_list
     # else:
     #     if backend.startswith("vlm-"):
     #         backend = backend[4:]
@@ -177,6 +360,33 @@ def do_parse(
     #         logger.info(f"local output dir is {local_md_dir}")
 
 
+def parse_doc_pages(
+        pdf_bytes: bytes,
+        output_dir,
+        file_name,
+        lang="en",
+        method="auto",
+        formula_enable=False,
+        table_enable=False,
+        cache_dir=None,
+        write_artifacts=True,
+        text_layer_fast_path=False
+) -> list[dict]:
+    """
+    Analyse the whole PDF in a single pipeline pass and return its markdown page by page:
+    `[{"page_idx": 0, "md": "..."}, ...]`, ordered, with 0-based page indices (same numbering as
+    `start_page_id`/`end_page_id`). Any page range can then be resolved in memory with `slice_pages`.
+    With `cache_dir`, previously parsed pages are reused and only the missing span is analysed.
+    With write_artifacts=False nothing is written to output_dir and images are skipped.
+    With text_layer_fast_path=True, born-digital pages are read from the text layer (see `parse_pdfs_pages`).
+    """
+    pages = parse_pdfs_pages([pdf_bytes], [file_name], [lang], output_dir, method=method,
+                             formula_enable=formula_enable, table_enable=table_enable, cache_dir=cache_dir,
+                             write_artifacts=write_artifacts, text_layer_fast_path=text_layer_fast_path)[0]
+    logger.info(f"Parsed {file_name}: {len(pages)} pages")
+    return pages
+
+
 def parse_doc(
         pdf_bytes: bytes,
         output_dir,
@@ -187,7 +397,10 @@ def parse_doc(
         server_url=None,
         start_page_id=0,
         end_page_id=None,
-        md_name=None
+        md_name=None,
+        cache_dir=None,
+        write_artifacts=True,
+        text_layer_fast_path=False
 ):
     """
         Parameter description:
@@ -211,8 +424,25 @@ def parse_doc(
         server_url: When the backend is `sglang-client`, you need to specify the server_url, for example:`http://127.0.0.1:30000`
         start_page_id: Start page ID for parsing, default is 0
         end_page_id: End page ID for parsing, default is None (parse all pages until the end of the document)
+        cache_dir: Directory of the page-level parse cache. When set (pipeline backend only), pages that were
+            already parsed with the same settings are reused instead of being analysed again.
+        write_artifacts: When False (pipeline backend only), parse in memory: no markdown/image files are written
+            and images are not cropped or encoded. Use it when only the text is needed.
+        text_layer_fast_path: When True (pipeline backend only), pages with a clean text layer are read directly
+            and only the other pages go through the layout/OCR models.
     """
     try:
+        if backend == "pipeline" and (cache_dir is not None or not write_artifacts or text_layer_fast_path):
+            ## only pages missing from the cache are analysed, the rest is stitched from cached per-page markdown
+            pages = parse_pdfs_pages([pdf_bytes], [file_name], [lang], output_dir, method=method,
+                                     start_page_id=start_page_id, end_page_id=end_page_id, cache_dir=cache_dir,
+                                     write_artifacts=write_artifacts, text_layer_fast_path=text_layer_fast_path)[0]
+            md_content_str = stitch_markdown(pages)
+            if write_artifacts:
+                _, local_md_dir = prepare_env(output_dir, file_name, method)
+                FileBasedDataWriter(local_md_dir).write_string(f"{file_name}_{md_name}.md", md_content_str)
+            return '\n'.join([i for i in md_content_str.split('\n') if '.jpg' not in i])
+
         # file_name_list = []
         # pdf_bytes_list = []
         # lang_list = []
@@ -250,43 +480,47 @@ def parse_doc(
 def parse_multi_docs(
         path_list: list[Path],
         output_dir,
-        lang="en",
+        lang: str | list[str] = "en",
         backend="pipeline",
         method="auto",
         server_url=None,
         start_page_id=0,
         end_page_id=None,
-        md_name=None):
+        md_name=None,
+        cache_dir=None,
+        text_layer_fast_path=False) -> list[dict]:
+    """
+    Parse several documents in one batched pipeline run. Only the pipeline backend batches documents;
+    any other backend raises ValueError.
+
+    lang: one language for every document, or one per entry of path_list.
+    Returns one dict per document, in input order:
+        {"file_name": ..., "pages": [{"page_idx": i, "md": "..."}, ...]}
+    When md_name is given, the stitched markdown of each document is also written to
+    <output_dir>/<file_name>/<method>/<file_name>_<md_name>.md
+    """
+    if backend != "pipeline":
+        raise ValueError(f"Batched parsing is only supported by the pipeline backend, got {backend}")
+
     try:
+        lang_list = [lang] * len(path_list) if isinstance(lang, str) else list(lang)
         file_name_list = []
         pdf_bytes_list = []
-        lang_list = []
         for path in path_list:
-            file_name = str(Path(path).stem)
-            pdf_bytes = read_fn(path)
-            file_name_list.append(file_name)
-            pdf_bytes_list.append(pdf_bytes)
-            lang_list.append(lang)
+            file_name_list.append(str(Path(path).stem))
+            pdf_bytes_list.append(read_fn(path))
 
-        # parse_doc(pdf_bytes_list[0], )
-        # for idx, pdf_bytes in enumerate(pdf_bytes_list):
-        #     new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-        #     pdf_bytes_list[idx] = new_pdf_bytes
-        #     lang_list = [lang_list[idx]]
-        #
-        #     md_content_str = do_parse(
-        #         output_dir=output_dir,
-        #         pdf_file_names=file_name_list[idx],
-        #         pdf_bytes_list=pdf_bytes_list,
-        #         p_lang_list=lang_list,
-        #         backend=backend,
-        #         parse_method=method,
-        #         server_url=server_url,
-        #         start_page_id=start_page_id,
-        #         end_page_id=end_page_id,
-        #         md_name=md_name
-        #     )
-        # return md_content_str
+        all_pages = parse_pdfs_pages(pdf_bytes_list, file_name_list, lang_list, output_dir, method=method,
+                                     start_page_id=start_page_id, end_page_id=end_page_id, cache_dir=cache_dir,
+                                     text_layer_fast_path=text_layer_fast_path)
+
+        results = []
+        for file_name, pages in zip(file_name_list, all_pages):
+            if md_name is not None:
+                _, local_md_dir = prepare_env(output_dir, file_name, method)
+                FileBasedDataWriter(local_md_dir).write_string(f"{file_name}_{md_name}.md", stitch_markdown(pages))
+            results.append({"file_name": file_name, "pages": pages})
+        return results
     except Exception as e:
         logger.exception(e)
 
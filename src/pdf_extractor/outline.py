@@ -0,0 +1,122 @@
+"""
+Section detection from the PDF outline (bookmarks).
+
+Many annual reports carry an outline with exact page targets. When one is usable it gives the
+section page ranges directly, without parsing the contents page or asking the LLM.
+"""
+
+import ctypes
+from typing import Dict, Optional
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from loguru import logger
+
+MIN_SECTIONS = 2
+MAX_KEY_BYTES = 100  # section keys become `session_name`, a VARCHAR(100) in the collection
+
+
+def get_page_label(pdf: pdfium.PdfDocument, page_index: int) -> str:
+    """Printed page label (e.g. 'iv', '12'); falls back to the 1-based page number"""
+    n_bytes = pdfium_c.FPDF_GetPageLabel(pdf.raw, page_index, None, 0)
+    if n_bytes <= 2:
+        return str(page_index + 1)
+    buffer = ctypes.create_string_buffer(n_bytes)
+    pdfium_c.FPDF_GetPageLabel(pdf.raw, page_index, buffer, n_bytes)
+    return buffer.raw[:n_bytes - 2].decode("utf-16-le")  ## drop the UTF-16 NUL terminator
+
+
+def _top_level_items(toc: list, page_count: int) -> list:
+    """
+    Positions in `toc` of the outline items that split the document into sections: level 0, or level 1
+    under a single title entry, among the items that target a page of the document
+    """
+    targets_page = [item.page_index is not None and 0 <= item.page_index < page_count for item in toc]
+    top_level = [i for i, item in enumerate(toc) if targets_page[i] and item.level == 0]
+    if len(top_level) == 1:
+        top_level = [i for i, item in enumerate(toc) if targets_page[i] and item.level == 1]
+    return top_level
+
+
+def _child_titles(toc: list, position: int) -> list:
+    """Titles of the direct children of toc[position]; `get_toc` lists the children right after their parent"""
+    level = toc[position].level
+    children = []
+    for child in toc[position + 1:]:
+        if child.level <= level:
+            break
+        if child.level == level + 1:
+            children.append(child.title.strip())
+    return children
+
+
+def _fit_key(title: str, suffix: str = "") -> str:
+    """`title` + `suffix`, with the title cut so the key fits MAX_KEY_BYTES of UTF-8"""
+    budget = max(MAX_KEY_BYTES - len(suffix.encode("utf-8")), 0)
+    title = title.encode("utf-8")[:budget].decode("utf-8", errors="ignore").rstrip()
+    return title + suffix
+
+
+def _unique_key(sections: Dict[str, Dict], title: str, start_label: str) -> str:
+    """
+    `title`, or `title (p. <label>)` (then an ordinal) when an earlier bookmark has the same title;
+    long titles are cut to fit MAX_KEY_BYTES first, so the cut titles are the ones compared
+    """
+    key = _fit_key(title)
+    if key not in sections:
+        return key
+    key = _fit_key(title, f" (p. {start_label})")
+    ordinal = 2
+    while key in sections:
+        key = _fit_key(title, f" (p. {start_label}, {ordinal})")
+        ordinal += 1
+    return key
+
+
+def detect_sections_from_outline(pdf_bytes: bytes) -> Optional[Dict[str, Dict]]:
+    """
+    Build the `{section: {"start", "end", "sections"}}` dict from the PDF outline.
+
+    Unlike the LLM result (printed page numbers, padded by the caller), "start"/"end" here are exact
+    0-based page indices, marked with "source": "outline"; the printed labels are kept in
+    "start_label"/"end_label". Repeated titles (e.g. "Notes" under two parts) get the start label appended
+    to stay distinct. Returns None when there is no usable outline.
+    """
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        page_count = len(pdf)
+        toc = list(pdf.get_toc())
+        top_level = _top_level_items(toc, page_count)
+        if len(top_level) < MIN_SECTIONS:
+            logger.info(f"No usable outline ({len(top_level)} top-level entries)")
+            return None
+
+        page_indices = [toc[position].page_index for position in top_level]
+        if page_indices != sorted(page_indices):
+            logger.info("Outline entries are not in page order, not using it")
+            return None
+
+        sections = {}
+        for i, position in enumerate(top_level):
+            title = toc[position].title.strip()
+            if not title:
+                continue
+            start = page_indices[i]
+            end = page_indices[i + 1] - 1 if i + 1 < len(top_level) else page_count - 1
+            end = max(end, start)
+            start_label = get_page_label(pdf, start)
+            sections[_unique_key(sections, title, start_label)] = {
+                "start": str(start),
+                "end": str(end),
+                "start_label": start_label,
+                "end_label": get_page_label(pdf, end),
+                "sections": _child_titles(toc, position),
+                "source": "outline",
+            }
+    finally:
+        pdf.close()
+
+    if len(sections) < MIN_SECTIONS:
+        return None
+    logger.info(f"Found {len(sections)} sections in the PDF outline")
+    return sections
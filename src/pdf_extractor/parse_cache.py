@@ -0,0 +1,99 @@
+"""
+Page-level cache for MinerU parse results.
+
+A PDF is laid out once per parse setting; any later page range is stitched from the
+cached per-page output instead of running the layout/OCR models again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from loguru import logger
+
+
+class ParseCache:
+    """Disk-backed cache of per-page MinerU output, keyed by PDF content hash + parse settings"""
+
+    def __init__(self, cache_dir: str, max_docs: int = 4):
+        self.cache_dir = cache_dir
+        self.max_docs = max_docs
+        os.makedirs(self.cache_dir, exist_ok=True)
+        ## small LRU of parsed documents held in memory; the rest is reloaded from disk on demand
+        self._pages: "OrderedDict[str, Dict[int, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(pdf_bytes: bytes,
+                 lang: str,
+                 method: str,
+                 formula_enable: bool,
+                 table_enable: bool,
+                 backend: str = "pipeline",
+                 text_layer_fast_path: bool = False) -> str:
+        pdf_digest = hashlib.sha256(pdf_bytes).hexdigest()
+        settings = f"{backend}|{lang}|{method}|formula={int(formula_enable)}|table={int(table_enable)}"
+        if text_layer_fast_path:
+            settings += "|text_layer"
+        settings_digest = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+        return f"{pdf_digest}_{settings_digest}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key: str) -> Dict[int, dict]:
+        if key in self._pages:
+            self._pages.move_to_end(key)
+            return self._pages[key]
+
+        pages = {}
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    pages = {int(page_idx): record for page_idx, record in json.load(f)["pages"].items()}
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable parse cache {path}: {e}")
+                pages = {}
+        self._pages[key] = pages
+        while len(self._pages) > self.max_docs:
+            self._pages.popitem(last=False)
+        return pages
+
+    def missing(self, key: str, page_ids: Iterable[int], fields: Iterable[str] = ("md",)) -> List[int]:
+        """Page ids that are not cached yet (or are cached without all the requested fields)"""
+        with self._lock:
+            pages = self._load(key)
+            return [i for i in page_ids if i not in pages or any(f not in pages[i] for f in fields)]
+
+    def get_pages(self, key: str, page_ids: Iterable[int]) -> Dict[int, dict]:
+        with self._lock:
+            pages = self._load(key)
+            return {i: pages[i] for i in page_ids if i in pages}
+
+    def put_pages(self, key: str, pages: Dict[int, dict]):
+        """Merge per-page records (absolute page index -> record) into the cache and persist them"""
+        with self._lock:
+            cached = self._load(key)
+            for page_idx, record in pages.items():
+                cached.setdefault(page_idx, {}).update(record)
+
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"pages": {str(i): r for i, r in sorted(cached.items())}}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)  ## atomic, so concurrent readers never see a partial file
+
+
+_CACHES: Dict[str, ParseCache] = {}
+
+
+def get_parse_cache(cache_dir: str) -> ParseCache:
+    """Return the process-wide cache instance for `cache_dir`"""
+    cache_dir = os.path.abspath(cache_dir)
+    if cache_dir not in _CACHES:
+        _CACHES[cache_dir] = ParseCache(cache_dir)
+    return _CACHES[cache_dir]
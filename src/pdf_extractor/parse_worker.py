@@ -0,0 +1,190 @@
+"""
+Long-lived MinerU parse worker.
+
+Loads the pipeline models once and serves parse jobs over a local socket, so short ingestion
+runs and ad-hoc re-parses do not pay the torch/onnxruntime model loading every time.
+
+Start it with:
+    python -m src.pdf_extractor.parse_worker --address 127.0.0.1:8765
+
+and set MINERU_PARSE_WORKER=127.0.0.1:8765 (or a unix socket path) for the ingestion process;
+`analyze_page_spans` then routes its jobs to the worker and falls back to in-process parsing
+when the worker cannot be reached.
+
+Jobs are pickled, so only authenticated clients may connect. The shared key is MINERU_PARSE_WORKER_AUTHKEY;
+without it the worker generates a random key into MINERU_PARSE_WORKER_AUTHKEY_FILE (owner-only, 0600),
+which clients of the same user read.
+"""
+
+import argparse
+import io
+import os
+import secrets
+import stat
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from loguru import logger
+
+WORKER_ADDRESS_ENV = "MINERU_PARSE_WORKER"
+WORKER_AUTHKEY_ENV = "MINERU_PARSE_WORKER_AUTHKEY"
+WORKER_AUTHKEY_FILE_ENV = "MINERU_PARSE_WORKER_AUTHKEY_FILE"
+DEFAULT_AUTHKEY_FILE = os.path.join(os.path.expanduser("~"), ".cache", "adv-ir-rag", "parse_worker.key")
+
+## what a client sees when the worker is down, dies mid-job, rejects the key or reports a failure
+WORKER_ERRORS = (OSError, EOFError, AuthenticationError, RuntimeError)
+
+
+def parse_address(address: str):
+    """'host:port' -> (host, port); anything else is treated as a unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def get_worker_address():
+    address = os.getenv(WORKER_ADDRESS_ENV)
+    return parse_address(address) if address else None
+
+
+def _authkey_file() -> str:
+    return os.getenv(WORKER_AUTHKEY_FILE_ENV, DEFAULT_AUTHKEY_FILE)
+
+
+def _read_authkey_file(path: str) -> bytes:
+    mode = os.stat(path).st_mode
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RuntimeError(f"Parse worker key file {path} is accessible by other users, chmod 600 it")
+    with open(path, "rb") as f:
+        authkey = f.read().strip()
+    if not authkey:
+        raise RuntimeError(f"Parse worker key file {path} is empty")
+    return authkey
+
+
+def get_authkey(create: bool = False) -> bytes:
+    """
+    The worker's shared key: MINERU_PARSE_WORKER_AUTHKEY, else the key file. With `create` (the worker side)
+    a missing key file is generated; a client without a key raises RuntimeError.
+    """
+    authkey = os.getenv(WORKER_AUTHKEY_ENV)
+    if authkey:
+        return authkey.encode("utf-8")
+
+    path = _authkey_file()
+    if os.path.exists(path):
+        return _read_authkey_file(path)
+    if not create:
+        raise RuntimeError(f"No parse worker key: set {WORKER_AUTHKEY_ENV} or start the worker to create {path}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    authkey = secrets.token_hex(32).encode("ascii")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    logger.info(f"Generated parse worker key in {path}")
+    return authkey
+
+
+class ParseWorkerClient:
+    """Sends page spans to a running parse worker and returns its per-page records"""
+
+    def __init__(self, address=None, authkey: bytes = None):
+        self.address = address or get_worker_address()
+        self.authkey = authkey
+
+    def _connect(self):
+        return Client(self.address, authkey=self.authkey or get_authkey())
+
+    def analyze_page_spans(self, span_list: list[dict], method="auto", formula_enable=False, table_enable=False):
+        with self._connect() as conn:
+            conn.send({"op": "analyze_page_spans",
+                       "span_list": span_list,
+                       "method": method,
+                       "formula_enable": formula_enable,
+                       "table_enable": table_enable})
+            response = conn.recv()
+        if not response["ok"]:
+            raise RuntimeError(f"Parse worker failed: {response['error']}")
+        return response["result"]
+
+    def ping(self) -> bool:
+        try:
+            with self._connect() as conn:
+                conn.send({"op": "ping"})
+                return conn.recv()["ok"]
+        except WORKER_ERRORS:
+            return False
+
+
+def _blank_pdf_bytes() -> bytes:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument.new()
+    pdf.new_page(612, 792)
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+def warm_up(lang="en", method="auto", formula_enable=False, table_enable=False):
+    """Run one blank page through the pipeline so MinerU's model singleton holds loaded models"""
+    from src.pdf_extractor.mineru_parser import pipeline_analyze_pages
+
+    start = time.time()
+    pipeline_analyze_pages([_blank_pdf_bytes()], [lang], image_writer_list=[None], image_dir_list=[""],
+                           parse_method=method, formula_enable=formula_enable, table_enable=table_enable)
+    logger.info(f"Parse worker models loaded in {time.time() - start:.1f}s")
+
+
+def serve(address, authkey: bytes = None, warm_lang="en"):
+    """Serve parse jobs until interrupted. Jobs run one at a time on the warm models."""
+    from src.pdf_extractor.mineru_parser import analyze_page_spans
+
+    ## resolve the key before loading the models, so a bad key file fails fast
+    authkey = authkey or get_authkey(create=True)
+    warm_up(lang=warm_lang)
+    with Listener(address, authkey=authkey) as listener:
+        logger.info(f"Parse worker listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                logger.warning(f"Rejected parse worker connection: {e}")
+                continue
+            with conn:
+                try:
+                    job = conn.recv()
+                except EOFError:
+                    continue
+                start = time.time()
+                try:
+                    ## a malformed job gets an error reply like any failed job instead of stopping the worker
+                    if job["op"] == "ping":
+                        conn.send({"ok": True})
+                        continue
+                    result = analyze_page_spans(job["span_list"],
+                                                method=job["method"],
+                                                formula_enable=job["formula_enable"],
+                                                table_enable=job["table_enable"],
+                                                use_worker=False)
+                    conn.send({"ok": True, "result": result})
+                    pages = sum(len(records) for records in result)
+                    logger.info(f"Parsed {pages} pages in {time.time() - start:.1f}s")
+                except Exception as e:
+                    logger.exception(e)
+                    conn.send({"ok": False, "error": repr(e)})
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Long-lived MinerU parse worker")
+    arg_parser.add_argument("--address", default=os.getenv(WORKER_ADDRESS_ENV, "127.0.0.1:8765"),
+                            help="host:port or unix socket path to listen on")
+    arg_parser.add_argument("--lang", default="en", help="language used to warm up the OCR models")
+    args = arg_parser.parse_args()
+
+    os.environ.pop(WORKER_ADDRESS_ENV, None)  ## the worker itself always parses in-process
+    serve(parse_address(args.address), warm_lang=args.lang)
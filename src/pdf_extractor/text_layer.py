@@ -0,0 +1,191 @@
+"""
+Text-layer fast path for born-digital PDFs.
+
+Pages whose embedded text layer is clean are read directly with pypdfium2; only scans,
+image-heavy or table-heavy pages and garbled encodings go through the MinerU layout/OCR pipeline.
+Headings of text-layer pages are recovered from font sizes: short lines set noticeably larger than
+the page's body text become heading blocks, like MinerU's `text_level` titles.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from loguru import logger
+
+MIN_CHARS = 200             # fewer characters than this: scan, cover or figure page
+MAX_BAD_CHAR_RATIO = 0.02   # replacement / private-use / control characters: broken font encoding
+MAX_IMAGE_COVERAGE = 0.5    # share of the page area covered by images
+MAX_NUMERIC_LINE_RATIO = 0.3  # share of lines that look like table rows (3+ numeric cells)
+
+_NUMERIC_CELL = re.compile(r"\(?-?[\d,]+(?:\.\d+)?\)?%?")
+
+HEADING_DETECTION = "font_size"  # recorded on text-layer pages; older cached pages without it are re-read
+MIN_HEADING_SIZE_RATIO = 1.15  # font size relative to the body text for a line to count as a heading
+HEADING_LEVEL_RATIOS = ((1.8, 1), (1.35, 2))  # larger ratios first; anything smaller is level 3
+MAX_HEADING_CHARS = 150
+
+
+def _bad_char_ratio(text: str) -> float:
+    if not text:
+        return 1.0
+    bad = 0
+    for char in text:
+        if char in "\n\r\t ":
+            continue
+        category = unicodedata.category(char)
+        if char == "�" or category in ("Co", "Cc", "Cs"):
+            bad += 1
+    return bad / len(text)
+
+
+def _numeric_line_ratio(text: str) -> float:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    numeric_lines = sum(1 for line in lines if len(_NUMERIC_CELL.findall(line)) >= 3)
+    return numeric_lines / len(lines)
+
+
+def _image_coverage(page) -> float:
+    page_width, page_height = page.get_size()
+    page_area = page_width * page_height
+    if page_area <= 0:
+        return 0.0
+    covered = 0.0
+    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+        left, bottom, right, top = obj.get_pos()
+        covered += max(right - left, 0) * max(top - bottom, 0)
+    return min(covered / page_area, 1.0)
+
+
+def read_page_text(page) -> str:
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range().replace("\r\n", "\n").replace("\r", "\n")
+    finally:
+        textpage.close()
+
+
+def classify_page(page) -> tuple[bool, str, str]:
+    """(use_text_layer, reason, text) for one pypdfium2 page"""
+    text = read_page_text(page)
+    n_chars = len(text.strip())
+    if n_chars < MIN_CHARS:
+        return False, f"sparse text layer ({n_chars} chars)", text
+
+    bad_ratio = _bad_char_ratio(text)
+    if bad_ratio > MAX_BAD_CHAR_RATIO:
+        return False, f"garbled encoding ({bad_ratio:.1%} bad chars)", text
+
+    coverage = _image_coverage(page)
+    if coverage > MAX_IMAGE_COVERAGE:
+        return False, f"image-heavy ({coverage:.0%} of page)", text
+
+    numeric_ratio = _numeric_line_ratio(text)
+    if numeric_ratio > MAX_NUMERIC_LINE_RATIO:
+        return False, f"table-heavy ({numeric_ratio:.0%} numeric lines)", text
+
+    return True, "clean text layer", text
+
+
+def _heading_level(line: str, size: float, body_size: float) -> int | None:
+    if not body_size or size < body_size * MIN_HEADING_SIZE_RATIO:
+        return None
+    if not 2 <= len(line) <= MAX_HEADING_CHARS or line[-1] in ".,;:" or not any(c.isalpha() for c in line):
+        return None
+    ratio = size / body_size
+    return next((level for min_ratio, level in HEADING_LEVEL_RATIOS if ratio >= min_ratio), 3)
+
+
+def line_headings(page) -> list[tuple[int, float] | None]:
+    """
+    (heading level (1 = largest), font size) or None for every line of `read_page_text(page)`. Each line takes
+    the median font size of its characters; the body size is the most common size on the page.
+    """
+    textpage = page.get_textpage()
+    try:
+        raw = textpage.get_text_range()
+        n_chars = textpage.count_chars()
+        if len(raw) != n_chars:  ## characters outside the BMP shift the offsets, no heading information then
+            return [None] * len(raw.replace("\r\n", "\n").replace("\r", "\n").split("\n"))
+        sizes = [pdfium_c.FPDFText_GetFontSize(textpage.raw, i) for i in range(n_chars)]
+    finally:
+        textpage.close()
+
+    body = Counter(round(size * 2) / 2 for char, size in zip(raw, sizes) if not char.isspace())
+    body_size = body.most_common(1)[0][0] if body else 0
+
+    levels = []
+    start = 0
+    for line in re.split(r"\r\n|\r|\n", raw):
+        line_sizes = sorted(size for char, size in zip(line, sizes[start:start + len(line)]) if not char.isspace())
+        size = line_sizes[len(line_sizes) // 2] if line_sizes else 0
+        level = _heading_level(line.strip(), size, body_size)
+        levels.append((level, size) if level else None)
+        start += len(line)
+        start += 2 if raw.startswith("\r\n", start) else 1
+    return levels
+
+
+def text_content_list(text: str, headings: list[tuple[int, float] | None] = None) -> list[dict]:
+    """
+    Content-list blocks for a text-layer page: one text block per paragraph, and a titled block
+    (`text_level`) per heading when `headings` (per line of `text`, see `line_headings`) is given
+    """
+    blocks = []
+    paragraph = []
+
+    def flush_paragraph():
+        if paragraph and "\n".join(paragraph).strip():
+            blocks.append({"type": "text", "text": "\n".join(paragraph).strip()})
+        paragraph.clear()
+
+    lines = text.split("\n")
+    headings = headings if headings and len(headings) == len(lines) else [None] * len(lines)
+    previous = None
+    for line, heading in zip(lines, headings):
+        if heading is not None and line.strip():
+            flush_paragraph()
+            if previous == heading:
+                ## a heading wrapped over several lines
+                blocks[-1]["text"] += " " + line.strip()
+            else:
+                blocks.append({"type": "text", "text": line.strip(), "text_level": heading[0]})
+        elif not line.strip():
+            flush_paragraph()
+        else:
+            paragraph.append(line)
+        previous = heading if line.strip() else None
+    flush_paragraph()
+    return blocks
+
+
+def route_pages(pdf_bytes: bytes, page_ids: list[int], file_name: str = "") -> tuple[dict[int, dict], list[int]]:
+    """
+    Split `page_ids` into pages served from the text layer and pages that need the pipeline.
+    Returns ({page_idx: page record}, [page ids for the layout/OCR pipeline]); every choice is logged.
+    """
+    text_pages = {}
+    pipeline_page_ids = []
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        for page_idx in page_ids:
+            page = pdf[page_idx]
+            try:
+                use_text_layer, reason, text = classify_page(page)
+                headings = line_headings(page) if use_text_layer else None
+            finally:
+                page.close()
+            if use_text_layer:
+                text_pages[page_idx] = {"md": text.strip(), "content_list": text_content_list(text, headings),
+                                        "source": "text_layer", "heading_detection": HEADING_DETECTION}
+                logger.info(f"{file_name} page {page_idx}: text layer ({reason})")
+            else:
+                pipeline_page_ids.append(page_idx)
+                logger.info(f"{file_name} page {page_idx}: pipeline ({reason})")
+    finally:
+        pdf.close()
+    return text_pages, pipeline_page_ids
@@ -1,22 +1,35 @@
+import argparse
 import json
 import asyncio
 import os
-from typing import Dict, List, Any
+from typing import Dict, Iterable, List, Any, Union
 from datetime import datetime
 import logging
 from pathlib import Path
 import re
+import multiprocessing
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from mineru.cli.common import convert_pdf_bytes_to_bytes_by_pypdfium2, prepare_env, read_fn
 
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers.json import JsonOutputParser
 
-from src.config import MILVUS_URL, MILVUS_DB_NAME, MILVUS_PW
+from src.config import (MILVUS_URL, MILVUS_DB_NAME, MILVUS_PW, PARSE_CONFIG, INGEST_CONFIG, CHUNK_CONFIG,
+                        DEDUP_CONFIG, VECTOR_CONFIG, EXPANSION_CONFIG)
 from src.database.milvus_handler import MilvusHandler
-from src.pdf_extractor.mineru_parser import parse_doc
+from src.pdf_extractor.mineru_parser import parse_doc, parse_doc_pages, slice_pages, slice_blocks, iter_slice_pages
+from src.pdf_extractor.outline import detect_sections_from_outline
+from src.pdf_processor.ingest_manifest import IngestManifest, content_hash, pipeline_fingerprint
+from src.pdf_processor.near_duplicates import DocumentDeduplicator, get_minhash_index, new_deduplicator
 from src.prompts import CONTENT_SEARCHING_PROMPT
 from src.utils import Utils, llm
+from src.utils.llm_cache import get_llm_cache
 from src.advance_rag import AdvanceDocProcessor
+from src.advance_rag.batch_expansion import (chunk_key, get_batch_expansion_client, load_batch_expansions,
+                                             save_batch_expansions)
 
 
 class PDFProcessor(MilvusHandler):
@@ -41,6 +54,17 @@ class PDFProcessor(MilvusHandler):
                 self.doc_path_list.append(doc_path)
         """END HERE"""
 
+        ## every page is laid out once; overlapping section ranges are served from the cache
+        if PARSE_CONFIG["CACHE_ENABLED"]:
+            self.parse_cache_dir = PARSE_CONFIG["CACHE_DIR"] or os.path.join(self.output_dir, "parse_cache")
+        else:
+            self.parse_cache_dir = None
+        self.write_parse_artifacts = PARSE_CONFIG["WRITE_ARTIFACTS"]
+        self.text_layer_fast_path = PARSE_CONFIG["TEXT_LAYER_FAST_PATH"]
+
+        ## content hashes of what is already in the collection, to skip unchanged documents/sections
+        self.manifest = IngestManifest(os.path.join(self.output_dir, "ingest_manifest.json"))
+
         self.llm = llm
         self.parser = JsonOutputParser()
         self.utils = Utils()
@@ -91,69 +115,210 @@ class PDFProcessor(MilvusHandler):
                       self.output_dir,
                       file_name=file_name,
                       lang=lang,
-                      backend="pipeline", start_page_id=page_start, end_page_id=page_end, md_name=md_name)
+                      backend="pipeline", start_page_id=page_start, end_page_id=page_end, md_name=md_name,
+                      cache_dir=self.parse_cache_dir, write_artifacts=self.write_parse_artifacts,
+                      text_layer_fast_path=self.text_layer_fast_path)
         return md
 
-
-    def look_for_session_pages(self,
-                           pdf_bytes: bytes,
-                           file_name: str,
-                           lang: str):
-
-        md_contents = self.extract_data_from_pdf(pdf_bytes, file_name, lang, page_start=0, page_end=3, md_name='contents')
+    def extract_pages_from_pdf(self,
+                               pdf_bytes: bytes,
+                               file_name: str,
+                               lang: str) -> List[Dict[str, Any]]:
+        """Parse the whole document once; returns [{'page_idx': i, 'md': ...}, ...]"""
+        pages = parse_doc_pages(pdf_bytes,
+                                self.output_dir,
+                                file_name=file_name,
+                                lang=lang,
+                                cache_dir=self.parse_cache_dir,
+                                write_artifacts=self.write_parse_artifacts,
+                                text_layer_fast_path=self.text_layer_fast_path)
+        return pages
+
+
+    def _contents_chain(self):
         prompt_template = PromptTemplate(
             template=CONTENT_SEARCHING_PROMPT,
             input_variables=["input_markdown"],
             partial_variables={"format_instructions": self.parser.get_format_instructions()},
         )
-        chain = prompt_template | self.llm | self.parser
-        result = chain.invoke({'input_markdown': md_contents})
+        return prompt_template | self.llm | self.parser
+
+    def look_for_session_pages(self,
+                           pdf_bytes: bytes,
+                           file_name: str,
+                           lang: str,
+                           pages: List[Dict[str, Any]]=None):
+
+        if PARSE_CONFIG["USE_OUTLINE"]:
+            ## exact page targets from the bookmarks, no contents-page LLM round trip needed
+            outline_sections = detect_sections_from_outline(pdf_bytes)
+            if outline_sections:
+                self.logger.info(f"📑 Using PDF outline for {file_name}: {len(outline_sections)} sections")
+                return outline_sections
+
+        if pages is not None:
+            md_contents = slice_pages(pages, 0, 3)
+        else:
+            md_contents = self.extract_data_from_pdf(pdf_bytes, file_name, lang, page_start=0, page_end=3, md_name='contents')
+        result = self._contents_chain().invoke({'input_markdown': md_contents})
 
         return result
 
+    async def a_look_for_session_pages(self,
+                                   pdf_bytes: bytes,
+                                   file_name: str,
+                                   lang: str,
+                                   pages: List[Dict[str, Any]]=None):
+        """Async `look_for_session_pages`: outline reading and parsing run in a thread, the LLM call is awaited"""
+
+        if PARSE_CONFIG["USE_OUTLINE"]:
+            outline_sections = await asyncio.to_thread(detect_sections_from_outline, pdf_bytes)
+            if outline_sections:
+                self.logger.info(f"📑 Using PDF outline for {file_name}: {len(outline_sections)} sections")
+                return outline_sections
+
+        if pages is not None:
+            md_contents = slice_pages(pages, 0, 3)
+        else:
+            md_contents = await asyncio.to_thread(self.extract_data_from_pdf, pdf_bytes, file_name, lang,
+                                                  page_start=0, page_end=3, md_name='contents')
+        result = await self._contents_chain().ainvoke({'input_markdown': md_contents})
 
+        return result
 
-    async def session_chunking(self, md_sections, session_name, company, year, apply_adv_rag=False):
 
-        ## remove image tag
-        md_sections = re.sub(r'!\[.*?\]\(.*?\)', '', md_sections)
 
-        session_chunks = []
-        # Step 1: Chunk the content
-        chunks = self.utils.split(md_sections) ## Todo: remove :20
-        self.logger.info(f"   📄 Created {len(chunks)} chunks")
+    @staticmethod
+    def _batched(iterable, batch_size: int):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
-        # Step 2: Generate embeddings for chunks
+    async def _embed_chunk_texts(self, texts: List[str], apply_adv_rag: bool = False):
+        """(len(texts), dim) vectors of the (optionally expanded) chunk texts, None if embedding failed"""
+        if not texts:
+            return np.empty((0, VECTOR_CONFIG["DIM"]), dtype=np.float32)
         if apply_adv_rag:
-            original_chunks, modified_chunks = await self.adv_rag_doc.document_expansion(chunks)
+            original_chunks, modified_chunks = await self.adv_rag_doc.document_expansion(texts)
             chunks_embeddings_dict = await self.utils.a_embed_documents(modified_chunks)
-            chunks = original_chunks.copy()
-            chunk_embeddings = chunks_embeddings_dict['vector']
         else:
-            chunks_embeddings_dict = await self.utils.a_embed_documents(chunks)
-            chunks = chunks_embeddings_dict['text']
-            chunk_embeddings = chunks_embeddings_dict['vector']
+            chunks_embeddings_dict = await self.utils.a_embed_documents(texts)
+        vectors = chunks_embeddings_dict['vector'] if chunks_embeddings_dict is not None else None
+        if vectors is None or len(vectors) != len(texts):
+            return None
+        return vectors
+
+    def _iter_section_chunks(self, md_sections: Union[str, Iterable[str]], blocks=None):
+        """(text, heading_path) of the chunks of one section, lazily"""
+        if blocks is not None:
+            return ((chunk["content"], chunk["heading_path"]) for chunk in self.utils.iter_split_blocks(blocks))
+        ## remove image tag (a tag never spans two pages)
+        pieces = [md_sections] if isinstance(md_sections, str) else md_sections
+        pieces = (re.sub(r'!\[.*?\]\(.*?\)', '', piece) for piece in pieces)
+        return ((chunk, "") for chunk in self.utils.iter_split(pieces))
+
+    async def session_chunking(self, md_sections: Union[str, Iterable[str]], session_name, company, year,
+                               apply_adv_rag=False, blocks=None, deduplicator: DocumentDeduplicator=None):
+        """
+        md_sections: markdown of the section, a string or a stream of pieces (`iter_slice_pages`).
+        blocks: MinerU content-list blocks of the section; when given, chunks are whole blocks packed under
+            their headings (no overlap) and carry their heading path, otherwise the markdown is split.
+        deduplicator: near-duplicate chunks are linked to their canonical chunk (its vector, `canonical_id`)
+            instead of being expanded and embedded again.
+
+        Chunks are produced lazily and handled in batches of CHUNK_CONFIG["STREAM_BATCH_SIZE"]: the first batch
+        is being embedded while the next one is split, and at most STREAM_MAX_IN_FLIGHT batches are pending.
+        """
+
+        # Step 1: Chunk the content (lazily)
+        chunk_stream = self._iter_section_chunks(md_sections, blocks)
+
+        doc_id = company + "_" + year
+        chunks, heading_paths, chunk_ids, canonical_ids = [], [], [], []
+        vectors: Dict[str, Any] = {}
+        in_flight = deque()  ## (ids of the chunks to embed, embedding task), oldest first
+
+        async def collect_oldest() -> bool:
+            unique_ids, task = in_flight.popleft()
+            batch_vectors = await task
+            if batch_vectors is None:
+                return False
+            vectors.update(zip(unique_ids, batch_vectors))
+            if deduplicator is not None:
+                deduplicator.commit(unique_ids, batch_vectors)
+            return True
+
+        failed = False
+        try:
+            for batch in self._batched(chunk_stream, CHUNK_CONFIG["STREAM_BATCH_SIZE"]):
+                batch_texts = [text for text, _ in batch]
+                batch_ids = [self.make_chunk_id(doc_id, session_name, len(chunks) + i) for i in range(len(batch))]
+
+                # Step 2: Link near-duplicates to a canonical chunk; only the other chunks are expanded and embedded
+                batch_canonical = [None] * len(batch)
+                if deduplicator is not None:
+                    batch_canonical = await asyncio.to_thread(deduplicator.match, batch_ids, batch_texts, session_name)
+                unique = [(chunk_id, text) for chunk_id, text, canonical_id in zip(batch_ids, batch_texts, batch_canonical)
+                          if canonical_id is None]
+
+                # Step 3: Generate embeddings for chunks, in the background while the next batch is split
+                task = asyncio.create_task(self._embed_chunk_texts([text for _, text in unique], apply_adv_rag))
+                in_flight.append(([chunk_id for chunk_id, _ in unique], task))
+                await asyncio.sleep(0)  ## let the request go out before splitting further
+
+                chunks.extend(batch_texts)
+                heading_paths.extend(heading_path for _, heading_path in batch)
+                chunk_ids.extend(batch_ids)
+                canonical_ids.extend(batch_canonical)
+
+                if len(in_flight) >= CHUNK_CONFIG["STREAM_MAX_IN_FLIGHT"] and not await collect_oldest():
+                    failed = True
+                    break
+            while in_flight and not failed:
+                failed = not await collect_oldest()
+        finally:
+            for _, task in in_flight:
+                task.cancel()
 
-        if not chunk_embeddings or len(chunk_embeddings) != len(chunks):
+        self.logger.info(f"   📄 Created {len(chunks)} chunks")
+        if not chunks and not failed:
+            self.logger.warning(f"   ⚠️ No text in {session_name}")
+            return []
+        if failed:
             self.logger.error(f"   ❌ Embedding failed for {session_name}")
+            if deduplicator is not None:
+                deduplicator.discard(session_name)
             return None
-        self.logger.info(f"   🧠 Generated {len(chunk_embeddings)} embeddings")
+        self.logger.info(f"   🧠 Generated {len(vectors)} embeddings")
+        if len(vectors) < len(chunks):
+            self.logger.info(f"   ♻️ {len(chunks) - len(vectors)} near-duplicate chunks reuse a canonical vector")
 
-        for i, (chunk_text, embedding) in enumerate(zip(chunks, chunk_embeddings)):
+        session_chunks = []
+        for i, chunk_text in enumerate(chunks):
+            canonical_id = canonical_ids[i]
+            embedding = deduplicator.vectors[canonical_id] if canonical_id is not None else vectors[chunk_ids[i]]
             # if len(chunk_text) >= 2000:
             #     print('exceeding 2000')
             #     continue
             chunk_data = {
+                "id": chunk_ids[i],
                 "session_name": session_name,
                 "company": company,
                 "date": year,
-                "doc_id": company + "_" + year,
+                "doc_id": doc_id,
                 "title": company + "_" + year,
                 "source_type": 'annual_report',
                 "content": chunk_text,
+                "heading_path": heading_paths[i],
+                "canonical_id": canonical_id or "",
                 "chunk_index": i,
                 "chunk_length": len(chunk_text),
-                "dense_embedding": embedding,
+                "dense_embedding": embedding,  ## row view of the batch array, no per-chunk copy
                 "created_at": datetime.now().isoformat()
             }
             session_chunks.append(chunk_data)
@@ -164,11 +329,27 @@ class PDFProcessor(MilvusHandler):
                                     pdf_bytes: bytes,
                                     file_name: str,
                                     lang: str,
-                                    page_results_dict):
+                                    page_results_dict,
+                                    pages: List[Dict[str, Any]]=None,
+                                    previous_sections: Dict[str, Any]=None,
+                                    deduplicator: DocumentDeduplicator=None,
+                                    fingerprint: str=None,
+                                    failed_sections: List[str]=None,
+                                    apply_adv_rag: bool=False) -> int:
+        """
+        Chunk, embed and store the sections one at a time: each section is written (`store_section`) as soon
+        as it is embedded, so only one section's chunks and vectors are held. Returns the number of chunks stored.
+        previous_sections: {session_name: {"hash", "fingerprint", "chunk_count"}} of the previous ingestion.
+            Sections whose markdown hash and pipeline fingerprint are unchanged are skipped.
+        deduplicator: shared by all sections, so boilerplate repeated across sections is embedded once.
+        failed_sections: names of the sections that could not be embedded are appended to it.
+        apply_adv_rag: embed the chunks with their LLM keywords and QA appended (`document_expansion`).
+        """
 
         company_year = self.extract_company_year(file_name)
         company = company_year['company']
         year = str(company_year['year'])
+        doc_id = company + "_" + year
 
         # # Todo: remove testing <start>
         # company= ''
@@ -184,38 +365,106 @@ class PDFProcessor(MilvusHandler):
         #     all_chunks.extend(session_chunks)
         # # Todo: remove testing <end>
 
-        all_chunks = []
+        chunks_stored = 0
 
-        for session_name, session_details in page_results_dict.items():
-            if session_details['start'] == '' and session_details['end'] == '':
-                ## LLM failed to generated pages skipping it
-                continue
-            page_start = int(session_details['start']) - 2 ## +/- to deal with the pdf page number does not align with actual number
+        ## section N+1 is extracted while section N is chunked/embedded; the bounded queue keeps memory flat
+        section_queue = asyncio.Queue(maxsize=INGEST_CONFIG["QUEUE_SIZE"])
+
+        async def produce_sections():
             try:
-                page_end = int(session_details['end']) + 2
-            except:
-                page_end = None ## last page
-            if page_start < 0:
-                page_start = 1
-            md_sections = self.extract_data_from_pdf(pdf_bytes,
-                                                     file_name,
-                                                     lang,
-                                                     page_start=page_start,
-                                                     page_end=page_end,
-                                                     md_name=session_name)
-
-            if md_sections is not None:
-                session_chunks = await self.session_chunking(md_sections, session_name, company, year)
-                all_chunks.extend(session_chunks)
-            else:
+                for session_name, session_details in page_results_dict.items():
+                    page_range = self._section_page_range(session_details)
+                    if page_range is None:
+                        continue
+                    page_start, page_end = page_range
+                    blocks = None
+                    if pages is not None:
+                        ## whole document already parsed, the section is streamed page by page from memory
+                        md_sections = partial(iter_slice_pages, pages, page_start, page_end)
+                        if CHUNK_CONFIG["STRUCTURE_AWARE"]:
+                            blocks = slice_blocks(pages, page_start, page_end)
+                    else:
+                        md_sections = await asyncio.to_thread(self.extract_data_from_pdf,
+                                                              pdf_bytes,
+                                                              file_name,
+                                                              lang,
+                                                              page_start=page_start,
+                                                              page_end=page_end,
+                                                              md_name=session_name)
+                    await section_queue.put((session_name, md_sections, blocks))
+            finally:
+                await section_queue.put(None)
+
+        producer = asyncio.create_task(produce_sections())
+        try:
+            while (item := await section_queue.get()) is not None:
+                session_name, md_sections, blocks = item
+                if md_sections is None:
+                    continue
+
+                ## a stream is read twice, once for the hash and once for the chunks
+                section_hash = content_hash(md_sections if isinstance(md_sections, str) else md_sections())
+                if (previous_sections is not None
+                        and self.manifest.section_unchanged(previous_sections.get(session_name), section_hash, fingerprint)):
+                    self.logger.info(f"   ⏭️ Section {session_name} unchanged, skipping")
+                    if deduplicator is not None:
+                        deduplicator.keep_section(session_name)
+                    continue
+
+                session_chunks = await self.session_chunking(
+                    md_sections if isinstance(md_sections, str) else md_sections(), session_name, company, year,
+                    apply_adv_rag=apply_adv_rag, blocks=blocks, deduplicator=deduplicator)
+                if session_chunks is None:
+                    if failed_sections is not None:
+                        failed_sections.append(session_name)
+                    continue
+                chunks_stored += await self.store_section(
+                    doc_id, session_name, session_chunks,
+                    deduplicator.take_entries() if deduplicator is not None else [],
+                    {"hash": section_hash, "fingerprint": fingerprint, "chunk_count": len(session_chunks)})
+            await producer
+        finally:
+            producer.cancel()
+        return chunks_stored
+
+    @staticmethod
+    def _section_page_range(session_details):
+        """(page_start, page_end) to extract for one section of the contents result, None to skip it"""
+        if session_details['start'] == '' and session_details['end'] == '':
+            ## LLM failed to generated pages skipping it
+            return None
+        if session_details.get('source') == 'outline':
+            ## outline targets are exact page indices, no padding needed
+            return int(session_details['start']), int(session_details['end'])
+
+        page_start = int(session_details['start']) - 2 ## +/- to deal with the pdf page number does not align with actual number
+        try:
+            page_end = int(session_details['end']) + 2
+        except:
+            page_end = None ## last page
+        if page_start < 0:
+            page_start = 1
+        return page_start, page_end
+
+    def _unchanged_sections(self, prepared: Dict[str, Any], previous_sections: Dict[str, Any],
+                            fingerprint: str) -> List[str]:
+        """Names of the sections of a `prepare_document` result whose markdown and pipeline are unchanged"""
+        unchanged = []
+        for session_name, session_details in prepared["page_results_dict"].items():
+            page_range = self._section_page_range(session_details)
+            if page_range is None or session_name not in previous_sections:
                 continue
-        return all_chunks
+            if self.manifest.section_unchanged(previous_sections[session_name],
+                                               content_hash(iter_slice_pages(prepared["pages"], *page_range)),
+                                               fingerprint):
+                unchanged.append(session_name)
+        return unchanged
 
     async def insert_into_vdb(self, all_chunks):
 
         if all_chunks:
 
-            chunks_stored = self.store_chunks(all_chunks)
+            chunks_stored = await asyncio.to_thread(self.replace_chunks, all_chunks)
             self.logger.info(f"✅ Stored {chunks_stored} chunks")
             # Log summary
             companies = set(chunk["company"] for chunk in all_chunks)
@@ -230,48 +479,256 @@ class PDFProcessor(MilvusHandler):
             self.logger.warning("No chunks to store")
             return 0
 
-    async def main(self):
+    async def prepare_document(self, path: Path) -> Dict[str, Any]:
+        """
+        Read and parse one document and locate its sections. CPU work runs in a thread so the event loop
+        keeps serving in-flight embedding/LLM requests. Returns None when the document is unchanged.
+        """
+        file_name = str(Path(path).stem)
+        pdf_bytes = await asyncio.to_thread(read_fn, path)
+        company_year = self.extract_company_year(file_name)
+        doc_id = company_year['company'] + "_" + str(company_year['year'])
 
-        self._initialize_collection()
+        pdf_hash = content_hash(pdf_bytes)
+        if self.manifest.is_unchanged(doc_id, pdf_hash, pipeline_fingerprint()):
+            self.logger.info(f"⏭️ {file_name} unchanged since last ingestion, skipping")
+            return None
 
-        md_content_list = []
+        if '宁德时代' in file_name:
+            lang = 'ch'
+        else:
+            lang = 'en'
 
-        for path in self.doc_path_list:
-            file_name = str(Path(path).stem)
-            pdf_bytes = read_fn(path)
+        pages = await asyncio.to_thread(self.extract_pages_from_pdf, pdf_bytes, file_name, lang)
+        page_results_dict = await self.a_look_for_session_pages(pdf_bytes, file_name, lang, pages=pages)
 
-            if '宁德时代' in file_name:
-                lang = 'ch'
-            else:
-                lang = 'en'
+        os.makedirs(os.path.join(self.output_dir, file_name), exist_ok=True)
+        with open(os.path.join(self.output_dir, file_name, 'content_results.json'), "w", encoding="utf-8") as f:
+            json.dump(page_results_dict, f, ensure_ascii=False, indent=4)
 
-            # file_name_list.append(file_name)
-            # pdf_bytes_list.append(pdf_bytes)
-            # lang_list.append(lang)
+        return {"doc_id": doc_id, "file_name": file_name, "lang": lang, "pdf_bytes": pdf_bytes,
+                "pdf_hash": pdf_hash, "pages": pages, "page_results_dict": page_results_dict}
 
+    async def store_section(self, doc_id: str, session_name: str, chunks: List[Dict[str, Any]],
+                            dedup_entries: List[tuple], section_entry: Dict[str, Any]) -> int:
+        """Replace one section in the collection and the corpus near-duplicate index, then record it in the manifest"""
+        if chunks:
+            chunks_stored = await self.insert_into_vdb(chunks)
+        else:
+            ## the section has no text anymore, its previous chunks must not survive
+            await asyncio.to_thread(self.delete_sections, doc_id, [session_name])
+            chunks_stored = 0
+        if DEDUP_CONFIG["ENABLED"] and DEDUP_CONFIG["CROSS_CORPUS"]:
+            ## the corpus index follows the collection: the replaced section is re-indexed
+            dedup_index = get_minhash_index()
+            await asyncio.to_thread(dedup_index.remove_sections, doc_id, [session_name])
+            await asyncio.to_thread(dedup_index.add, dedup_entries)
+        await asyncio.to_thread(self.manifest.update_section, doc_id, session_name, section_entry)
+        return chunks_stored
+
+    async def remove_sections(self, doc_id: str, session_names: List[str]):
+        """Drop sections that are no longer in the document from the collection, the corpus index and the manifest"""
+        if not session_names:
+            return
+        await asyncio.to_thread(self.delete_sections, doc_id, session_names)
+        if DEDUP_CONFIG["ENABLED"] and DEDUP_CONFIG["CROSS_CORPUS"]:
+            await asyncio.to_thread(get_minhash_index().remove_sections, doc_id, session_names)
+        await asyncio.to_thread(self.manifest.remove_sections, doc_id, session_names)
+
+    async def ingest_document(self, prepared: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Chunk, embed and store the new or changed sections of a `prepare_document` result, section by section,
+        then drop the sections the document no longer has. Returns {"doc_id", "chunks_stored", "failed_sections"}.
+        """
+        doc_id = prepared["doc_id"]
+        page_results_dict = prepared["page_results_dict"]
+        previous_sections = dict((self.manifest.get(doc_id) or {}).get("sections", {}))
+        fingerprint = pipeline_fingerprint()
+        failed_sections = []
+        deduplicator = None
+        if DEDUP_CONFIG["ENABLED"]:
+            ## chunks of the document's unchanged sections stay in the collection and can be canonicals
+            kept_sections = await asyncio.to_thread(self._unchanged_sections, prepared, previous_sections, fingerprint)
+            deduplicator = new_deduplicator(doc_id, self.get_dense_vectors, kept_sections=kept_sections)
+        chunks_stored = await self.extract_content_session(prepared["pdf_bytes"], prepared["file_name"],
+                                                           prepared["lang"], page_results_dict,
+                                                           pages=prepared["pages"],
+                                                           previous_sections=previous_sections,
+                                                           deduplicator=deduplicator,
+                                                           fingerprint=fingerprint,
+                                                           failed_sections=failed_sections,
+                                                           apply_adv_rag=EXPANSION_CONFIG["ENABLED"])
+        if deduplicator is not None:
+            deduplicator.log_stats()
+
+        await self.remove_sections(doc_id, [name for name in previous_sections if name not in page_results_dict])
+
+        ## without a document-level hash the next run falls through to the section hashes and retries the failed ones
+        if failed_sections:
+            self.logger.warning(f"⚠️ {len(failed_sections)} sections of {doc_id} failed and are retried on the next run: "
+                                f"{', '.join(failed_sections)}")
+        else:
+            await asyncio.to_thread(self.manifest.complete, doc_id, prepared["pdf_hash"], fingerprint)
+        self.logger.info(f"✅ {doc_id}: stored {chunks_stored} chunks")
+        return {"doc_id": doc_id, "chunks_stored": chunks_stored, "failed_sections": failed_sections}
 
-            page_results_dict = self.look_for_session_pages(pdf_bytes, file_name, lang)
+    async def process_document(self, path: Path) -> Dict[str, Any]:
+        """
+        Parse one document, locate its sections, then chunk, embed and store its new or changed sections.
+        Returns the `ingest_document` result ("doc_id" is None when the document is unchanged).
+        """
+        prepared = await self.prepare_document(path)
+        if prepared is None:
+            return {"doc_id": None, "chunks_stored": 0, "failed_sections": []}
+        return await self.ingest_document(prepared)
 
-            with open(os.path.join(self.output_dir, file_name, 'content_results.json'), "w", encoding="utf-8") as f:
-                json.dump(page_results_dict, f, ensure_ascii=False, indent=4)
+    async def run_batch_expansion(self):
+        """
+        Offline pass of EXPANSION_CONFIG["MODE"] = "batch", run before ingestion: the chunks of every new or
+        changed section of the input documents are expanded through the Batch API in shared batch files, keyed
+        by their chunk id, so the corpus waits for one batch turnaround instead of one per section. Chunks
+        expanded by the previous pass are reused. Near-duplicates are only known during ingestion, so they are
+        expanded as well. Refuses to run unless ingestion expands chunks in "batch" mode, the only reader of
+        the results.
+        """
+        if not EXPANSION_CONFIG["ENABLED"] or EXPANSION_CONFIG["MODE"] != "batch":
+            raise ValueError(f"Ingestion would not use the batch results (EXPANSION_ENABLED="
+                             f"{EXPANSION_CONFIG['ENABLED']}, EXPANSION_MODE={EXPANSION_CONFIG['MODE']!r}); "
+                             f"set EXPANSION_ENABLED=true and EXPANSION_MODE=batch for both runs")
+        fingerprint = pipeline_fingerprint()
+        requests: Dict[str, str] = {}  # chunk id -> chunk text
+        for path in self.doc_path_list:
+            prepared = await self.prepare_document(path)
+            if prepared is None:
+                continue
+            previous_sections = (self.manifest.get(prepared["doc_id"]) or {}).get("sections", {})
+            unchanged = self._unchanged_sections(prepared, previous_sections, fingerprint)
+            for session_name, session_details in prepared["page_results_dict"].items():
+                page_range = self._section_page_range(session_details)
+                if page_range is None or session_name in unchanged:
+                    continue
+                blocks = slice_blocks(prepared["pages"], *page_range) if CHUNK_CONFIG["STRUCTURE_AWARE"] else None
+                md_sections = iter_slice_pages(prepared["pages"], *page_range)
+                for i, (text, _) in enumerate(self._iter_section_chunks(md_sections, blocks)):
+                    requests[self.make_chunk_id(prepared["doc_id"], session_name, i)] = text
+
+        previous = load_batch_expansions()
+        expansions = {chunk_key(text): previous[chunk_key(text)] for text in requests.values()
+                      if chunk_key(text) in previous}
+        pending = {chunk_id: text for chunk_id, text in requests.items() if chunk_key(text) not in expansions}
+        self.logger.info(f"📦 Batch expansion of {len(pending)} chunks ({len(requests) - len(pending)} reused)")
+        if pending:
+            results = await get_batch_expansion_client().expand(pending)
+            expansions.update({chunk_key(pending[chunk_id]): expansion for chunk_id, expansion in results.items()})
+            self.logger.info(f"✅ {len(results)}/{len(pending)} chunks expanded, the rest are expanded online")
+        save_batch_expansions(expansions)
+
+    async def main(self, num_workers: int = None):
 
-            # # Todo remove testing
-            # page_results_dict = {}
-            # pdf_bytes = ''
-            # file_name = ''
-            # lang = ''
-            # # Todo end
-            all_chunks = await self.extract_content_session(pdf_bytes, file_name, lang, page_results_dict)
-            chunks_stored = await self.insert_into_vdb(all_chunks)
+        self._initialize_collection()
 
+        num_workers = num_workers or INGEST_CONFIG["NUM_WORKERS"]
+        if num_workers > 1 and len(self.doc_path_list) > 1:
+            await self.main_parallel(num_workers)
+            return
 
+        ## document N+1 is parsed while document N is embedded and stored
+        document_queue = asyncio.Queue(maxsize=INGEST_CONFIG["QUEUE_SIZE"])
 
+        async def produce_documents():
+            try:
+                for path in self.doc_path_list:
+                    try:
+                        prepared = await self.prepare_document(path)
+                    except Exception as e:
+                        self.logger.error(f"❌ Failed to parse {path}: {e}")
+                        continue
+                    if prepared is not None:
+                        await document_queue.put(prepared)
+            finally:
+                await document_queue.put(None)
+
+        producer = asyncio.create_task(produce_documents())
+        try:
+            while (prepared := await document_queue.get()) is not None:
+                ## one failed document must not end the run; it is not marked complete, so the next run retries it
+                try:
+                    await self.ingest_document(prepared)
+                except Exception as e:
+                    self.logger.error(f"❌ Ingestion of {prepared['doc_id']} failed: {e}")
+            await producer
+        finally:
+            producer.cancel()
+            if get_llm_cache() is not None:
+                get_llm_cache().log_stats()
+
+    async def main_parallel(self, num_workers: int):
+        """
+        Ingest documents concurrently, one document per worker process. Parsing, the contents LLM call,
+        chunking, embedding and storing run in the workers; the manifest and the corpus index are shared files.
+        """
+        num_workers = min(num_workers, len(self.doc_path_list))
+        self.logger.info(f"🚀 Ingesting {len(self.doc_path_list)} documents with {num_workers} worker processes")
+
+        loop = asyncio.get_running_loop()
+        ## spawn: torch/onnxruntime state must not be forked into the workers
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_ingestion_worker,
+                                 initargs=(num_workers,)) as executor:
+            futures = {loop.run_in_executor(executor, _ingest_document, path): path
+                       for path in self.doc_path_list}
+            for future in asyncio.as_completed(futures):
+                try:
+                    result = await future
+                except Exception as e:
+                    self.logger.error(f"❌ Ingestion failed: {e}")
+                    continue
+                if result["failed_sections"]:
+                    self.logger.warning(f"⚠️ {result['doc_id']}: {len(result['failed_sections'])} sections failed")
+
+
+_worker_processor: PDFProcessor = None
+_worker_loop: asyncio.AbstractEventLoop = None
+
+
+def _init_ingestion_worker(num_workers: int):
+    """Build one PDFProcessor and one event loop per worker process and split the CPU threads between workers"""
+    global _worker_processor, _worker_loop
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+    ## the async clients the processor keeps (LLM, embedding, batch API) are bound to the loop they first ran on,
+    ## so every document of this worker runs on the same loop instead of a fresh `asyncio.run` each
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    _worker_processor = PDFProcessor()
+    ## the parent created or checked the collection; each worker still adopts its key, vector dtype and fields
+    _worker_processor._initialize_collection()
+
+
+def _ingest_document(path: Path) -> Dict[str, Any]:
+    result = _worker_loop.run_until_complete(_worker_processor.process_document(path))
+    if get_llm_cache() is not None:
+        get_llm_cache().log_stats()
+    return result
 
 
 if __name__ == '__main__':
 
+    arg_parser = argparse.ArgumentParser(description="Ingest the PDF documents of the input folder")
+    arg_parser.add_argument("--batch-expansion", action="store_true",
+                            help="Only run the offline Batch API expansion pass for the next ingestion")
+    args = arg_parser.parse_args()
+
     pdf_processor = PDFProcessor()
-    asyncio.run(pdf_processor.main())
+    if args.batch_expansion:
+        asyncio.run(pdf_processor.run_batch_expansion())
+    else:
+        asyncio.run(pdf_processor.main())
 
 
 
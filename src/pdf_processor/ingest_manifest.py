@@ -0,0 +1,112 @@
+"""
+Content-hash manifest of what has been ingested into the vector DB.
+
+    {doc_id: {"pdf_hash": ..., "fingerprint": ...,
+              "sections": {session_name: {"hash": ..., "fingerprint": ..., "chunk_count": n}}}}
+
+Re-ingestion compares against it to skip unchanged documents and sections. "fingerprint" identifies the
+chunking/dedup/embedding settings the entry was produced with, so changing them re-ingests everything.
+Sections are recorded as they are stored; the document-level "pdf_hash" only once every section is stored.
+Ingestion workers share the file: every change is applied to its latest contents under a file lock.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Optional
+
+from src.config import CHUNK_CONFIG, DEDUP_CONFIG, EMBEDDING_CONFIG, EXPANSION_CONFIG, VECTOR_CONFIG
+
+
+def content_hash(data) -> str:
+    """sha256 of a str/bytes, or of the concatenation of a stream of str pieces"""
+    if isinstance(data, (str, bytes)):
+        data = [data]
+    digest = hashlib.sha256()
+    for piece in data:
+        digest.update(piece.encode("utf-8") if isinstance(piece, str) else piece)
+    return digest.hexdigest()
+
+
+def pipeline_fingerprint() -> str:
+    """Hash of the settings that decide which chunks and vectors a section turns into"""
+    settings = {
+        "chunking": {key: CHUNK_CONFIG[key] for key in ("SPLITTER", "STRUCTURE_AWARE", "CHUNK_MAX_TOK", "OVERLAP",
+                                                        "CHUNK_MAX_CHARS", "ENCODING")},
+        "dedup": {key: DEDUP_CONFIG[key] for key in ("ENABLED", "CROSS_CORPUS", "THRESHOLD", "NUM_PERM",
+                                                     "SHINGLE_SIZE", "MIN_SHINGLES")},
+        "embedding": {"backend": EMBEDDING_CONFIG["BACKEND"],
+                      "model": (EMBEDDING_CONFIG["LOCAL_MODEL"] if EMBEDDING_CONFIG["BACKEND"] == "local"
+                                else EMBEDDING_CONFIG["MODEL_ID"]),
+                      "dim": VECTOR_CONFIG["DIM"]},
+    }
+    if EXPANSION_CONFIG["ENABLED"]:
+        ## only when enabled, so collections ingested without expansion keep their fingerprint
+        settings["expansion"] = {"mode": EXPANSION_CONFIG["MODE"]}
+    return content_hash(json.dumps(settings, sort_keys=True))[:16]
+
+
+class IngestManifest:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.docs: Dict[str, Dict[str, Any]] = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextmanager
+    def _locked(self):
+        """Reload under an exclusive lock, apply the change, save"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.docs = self._read()
+                yield self.docs
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self.docs.get(doc_id)
+
+    def is_unchanged(self, doc_id: str, pdf_hash: str, fingerprint: str) -> bool:
+        entry = self.docs.get(doc_id)
+        return entry is not None and entry.get("pdf_hash") == pdf_hash and entry.get("fingerprint") == fingerprint
+
+    @staticmethod
+    def section_unchanged(section_entry: Optional[Dict[str, Any]], section_hash: str, fingerprint: str) -> bool:
+        return (section_entry is not None and section_entry.get("hash") == section_hash
+                and section_entry.get("fingerprint") == fingerprint)
+
+    def update_section(self, doc_id: str, session_name: str, section_entry: Dict[str, Any]):
+        """Record a stored section; the document counts as changed until `complete`"""
+        with self._locked() as docs:
+            entry = docs.setdefault(doc_id, {"sections": {}})
+            entry.update(pdf_hash=None, fingerprint=None)
+            entry["sections"][session_name] = section_entry
+
+    def remove_sections(self, doc_id: str, session_names: Iterable[str]):
+        with self._locked() as docs:
+            sections = docs.get(doc_id, {}).get("sections", {})
+            for session_name in session_names:
+                sections.pop(session_name, None)
+
+    def complete(self, doc_id: str, pdf_hash: str, fingerprint: str):
+        """Every section of the document is stored"""
+        with self._locked() as docs:
+            entry = docs.setdefault(doc_id, {"sections": {}})
+            entry.update(pdf_hash=pdf_hash, fingerprint=fingerprint)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.docs, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,333 @@
+"""
+MinHash/LSH near-duplicate suppression between splitting and embedding.
+
+Annual reports repeat boilerplate (disclaimers, headers/footers, risk factors copied year to year). A chunk
+whose estimated Jaccard similarity to an already-kept chunk reaches DEDUP_CONFIG["THRESHOLD"] is linked to
+that canonical chunk: it is stored with the canonical's vector and `canonical_id`, and is neither embedded
+nor LLM-expanded again. Matching runs within the document (in memory) and against the corpus (a persistent
+SQLite LSH index of every stored canonical chunk).
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import mmh3
+import numpy as np
+
+from src.config import DEDUP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_SQL_BATCH = 500  # host parameters per IN (...) query
+_TOKEN = re.compile(r"[a-z0-9]+|[\u3400-\u9fff]")  # words, and single CJK characters
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve midpoint (1/b)^(1/r) is closest to, but not above, `threshold`"""
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        midpoint = (1 / bands) ** (1 / rows)
+        if midpoint <= threshold and threshold - midpoint < best_error:
+            best, best_error = (bands, rows), threshold - midpoint
+    return best
+
+
+class MinHasher:
+
+    def __init__(self, num_perm: int = DEDUP_CONFIG["NUM_PERM"], shingle_size: int = DEDUP_CONFIG["SHINGLE_SIZE"],
+                 seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        ## a*h + b stays below 2^63 for 32-bit shingle hashes, so uint64 arithmetic does not overflow
+        self._a = rng.randint(1, 1 << 29, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 29, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def shingles(self, text: str) -> set:
+        tokens = _TOKEN.findall(text.lower())
+        k = self.shingle_size
+        return {" ".join(tokens[i:i + k]) for i in range(max(len(tokens) - k + 1, 0))}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature (uint64[num_perm]); None when the text is too short to compare reliably"""
+        shingles = self.shingles(text)
+        if len(shingles) < DEDUP_CONFIG["MIN_SHINGLES"]:
+            return None
+        hashes = np.fromiter((mmh3.hash(shingle, signed=False) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return (((self._a[:, None] * hashes[None, :]) + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+    @staticmethod
+    def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of the two shingle sets"""
+        return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+def band_keys(signature: np.ndarray, bands: int, rows: int) -> List[int]:
+    """One signed 64-bit bucket key per band (band index is part of the key)"""
+    return [mmh3.hash64(signature[band * rows:(band + 1) * rows].tobytes(), seed=band)[0] for band in range(bands)]
+
+
+class MinHashIndex:
+    """Persistent LSH index of the canonical chunks stored in the collection"""
+
+    def __init__(self, path: str, bands: int, rows: int):
+        self.path = path
+        self.bands = bands
+        self.rows = rows
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        ## ingestion worker processes store sections concurrently, wait for each other's writes
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                session_name TEXT NOT NULL,
+                signature BLOB NOT NULL
+            )""")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_bucket ON buckets (bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_chunk ON buckets (chunk_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_signatures_section ON signatures (doc_id, session_name)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        banding = f"{bands}x{rows}"
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'banding'").fetchone()
+        if stored is not None and stored[0] != banding:
+            self._rebuild_buckets()
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('banding', ?)", (banding,))
+
+    def _rebuild_buckets(self):
+        """Re-band every stored signature after the threshold (and so the banding) changed"""
+        logger.info(f"Rebuilding near-duplicate buckets for {self.bands}x{self.rows} banding")
+        self._conn.execute("BEGIN")
+        self._conn.execute("DELETE FROM buckets")
+        for chunk_id, blob in self._conn.execute("SELECT chunk_id, signature FROM signatures").fetchall():
+            self._conn.executemany("INSERT INTO buckets (bucket, chunk_id) VALUES (?, ?)",
+                                   [(key, chunk_id) for key in
+                                    band_keys(np.frombuffer(blob, dtype=np.uint64), self.bands, self.rows)])
+        self._conn.execute("COMMIT")
+
+    def candidates(self, keys: Sequence[int], doc_id: str = None,
+                   kept_sections: Iterable[str] = ()) -> Dict[str, np.ndarray]:
+        """
+        {chunk_id: signature} of indexed chunks sharing at least one bucket with `keys`; chunks of `doc_id`
+        only from its `kept_sections`, the others are being replaced
+        """
+        kept_sections = set(kept_sections)
+        keys = list(set(keys))
+        chunk_ids = set()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT chunk_id FROM buckets WHERE bucket IN ({','.join('?' * len(batch))})", batch)
+                chunk_ids.update(chunk_id for chunk_id, in rows)
+
+            chunk_ids = list(chunk_ids)
+            found = {}
+            for i in range(0, len(chunk_ids), _SQL_BATCH):
+                batch = chunk_ids[i:i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, doc_id, session_name, signature FROM signatures "
+                    f"WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+                for chunk_id, chunk_doc_id, session_name, blob in rows:
+                    if chunk_doc_id != doc_id or session_name in kept_sections:
+                        found[chunk_id] = np.frombuffer(blob, dtype=np.uint64)
+        return found
+
+    def add(self, entries: Iterable[Tuple[str, str, str, bytes]]):
+        """Index (chunk_id, doc_id, session_name, signature bytes) entries"""
+        entries = list(entries)
+        if not entries:
+            return
+        bucket_rows = [(key, chunk_id) for chunk_id, _, _, blob in entries
+                       for key in band_keys(np.frombuffer(blob, dtype=np.uint64), self.bands, self.rows)]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._delete_chunks([entry[0] for entry in entries])
+            self._conn.executemany("INSERT INTO signatures (chunk_id, doc_id, session_name, signature) "
+                                   "VALUES (?, ?, ?, ?)", entries)
+            self._conn.executemany("INSERT INTO buckets (bucket, chunk_id) VALUES (?, ?)", bucket_rows)
+            self._conn.execute("COMMIT")
+
+    def remove_sections(self, doc_id: str, session_names: Iterable[str]):
+        """Drop the entries of sections that were deleted or replaced in the collection"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for session_name in session_names:
+                chunk_ids = [chunk_id for chunk_id, in self._conn.execute(
+                    "SELECT chunk_id FROM signatures WHERE doc_id = ? AND session_name = ?", (doc_id, session_name))]
+                self._delete_chunks(chunk_ids)
+            self._conn.execute("COMMIT")
+
+    def _delete_chunks(self, chunk_ids: List[str]):
+        for i in range(0, len(chunk_ids), _SQL_BATCH):
+            batch = chunk_ids[i:i + _SQL_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            self._conn.execute(f"DELETE FROM buckets WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM signatures WHERE chunk_id IN ({placeholders})", batch)
+
+
+class DocumentDeduplicator:
+    """
+    Near-duplicate matching for the chunks of one document: earlier chunks of the same document first, then
+    the corpus index. Chunks that are kept become canonical for the rest of the document, and their
+    signatures are collected in `new_entries` for the corpus index once their section is stored.
+    Indexed chunks of the document itself are only matched in `kept_sections` (unchanged sections that are
+    not re-ingested); the other sections of the document are being replaced.
+    """
+
+    def __init__(self,
+                 doc_id: str,
+                 hasher: MinHasher,
+                 index: Optional[MinHashIndex],
+                 fetch_vectors: Callable[[List[str]], Dict[str, np.ndarray]],
+                 threshold: float = DEDUP_CONFIG["THRESHOLD"],
+                 kept_sections: Iterable[str] = ()):
+        self.doc_id = doc_id
+        self.kept_sections = set(kept_sections)
+        self.hasher = hasher
+        self.index = index
+        self.fetch_vectors = fetch_vectors
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold, hasher.num_perm)
+
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[int, List[str]] = {}
+        self._pending: Dict[str, Tuple[str, np.ndarray]] = {}  # kept chunk id -> (session_name, signature), not embedded yet
+        self._section_chunks: Dict[str, List[str]] = {}  # session_name -> ids of its kept chunks
+        self.vectors: Dict[str, np.ndarray] = {}  # canonical chunk id -> vector
+        self.new_entries: List[Tuple[str, str, str, bytes]] = []
+        self.stats = {"chunks": 0, "doc_duplicates": 0, "corpus_duplicates": 0, "skipped_chars": 0}
+
+    def _best_match(self, signature: np.ndarray, candidates: Dict[str, np.ndarray]) -> Optional[str]:
+        best_id, best_similarity = None, self.threshold
+        for chunk_id, candidate in candidates.items():
+            similarity = self.hasher.similarity(signature, candidate)
+            if similarity >= best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        return best_id
+
+    def _doc_candidates(self, keys: List[int]) -> Dict[str, np.ndarray]:
+        return {chunk_id: self._signatures[chunk_id]
+                for key in keys for chunk_id in self._buckets.get(key, ())}
+
+    def match(self, chunk_ids: List[str], texts: List[str], session_name: str) -> List[Optional[str]]:
+        """
+        Canonical chunk id for each duplicate chunk, None for chunks to embed. Kept chunks are registered as
+        pending canonicals right away (so later chunks can match them); call `commit` with their vectors once
+        embedded, or `discard` the section if it failed. A duplicate's canonical vector is only guaranteed to be in
+        `vectors` once the canonical chunk is committed.
+        """
+        signatures = [self.hasher.signature(text) for text in texts]
+        keys = [band_keys(sig, self.bands, self.rows) if sig is not None else [] for sig in signatures]
+
+        corpus_matches: List[Optional[str]] = [None] * len(texts)
+        if self.index is not None:
+            candidates = self.index.candidates([key for chunk_keys in keys for key in chunk_keys],
+                                               doc_id=self.doc_id, kept_sections=self.kept_sections)
+            if candidates:
+                for i, sig in enumerate(signatures):
+                    if sig is not None:
+                        corpus_matches[i] = self._best_match(sig, candidates)
+                wanted = [chunk_id for chunk_id in set(corpus_matches) if chunk_id and chunk_id not in self.vectors]
+                if wanted:
+                    self.vectors.update(self.fetch_vectors(wanted))
+                ## a canonical that is no longer in the collection cannot lend its vector
+                corpus_matches = [chunk_id if chunk_id in self.vectors else None for chunk_id in corpus_matches]
+
+        canonical: List[Optional[str]] = []
+        for i, (chunk_id, text, sig) in enumerate(zip(chunk_ids, texts, signatures)):
+            self.stats["chunks"] += 1
+            match = None
+            if sig is not None:
+                match = self._best_match(sig, self._doc_candidates(keys[i]))
+                if match is not None:
+                    self.stats["doc_duplicates"] += 1
+                elif corpus_matches[i] is not None:
+                    match = corpus_matches[i]
+                    self.stats["corpus_duplicates"] += 1
+            if match is not None:
+                self.stats["skipped_chars"] += len(text)
+            elif sig is not None:
+                self._signatures[chunk_id] = sig
+                for key in keys[i]:
+                    self._buckets.setdefault(key, []).append(chunk_id)
+                self._pending[chunk_id] = (session_name, sig)
+                self._section_chunks.setdefault(session_name, []).append(chunk_id)
+            canonical.append(match)
+        return canonical
+
+    def keep_section(self, session_name: str):
+        """Mark a section of the document as unchanged: its indexed chunks can be canonicals"""
+        self.kept_sections.add(session_name)
+
+    def commit(self, chunk_ids: List[str], vectors):
+        """Record the vectors of embedded kept chunks and queue them for the corpus index"""
+        self.vectors.update(zip(chunk_ids, vectors))
+        for chunk_id in chunk_ids:
+            if chunk_id in self._pending:
+                session_name, sig = self._pending.pop(chunk_id)
+                self.new_entries.append((chunk_id, self.doc_id, session_name, sig.tobytes()))
+
+    def take_entries(self) -> List[Tuple[str, str, str, bytes]]:
+        """The collected corpus index entries, emptied"""
+        entries, self.new_entries = self.new_entries, []
+        return entries
+
+    def discard(self, session_name: str):
+        """
+        Forget every kept chunk of a section that is not stored, committed or not: none of them can be a
+        canonical for the rest of the document, nor be indexed
+        """
+        dropped = set(self._section_chunks.pop(session_name, ()))
+        for chunk_id in dropped:
+            self._signatures.pop(chunk_id, None)
+            self._pending.pop(chunk_id, None)
+            self.vectors.pop(chunk_id, None)
+        for key in list(self._buckets):
+            self._buckets[key] = [chunk_id for chunk_id in self._buckets[key] if chunk_id not in dropped]
+        self.new_entries = [entry for entry in self.new_entries if entry[0] not in dropped]
+
+    def log_stats(self):
+        duplicates = self.stats["doc_duplicates"] + self.stats["corpus_duplicates"]
+        logger.info(f"Near-duplicates in {self.doc_id}: {duplicates}/{self.stats['chunks']} chunks "
+                    f"({self.stats['doc_duplicates']} within the document, {self.stats['corpus_duplicates']} "
+                    f"in the corpus), {self.stats['skipped_chars']} characters not embedded or expanded")
+
+
+_hasher: Optional[MinHasher] = None
+_index: Optional[MinHashIndex] = None
+
+
+def get_minhash_index() -> MinHashIndex:
+    """
+    Process-wide corpus index. Every ingestion worker process writes to the same file: the WAL journal lets
+    readers run alongside a writer, writes are single BEGIN/COMMIT transactions that wait up to 30 s for the
+    other processes' (sqlite busy timeout), and a threading.Lock serializes the threads of one process
+    """
+    global _index
+    if _index is None:
+        bands, rows = lsh_bands(DEDUP_CONFIG["THRESHOLD"], DEDUP_CONFIG["NUM_PERM"])
+        _index = MinHashIndex(DEDUP_CONFIG["INDEX_PATH"], bands, rows)
+    return _index
+
+
+def new_deduplicator(doc_id: str, fetch_vectors: Callable[[List[str]], Dict[str, np.ndarray]],
+                     kept_sections: Iterable[str] = ()) -> DocumentDeduplicator:
+    global _hasher
+    if _hasher is None:
+        _hasher = MinHasher()
+    index = get_minhash_index() if DEDUP_CONFIG["CROSS_CORPUS"] else None
+    return DocumentDeduplicator(doc_id, _hasher, index, fetch_vectors, kept_sections=kept_sections)
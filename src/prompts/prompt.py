@@ -77,6 +77,43 @@ class DocPrompt:
     {format_instructions}
     """
 
+    KEYWORD_QA_PROMPT: str = """
+    You are an expert in document analysis. Given a text, do both of the following tasks.
+    
+    1. Extract meaningful keywords. The extracted keywords should reflect domain-specific knowledge,
+    such as finance, technology, or other specialized fields.
+    2. Generate essential questions that, when answered, capture the main points of the text.
+    Each question should be one line without numbering or prefixes.
+    You should generate no more than 8 questions. Each question must less than 30 tokens.
+    
+    <Text>
+    {chunk_text}
+    </Text>
+    
+    Please follow this format instruction:
+    {format_instructions}
+    """
+
+    PACKED_KEYWORD_QA_PROMPT: str = """
+    You are an expert in document analysis. You will be given several text chunks, each wrapped in a
+    <Chunk index="..."> tag. For EVERY chunk, independently of the others, do both of the following tasks.
+    
+    1. Extract meaningful keywords. The extracted keywords should reflect domain-specific knowledge,
+    such as finance, technology, or other specialized fields.
+    2. Generate essential questions that, when answered, capture the main points of the chunk.
+    Each question should be one line without numbering or prefixes.
+    You should generate no more than 8 questions per chunk. Each question must less than 30 tokens.
+    
+    Return exactly one entry per chunk, with "chunk_index" set to the index of its <Chunk> tag.
+    
+    <Chunks>
+    {chunks_text}
+    </Chunks>
+    
+    Please follow this format instruction:
+    {format_instructions}
+    """
+
 class QueryPrompt:
 
 
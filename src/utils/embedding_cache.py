@@ -0,0 +1,139 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Vectors are stored in SQLite as float16/float32 blobs, keyed by (embedding endpoint/model id, input type,
+text hash). Lookups are done in bulk so only the misses are sent to the embedding service, and the
+least recently used entries are evicted once the cache grows past its size budget.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SQL_BATCH = 500  # keys per IN (...) query, below SQLite's host parameter limit
+
+
+class EmbeddingCache:
+
+    def __init__(self, path: str, model_id: str, dtype: str = "float16", max_bytes: int = 2 * 1024 ** 3):
+        self.path = path
+        self.model_id = model_id
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def make_key(self, text: str, input_type: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\0{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Sequence[str], input_type: str) -> List[Optional[np.ndarray]]:
+        """Cached float32 vector for each text, None for misses"""
+        keys = [self.make_key(text, input_type) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence, input_type: str):
+        now = time.time()
+        rows = [(self.make_key(text, input_type), self.dtype.name,
+                 np.asarray(vector, dtype=self.dtype).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, dtype, vector, last_access) "
+                                   "VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._total_bytes += sum(len(row[2]) for row in rows)
+            if self._total_bytes > self.max_bytes:
+                ## replaced rows were counted twice above, recount before evicting
+                self._total_bytes = self._conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries down to 90% of the budget"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings "
+                                      "ORDER BY last_access LIMIT ?", (_SQL_BATCH,)).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+            evicted += len(rows)
+        logger.info(f"Evicted {evicted} cached embeddings, cache size now {self._total_bytes / 1024 ** 2:.0f} MB")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+
+class QueryEmbeddingLRU:
+    """
+    In-process LRU/TTL cache of query embeddings. Vectors are stored as read-only float32 arrays
+    and handed out as-is, so a hit costs neither a copy nor a round trip.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, np.ndarray]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        entry = self._entries.get(text)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                del self._entries[text]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(text)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, text: str, vector) -> np.ndarray:
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        self._entries[text] = (time.monotonic(), vector)
+        self._entries.move_to_end(text)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return vector
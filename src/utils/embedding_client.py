@@ -0,0 +1,246 @@
+"""
+Pooled, micro-batched client for the embedding service (EMB_URL).
+
+Speaks the service contract `{'input': [...], 'type': 'documents'|'query'} -> {'text': [...], 'vector': [...]}`,
+splits large inputs into micro-batches (by count and by characters), sends them concurrently over
+one shared connection pool, retries each batch with backoff and reassembles the vectors in input order.
+
+Vectors are decoded straight into contiguous float32 arrays: services that honour `'encoding': 'base64'`
+reply with little-endian bytes (`'vector'` as a base64 string, plus `'dtype'` and `'shape'`), plain JSON
+float lists are parsed with orjson. Callers get one (n, dim) array per call and pass row views onward.
+"""
+
+import asyncio
+import base64
+import logging
+import random
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+
+import httpx
+import numpy as np
+import orjson
+
+from src.config import EMB_URL, EMBEDDING_CONFIG, VECTOR_CONFIG
+from src.utils.embedding_cache import EmbeddingCache, QueryEmbeddingLRU
+
+logger = logging.getLogger(__name__)
+
+
+def decode_vectors(result: Dict[str, Any], n: Optional[int] = None) -> np.ndarray:
+    """float32 array from a service response; (n, dim) for a batch of `n` inputs, (dim,) for a single query"""
+    vector = result['vector']
+    if isinstance(vector, str):
+        dtype = np.dtype(result.get('dtype', 'float32')).newbyteorder('<')
+        array = np.frombuffer(base64.b64decode(vector), dtype=dtype)
+        if 'shape' in result:
+            array = array.reshape(result['shape'])
+        elif n is not None:
+            array = array.reshape(n, -1)
+        return array.astype(np.float32, copy=False)
+    return np.asarray(vector, dtype=np.float32)
+
+
+class EmbeddingClient:
+
+    def __init__(self,
+                 url: str = EMB_URL,
+                 max_batch_size: int = EMBEDDING_CONFIG["MAX_BATCH_SIZE"],
+                 max_batch_chars: int = EMBEDDING_CONFIG["MAX_BATCH_CHARS"],
+                 max_concurrency: int = EMBEDDING_CONFIG["MAX_CONCURRENCY"],
+                 max_retries: int = EMBEDDING_CONFIG["MAX_RETRIES"],
+                 backoff_seconds: float = EMBEDDING_CONFIG["BACKOFF_SECONDS"],
+                 timeout: float = EMBEDDING_CONFIG["TIMEOUT"],
+                 response_encoding: str = EMBEDDING_CONFIG["RESPONSE_ENCODING"],
+                 cache: Optional[EmbeddingCache] = None):
+        self.url = url
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = httpx.Timeout(timeout, connect=10)
+        self.response_encoding = response_encoding
+        self.cache = cache
+        self.query_cache = QueryEmbeddingLRU(EMBEDDING_CONFIG["QUERY_CACHE_SIZE"], EMBEDDING_CONFIG["QUERY_CACHE_TTL"])
+        self._inflight_queries: Dict[str, asyncio.Future] = {}
+
+        ## httpx clients and semaphores are bound to the event loop they were created on
+        self._loop = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            self._client = httpx.AsyncClient(verify=False, timeout=self.timeout, limits=limits)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight_queries = {}
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def iter_batches(self, texts: List[str]) -> Iterator[Tuple[int, List[str]]]:
+        """(offset, batch) micro-batches bounded by both item count and total characters"""
+        start = 0
+        batch: List[str] = []
+        batch_chars = 0
+        for i, text in enumerate(texts):
+            if batch and (len(batch) >= self.max_batch_size or batch_chars + len(text) > self.max_batch_chars):
+                yield start, batch
+                start, batch, batch_chars = i, [], 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            yield start, batch
+
+    async def _post(self, texts, input_type: str) -> Dict[str, Any]:
+        """Service response with 'vector' decoded to a float32 array"""
+        client = self._ensure_client()
+        payload = {'input': texts, 'type': input_type}
+        if self.response_encoding == 'base64':
+            payload['encoding'] = 'base64'
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await client.post(self.url, content=orjson.dumps(payload),
+                                                 headers={'Content-Type': 'application/json'})
+                response.raise_for_status()
+                result = orjson.loads(response.content)
+                n = None if isinstance(texts, str) else len(texts)
+                result['vector'] = decode_vectors(result, n)
+                return result
+            except (httpx.HTTPError, ValueError) as e:
+                if attempt == self.max_retries:
+                    raise
+                ## exponential backoff with jitter, without holding a concurrency slot while waiting
+                delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"Embedding batch failed ({e!r}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _embed_uncached(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 array, each batch copied once into its rows"""
+        if not texts:
+            return np.empty((0, VECTOR_CONFIG["DIM"]), dtype=np.float32)
+        batches = list(self.iter_batches(texts))
+        tasks = [asyncio.ensure_future(self._post(batch, 'documents')) for _, batch in batches]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            ## the section fails with the first batch that runs out of retries: stop the others and free their slots
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        vectors = None
+        for (offset, batch), result in zip(batches, results):
+            batch_vectors = result['vector']
+            if batch_vectors.ndim != 2 or len(batch_vectors) != len(batch):
+                raise ValueError(f"Embedding service returned {len(batch_vectors)} vectors for {len(batch)} inputs")
+            if vectors is None:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+            vectors[offset:offset + len(batch)] = batch_vectors
+        logger.info(f"Embedded {len(texts)} documents in {len(batches)} batches")
+        return vectors
+
+    async def embed_documents(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        {'text': texts, 'vector': (n, dim) float32 array} with rows in input order; raises if a batch keeps failing.
+        Iterating the array yields row views, which go into the Milvus insert rows without further copies.
+        """
+        if self.cache is None:
+            return {'text': list(texts), 'vector': await self._embed_uncached(texts)}
+
+        cached = await asyncio.to_thread(self.cache.get_many, texts, 'documents')
+        miss_idx = [i for i, vector in enumerate(cached) if vector is None]
+        miss_vectors = None
+        if miss_idx:
+            miss_texts = [texts[i] for i in miss_idx]
+            miss_vectors = await self._embed_uncached(miss_texts)
+            await asyncio.to_thread(self.cache.put_many, miss_texts, miss_vectors, 'documents')
+        logger.info(f"Embedding cache: {len(texts) - len(miss_idx)}/{len(texts)} hits")
+
+        if miss_vectors is not None:
+            dim = miss_vectors.shape[1]
+        else:
+            dim = cached[0].shape[0] if texts else VECTOR_CONFIG["DIM"]
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                vectors[i] = vector
+        if miss_idx:
+            vectors[miss_idx] = miss_vectors
+        return {'text': list(texts), 'vector': vectors}
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        """
+        Read-only float32 query vector. Hot queries are served from the in-process LRU without a copy;
+        concurrent requests for the same text share one in-flight lookup (single-flight).
+        """
+        vector = self.query_cache.get(text)
+        if vector is not None:
+            return vector
+
+        self._ensure_client()
+        inflight = self._inflight_queries.get(text)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_queries[text] = future
+        try:
+            vector = self.query_cache.put(text, await self._fetch_query(text))
+            future.set_result(vector)
+            return vector
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  ## mark retrieved; waiters re-raise it
+            raise
+        finally:
+            del self._inflight_queries[text]
+
+    async def _fetch_query(self, text: str):
+        if self.cache is not None:
+            cached = (await asyncio.to_thread(self.cache.get_many, [text], 'query'))[0]
+            if cached is not None:
+                return cached
+
+        vector = (await self._post(text, 'query'))['vector']
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, [text], [vector], 'query')
+        return vector
+
+
+_client: Optional[EmbeddingClient] = None
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """
+    Process-wide client, so every caller shares one connection pool and concurrency limit.
+    EMBEDDING_CONFIG["BACKEND"] = "local" embeds in-process with a CPU model instead of calling EMB_URL.
+    """
+    global _client
+    if _client is None:
+        local = EMBEDDING_CONFIG["BACKEND"] == "local"
+        cache = None
+        if EMBEDDING_CONFIG["CACHE_ENABLED"]:
+            model_id = (f"local|{EMBEDDING_CONFIG['LOCAL_ENGINE']}|{EMBEDDING_CONFIG['LOCAL_MODEL']}" if local
+                        else f"{EMB_URL}|{EMBEDDING_CONFIG['MODEL_ID']}")
+            cache = EmbeddingCache(EMBEDDING_CONFIG["CACHE_PATH"],
+                                   model_id=model_id,
+                                   dtype=EMBEDDING_CONFIG["CACHE_DTYPE"],
+                                   max_bytes=EMBEDDING_CONFIG["CACHE_MAX_BYTES"])
+        if local:
+            from src.utils.local_embedding import LocalEmbeddingClient
+            _client = LocalEmbeddingClient(cache=cache)
+        else:
+            _client = EmbeddingClient(cache=cache)
+    return _client
@@ -1,5 +1,19 @@
-from langchain_community.chat_models import ChatOpenAI
+from langchain_openai import ChatOpenAI
+from langchain_core.globals import set_llm_cache
 from dotenv import load_dotenv
+from src.config import RATE_LIMIT_CONFIG
+from src.utils.llm_cache import get_llm_cache
+from src.utils.rate_limiter import rate_limited_http_clients
 load_dotenv()
 
-llm = ChatOpenAI(model_name="gpt-4o", temperature=0)
\ No newline at end of file
+## every chain (and every model from get_llm_model) looks up identical calls in the persistent cache
+if get_llm_cache() is not None:
+    set_llm_cache(get_llm_cache())
+
+## sync and async calls of the shared chat model wait for the same rate limiter
+_http_clients = {}
+if RATE_LIMIT_CONFIG["ENABLED"]:
+    _http_clients["http_client"], _http_clients["http_async_client"] = rate_limited_http_clients(
+        "gpt-4o", **RATE_LIMIT_CONFIG["DEFAULT"])
+
+llm = ChatOpenAI(model_name="gpt-4o", temperature=0, **_http_clients)
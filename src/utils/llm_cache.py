@@ -0,0 +1,153 @@
+"""
+Persistent LLM response cache, installed as the LangChain global cache (`set_llm_cache`).
+
+Every chat model call made through a chain (`prompt | llm | parser`) is looked up by
+(model and call parameters, rendered prompt). The rendered prompt includes the parser's format
+instructions, so the parser schema is part of the key as well: changing a prompt or a schema only
+re-runs the calls it affects. Responses are stored in SQLite and the least recently used entries are
+evicted once the cache grows past its size budget.
+
+Only deterministic calls are cached: a model sampling at a temperature above 0 (or at the provider's
+default, when none is set) is expected to answer differently each time, so its calls always go out.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from src.config import LLM_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+## llm_string = serialized model ("temperature": 0.1 in its kwargs) + "---" + call parameters (('temperature', 0.7))
+_CALL_TEMPERATURE = re.compile(r"\('temperature', ([^)]+)\)")
+_MODEL_TEMPERATURE = re.compile(r'"temperature": ([^,}\s]+)')
+
+
+def llm_temperature(llm_string: str) -> Optional[float]:
+    """Sampling temperature of a call, a call parameter over the model's own; None when unset"""
+    for pattern in (_CALL_TEMPERATURE, _MODEL_TEMPERATURE):
+        match = pattern.search(llm_string)
+        if match:
+            try:
+                return float(match.group(1))
+            except ValueError:
+                return None
+    return None
+
+
+class PersistentLLMCache(BaseCache):
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        ## ingestion worker processes share the file, wait for each other's writes
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                generations TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._total_bytes = self._size()
+
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(generations)), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        """`llm_string` identifies the model and its parameters, `prompt` is the serialized rendered prompt"""
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cacheable(llm_string: str) -> bool:
+        return llm_temperature(llm_string) == 0
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if not self.cacheable(llm_string):
+            return None
+        key = self.make_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        if row is not None:
+            try:
+                generations = [loads(generation) for generation in json.loads(row[0])]
+            except Exception as e:
+                logger.warning(f"Dropping unreadable cached LLM response: {e}")
+                generations = None
+            if generations:
+                self.hits += 1
+                return generations
+        self.misses += 1
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if not self.cacheable(llm_string):
+            return
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, generations, last_access) VALUES (?, ?, ?)",
+                               (self.make_key(prompt, llm_string), generations, time.time()))
+            self._total_bytes += len(generations)
+            if self._total_bytes > self.max_bytes:
+                ## replaced rows and other processes' writes are not tracked, recount before evicting
+                self._total_bytes = self._size()
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Drop least recently used responses down to 90% of the budget"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute("SELECT key, LENGTH(generations) FROM responses "
+                                      "ORDER BY last_access LIMIT 500").fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+            evicted += len(rows)
+        logger.info(f"Evicted {evicted} cached LLM responses, cache size now {self._total_bytes / 1024 ** 2:.0f} MB")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        if total:
+            logger.info(f"LLM cache: {self.hits}/{total} calls served from cache "
+                        f"({self._total_bytes / 1024 ** 2:.0f} MB on disk)")
+
+
+_llm_cache: Optional[PersistentLLMCache] = None
+
+
+def get_llm_cache() -> Optional[PersistentLLMCache]:
+    """Process-wide cache (None when LLM_CACHE_CONFIG["ENABLED"] is off)"""
+    global _llm_cache
+    if _llm_cache is None and LLM_CACHE_CONFIG["ENABLED"]:
+        _llm_cache = PersistentLLMCache(LLM_CACHE_CONFIG["PATH"], LLM_CACHE_CONFIG["MAX_BYTES"])
+    return _llm_cache
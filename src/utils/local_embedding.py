@@ -0,0 +1,224 @@
+"""
+Offline CPU embedding backend.
+
+Runs a local ONNX (fastembed) or sentence-transformers model behind the same
+`{'input', 'type'} -> {'text', 'vector'}` contract as the remote EMB_URL service, either in-process
+(EMBEDDING_CONFIG["BACKEND"] = "local") or as a small local server:
+
+    python -m src.utils.local_embedding --host 127.0.0.1 --port 8001
+
+with EMBEDDING_END_POINT=http://127.0.0.1:8001/ for the ingestion process.
+
+Concurrent requests are coalesced into model batches (dynamic batching) and the batches run on a
+thread pool sized to the CPU cores; each model call uses one intra-op thread so batches run side by side.
+"""
+
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.config import EMBEDDING_CONFIG
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.embedding_client import EmbeddingClient
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbeddingModel:
+    """Dynamic batcher in front of a local CPU embedding model"""
+
+    def __init__(self,
+                 model_name: str = EMBEDDING_CONFIG["LOCAL_MODEL"],
+                 engine: str = EMBEDDING_CONFIG["LOCAL_ENGINE"],
+                 max_batch_size: int = EMBEDDING_CONFIG["LOCAL_BATCH_SIZE"],
+                 max_wait_ms: float = EMBEDDING_CONFIG["LOCAL_BATCH_WAIT_MS"],
+                 num_threads: Optional[int] = EMBEDDING_CONFIG["LOCAL_THREADS"]):
+        self.model_name = model_name
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="local-embedding")
+        self._model = None
+        ## batches run on several executor threads; only the first one loads the model, the others wait for it
+        self._model_lock = threading.RLock()
+        self._warmed_up = False
+
+        ## pending (text, future) per input type, bound to the event loop they were created on
+        self._loop = None
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def _load_model(self):
+        if self._model is not None:
+            return self._model
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Loading local embedding model {self.model_name} ({self.engine}, {self.num_threads} threads)")
+                if self.engine == "fastembed":
+                    from fastembed import TextEmbedding
+                    self._model = TextEmbedding(self.model_name, threads=1)
+                elif self.engine == "sentence-transformers":
+                    import torch
+                    from sentence_transformers import SentenceTransformer
+                    torch.set_num_threads(1)
+                    self._model = SentenceTransformer(self.model_name, device="cpu")
+                else:
+                    raise ValueError(f"Unknown local embedding engine {self.engine!r}")
+        return self._model
+
+    def warm_up(self):
+        """Load the model and run one tiny batch, once, so the first real batches do not pay for it"""
+        with self._model_lock:
+            if not self._warmed_up:
+                self.encode(["warm up"], "documents")
+                self._warmed_up = True
+
+    def encode(self, texts: List[str], input_type: str) -> np.ndarray:
+        """Blocking (len(texts), dim) float32 array; runs on the thread pool"""
+        model = self._load_model()
+        if self.engine == "fastembed":
+            if input_type == "query":
+                vectors = model.query_embed(texts)
+            else:
+                vectors = model.passage_embed(texts, batch_size=len(texts))
+            return np.stack(list(vectors)).astype(np.float32, copy=False)
+        return model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                            normalize_embeddings=True).astype(np.float32, copy=False)
+
+    def _bind_loop(self, loop):
+        if self._loop is not loop:
+            self._loop = loop
+            self._pending = {}
+            self._flush_handle = None
+
+    async def embed(self, texts: List[str], input_type: str) -> List[np.ndarray]:
+        """Queue `texts` for the next model batches and wait for their vectors"""
+        loop = asyncio.get_running_loop()
+        self._bind_loop(loop)
+        pending = self._pending.setdefault(input_type, [])
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            pending.append((text, future))
+            futures.append(future)
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(full_only=True)
+        if self._flush_handle is None and any(self._pending.values()):
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await asyncio.gather(*futures)
+
+    def _flush(self, full_only: bool = False):
+        """Dispatch pending texts to the thread pool in batches of at most `max_batch_size`"""
+        if not full_only:
+            self._flush_handle = None
+        for input_type, pending in self._pending.items():
+            while len(pending) >= self.max_batch_size or (pending and not full_only):
+                batch, pending[:] = pending[:self.max_batch_size], pending[self.max_batch_size:]
+                asyncio.ensure_future(self._run_batch(batch, input_type))
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]], input_type: str):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self.encode, texts, input_type)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    async def handle(self, payload: dict) -> dict:
+        """
+        Serve one request of the EMB_URL contract; a str input gets a single vector back.
+        With `'encoding': 'base64'` the vectors are returned as little-endian float32 bytes.
+        """
+        texts = payload['input']
+        input_type = payload.get('type', 'documents')
+        if isinstance(texts, str):
+            vectors = (await self.embed([texts], input_type))[0]
+        else:
+            vectors = np.stack(await self.embed(texts, input_type)) if texts else np.empty((0, 0), np.float32)
+        if payload.get('encoding') == 'base64':
+            return {'text': texts,
+                    'vector': base64.b64encode(vectors.astype('<f4').tobytes()).decode('ascii'),
+                    'dtype': 'float32',
+                    'shape': list(vectors.shape)}
+        return {'text': texts, 'vector': vectors.tolist()}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class LocalEmbeddingClient(EmbeddingClient):
+    """EmbeddingClient that embeds in-process instead of posting to EMB_URL; caching and batching are shared"""
+
+    def __init__(self, model: Optional[LocalEmbeddingModel] = None, cache: Optional[EmbeddingCache] = None):
+        self.model = model or LocalEmbeddingModel()
+        super().__init__(url=f"local://{self.model.model_name}", max_batch_size=self.model.max_batch_size,
+                         max_concurrency=self.model.num_threads, max_retries=0, cache=cache)
+
+    def _ensure_client(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight_queries = {}
+            ## warm the model up off the event loop before the first batch, as the server does at startup
+            self._warm_up = loop.run_in_executor(self.model._executor, self.model.warm_up)
+        return None
+
+    async def _post(self, texts, input_type: str) -> Dict:
+        self._ensure_client()
+        await self._warm_up
+        if isinstance(texts, str):
+            return {'text': texts, 'vector': (await self.model.embed([texts], input_type))[0]}
+        return {'text': texts, 'vector': np.stack(await self.model.embed(texts, input_type))}
+
+    async def aclose(self):
+        self.model.shutdown()
+
+
+def create_app(model: Optional[LocalEmbeddingModel] = None):
+    """FastAPI app serving the EMB_URL contract on POST /"""
+    from fastapi import FastAPI
+
+    model = model or LocalEmbeddingModel()
+    app = FastAPI(title="Local embedding service")
+
+    @app.post("/")
+    async def embed(payload: dict):
+        return await model.handle(payload)
+
+    @app.get("/health")
+    async def health():
+        return {"model": model.model_name, "engine": model.engine, "threads": model.num_threads}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a local CPU embedding model over the EMB_URL contract")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--model", default=EMBEDDING_CONFIG["LOCAL_MODEL"])
+    parser.add_argument("--engine", default=EMBEDDING_CONFIG["LOCAL_ENGINE"],
+                        choices=["fastembed", "sentence-transformers"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    local_model = LocalEmbeddingModel(model_name=args.model, engine=args.engine)
+    local_model.warm_up()
+    uvicorn.run(create_app(local_model), host=args.host, port=args.port)
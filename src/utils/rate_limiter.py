@@ -0,0 +1,235 @@
+"""
+Client-side rate limiting for LLM calls.
+
+One `AdaptiveRateLimiter` per model (MODEL_CONFIGS[task]["rate_limit"], RATE_LIMIT_CONFIG["DEFAULT"] otherwise)
+combines
+  - token buckets for requests and tokens per minute, kept in step with the endpoint's
+    x-ratelimit-remaining-* / x-ratelimit-limit-* response headers (limits left unset are learned from them),
+  - an AIMD concurrency limit: +1 slot per limit's worth of successful calls, halved on a 429, and
+  - a shared pause until retry-after / x-ratelimit-reset-* after a 429, so the SDK's retries do not all fire at once.
+
+The limiter sits in an httpx transport, so every request the OpenAI SDK sends for a chat model, sync or async,
+waits for a slot first:
+
+    sync_client, async_client = rate_limited_http_clients("openai/gpt-4.1-nano", rpm=500, tpm=200_000)
+    ChatOpenAI(..., http_client=sync_client, http_async_client=async_client)
+"""
+
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPLETION_TOKENS = 512  # Counted for a request without max_tokens
+POLL_SECONDS = 0.05  # Re-check interval while every concurrency slot is taken
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of a rate-limit header value: "12", "1.5", "20ms", "6m0s" """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+
+def _header_float(headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holds at most a minute's worth; unlimited while None"""
+
+    def __init__(self, per_minute: Optional[float] = None):
+        self.per_minute = per_minute
+        self.level = per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` units are available; a cost above the capacity waits for a full bucket"""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        missing = min(cost, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, cost: float):
+        if self.per_minute:
+            self.level -= cost
+
+    def sync(self, remaining: Optional[float], limit: Optional[float], now: float):
+        """Follow the endpoint's view: learn the limit if unset and never believe in more than it has left"""
+        if limit and not self.per_minute:
+            self.per_minute, self.level = limit, limit
+        if remaining is not None and self.per_minute:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, name: str,
+                 rpm: Optional[float] = None,
+                 tpm: Optional[float] = None,
+                 max_concurrency: int = 16,
+                 min_concurrency: int = 1):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max(min_concurrency, max_concurrency // 2))  # AIMD limit, starts halfway
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: float) -> float:
+        """0 once a slot is taken, otherwise the seconds to wait before trying again"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.paused_until - now,
+                       self.requests.wait_time(1, now),
+                       self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            if self.in_flight >= int(self.concurrency):
+                return POLL_SECONDS
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire_sync(self, tokens: float):
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire(self, tokens: float):
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, status_code: Optional[int] = None, headers: Optional[httpx.Headers] = None):
+        """Free the slot and adapt to the response (None when the request failed without one)"""
+        headers = headers if headers is not None else httpx.Headers()
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.calls += 1
+            self.requests.sync(_header_float(headers, "x-ratelimit-remaining-requests"),
+                               _header_float(headers, "x-ratelimit-limit-requests"), now)
+            self.tokens.sync(_header_float(headers, "x-ratelimit-remaining-tokens"),
+                             _header_float(headers, "x-ratelimit-limit-tokens"), now)
+
+            if status_code == 429:
+                self.throttled += 1
+                retry_after = (parse_duration(headers.get("retry-after"))
+                               or max(parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                                      parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+                               or 1.0)
+                self.paused_until = max(self.paused_until, now + retry_after)
+                ## one decrease per burst: the other 429s of the same wave were already in flight
+                if now - self.last_decrease > retry_after:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self.last_decrease = now
+                    logger.warning(f"{self.name}: rate limited, concurrency -> {int(self.concurrency)}, "
+                                   f"pausing {retry_after:.1f}s")
+            elif status_code is not None and status_code < 400:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "throttled": self.throttled, "concurrency": int(self.concurrency),
+                "rpm": self.requests.per_minute, "tpm": self.tokens.per_minute}
+
+
+def estimate_tokens(request: httpx.Request) -> float:
+    """Prompt tokens (about 4 bytes each) plus the completion budget of a chat/completions request"""
+    if not request.url.path.endswith("completions"):
+        return 0
+    try:
+        body = request.content
+        payload = json.loads(body)
+    except Exception:
+        return 0
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return len(body) / 4 + completion
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+
+    def __init__(self, limiter: AdaptiveRateLimiter, transport: Optional[httpx.BaseTransport] = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.limiter.acquire_sync(estimate_tokens(request))
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+        self.limiter.release(response.status_code, response.headers)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, limiter: AdaptiveRateLimiter, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.acquire(estimate_tokens(request))
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+        self.limiter.release(response.status_code, response.headers)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, **limits) -> AdaptiveRateLimiter:
+    """Process-wide limiter per model name; `limits` only apply when it is first created"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveRateLimiter(name, **limits)
+        return _limiters[name]
+
+
+def rate_limited_http_clients(name: str, **limits) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """(sync, async) httpx clients whose requests go through the `name` limiter"""
+    limiter = get_rate_limiter(name, **limits)
+    return (httpx.Client(transport=RateLimitedTransport(limiter), timeout=None),
+            httpx.AsyncClient(transport=AsyncRateLimitedTransport(limiter), timeout=None))
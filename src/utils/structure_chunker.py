@@ -0,0 +1,114 @@
+"""
+Structure-aware chunking from MinerU content-list blocks.
+
+Whole blocks (paragraphs, tables, equations) are packed into chunks of at most CHUNK_CONFIG["CHUNK_MAX_TOK"]
+tokens. A new heading starts a new chunk, so a chunk never straddles two sections, and no overlap is needed
+because blocks are never cut; only a single block over the budget is split with the token splitter.
+Each chunk carries its heading path ("Annual Report > Risk Factors > Credit risk").
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from src.config import CHUNK_CONFIG
+from src.utils.token_splitter import TokenSplitter
+
+HEADING_SEPARATOR = " > "
+MAX_HEADING_PATH_CHARS = 300  # Milvus heading_path is VARCHAR(1000) bytes
+
+
+def block_text(block: Dict) -> str:
+    """Text of one content-list block; images keep only their captions"""
+    block_type = block.get("type")
+    if block_type == "table":
+        ## one row per line, so an over-budget table is split between rows
+        table_body = block.get("table_body", "").replace("</tr>", "</tr>\n")
+        parts = block.get("table_caption", []) + [table_body] + block.get("table_footnote", [])
+    elif block_type == "image":
+        parts = block.get("img_caption", []) + block.get("img_footnote", [])
+    else:
+        parts = [block.get("text", "")]
+    return "\n".join(part.strip() for part in parts if part and part.strip())
+
+
+class StructureChunker:
+
+    def __init__(self,
+                 chunk_max_tok: int = CHUNK_CONFIG["CHUNK_MAX_TOK"],
+                 max_chars: int = CHUNK_CONFIG["CHUNK_MAX_CHARS"]):
+        self.chunk_max_tok = chunk_max_tok
+        self.max_chars = max_chars
+        ## only used for blocks that are over budget on their own, so no overlap
+        self.splitter = TokenSplitter(chunk_max_tok=chunk_max_tok, overlap=0, max_chars=max_chars)
+        ## blocks are joined by a blank line, which is tokens of its own
+        self.separator_tokens = self.splitter.count_tokens("\n\n")
+
+    @staticmethod
+    def _heading_path(headings: List[str]) -> str:
+        path = HEADING_SEPARATOR.join(headings)
+        if len(path) > MAX_HEADING_PATH_CHARS:
+            path = "..." + path[-(MAX_HEADING_PATH_CHARS - 3):]
+        return path
+
+    def iter_chunks(self, blocks: Iterable[Dict]) -> Iterator[Dict[str, str]]:
+        """{'content', 'heading_path'} per chunk, in document order"""
+        headings: List[str] = []
+        parts: List[str] = []
+        tokens = chars = 0
+        has_body = False
+        path = ""
+
+        def flush():
+            return {"content": "\n\n".join(parts), "heading_path": path}
+
+        for block in blocks:
+            text = block_text(block)
+            if not text:
+                continue
+            level = block.get("text_level")
+            if level:
+                ## a heading closes the current chunk; consecutive headings stay together with the body that follows
+                if has_body:
+                    yield flush()
+                    parts, tokens, chars, has_body = [], 0, 0, False
+                headings = headings[:max(level, 1) - 1] + [text]
+                path = self._heading_path(headings)
+                text = "#" * min(level, 6) + " " + text
+            n_tokens = self.splitter.count_tokens(text)
+
+            if n_tokens > self.chunk_max_tok or len(text) > self.max_chars:
+                if has_body:
+                    yield flush()
+                    parts = []
+                ## headings still waiting for their body are split together with it, so the first piece keeps
+                ## them and stays within the budget
+                for piece in self.splitter.iter_chunks("\n\n".join(parts + [text])):
+                    parts = [piece]
+                    yield flush()
+                parts, tokens, chars, has_body = [], 0, 0, False
+                continue
+
+            if parts and (tokens + self.separator_tokens + n_tokens > self.chunk_max_tok
+                          or chars + len(text) + 2 > self.max_chars):
+                yield flush()
+                parts, tokens, chars, has_body = [], 0, 0, False
+                path = self._heading_path(headings)
+            tokens += n_tokens + (self.separator_tokens if parts else 0)
+            parts.append(text)
+            chars += len(text) + 2
+            has_body = has_body or not level
+
+        if parts:
+            yield flush()
+
+    def chunk(self, blocks: List[Dict]) -> List[Dict[str, str]]:
+        return list(self.iter_chunks(blocks))
+
+
+_chunker: Optional[StructureChunker] = None
+
+
+def get_structure_chunker() -> StructureChunker:
+    global _chunker
+    if _chunker is None:
+        _chunker = StructureChunker()
+    return _chunker
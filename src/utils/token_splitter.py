@@ -0,0 +1,222 @@
+"""
+Token-aware, single-pass text splitter.
+
+The text is scanned once into sentence/line units (each unit keeps its trailing whitespace, so units are
+contiguous spans of the input), units are token-counted in tiktoken batch calls and then packed
+greedily into chunks of at most CHUNK_CONFIG["CHUNK_MAX_TOK"] tokens. Chunks are yielded as they complete,
+from a string or a stream of text pieces. Chunks are plain slices of the input,
+the overlap is made of whole trailing units up to CHUNK_CONFIG["OVERLAP"] tokens, and units longer than
+the budget are cut at token boundaries.
+
+Benchmark against the NLTK splitter on parsed reports (markdown files, or the parse cache JSON files):
+    python -m src.utils.token_splitter output/parse_cache
+"""
+
+import argparse
+import os
+import re
+import time
+from collections import deque
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import tiktoken
+
+from src.config import CHUNK_CONFIG
+
+## paragraph breaks, line breaks and whitespace after sentence punctuation (latin and CJK)
+_BOUNDARY = re.compile(r"\n\s*\n|\n|(?<=[.!?;。！？；])\s+|(?<=[。！？；])")
+
+Span = Tuple[int, int, int]  # (start char, end char, tokens)
+ENCODE_BATCH = 256  # units token-counted per tiktoken call
+
+
+class TokenSplitter:
+
+    def __init__(self,
+                 chunk_max_tok: int = CHUNK_CONFIG["CHUNK_MAX_TOK"],
+                 overlap: int = CHUNK_CONFIG["OVERLAP"],
+                 max_chars: int = CHUNK_CONFIG["CHUNK_MAX_CHARS"],
+                 encoding_name: str = CHUNK_CONFIG["ENCODING"]):
+        if overlap >= chunk_max_tok:
+            raise ValueError(f"Overlap ({overlap}) must be smaller than the chunk size ({chunk_max_tok})")
+        self.chunk_max_tok = chunk_max_tok
+        self.overlap = overlap
+        self.max_chars = max_chars
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    @staticmethod
+    def _iter_units(text: str, start: int = 0, final: bool = True) -> Iterator[Tuple[int, int]]:
+        """
+        (start, end) units of text[start:]. Unless `final`, units are only yielded up to the last boundary
+        followed by non-whitespace: a boundary within the trailing whitespace can still grow with the next
+        piece ("\n" + "\n" is one paragraph break), and the trailing unit has no boundary yet.
+        """
+        limit = len(text) if final else len(text.rstrip())
+        for match in _BOUNDARY.finditer(text, start):
+            if not final and match.end() >= limit:
+                break
+            if match.end() > start:
+                yield start, match.end()
+                start = match.end()
+        if final and start < len(text):
+            yield start, len(text)
+
+    def _cut_long_unit(self, text: str, start: int, end: int) -> Iterator[Span]:
+        """Cut one over-budget unit at token boundaries, then at `max_chars` if tokens are unusually long"""
+        unit = text[start:end]
+        tokens = self.encoding.encode_ordinary(unit)
+        ## character offsets of the tokens; tiktoken replaces lone surrogates one for one, so they index `unit`
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        offsets.append(len(unit))
+        i = 0
+        while i < len(tokens):
+            j = min(i + self.chunk_max_tok, len(tokens))
+            while offsets[j] == offsets[i]:  ## the cut fell inside the first character (CJK takes several tokens)
+                j += 1
+            ## a cut inside a character moves to its start, and a slice can tokenize differently: count the slice
+            while (n_tokens := self.count_tokens(unit[offsets[i]:offsets[j]])) > self.chunk_max_tok:
+                j -= 1
+                if offsets[j] == offsets[i]:
+                    j += 1
+                    break
+            piece_start, piece_end = start + offsets[i], start + offsets[j]
+            if piece_end - piece_start <= self.max_chars:
+                yield piece_start, piece_end, n_tokens
+            else:
+                for char_start in range(piece_start, piece_end, self.max_chars):
+                    char_end = min(char_start + self.max_chars, piece_end)
+                    yield char_start, char_end, self.count_tokens(text[char_start:char_end])
+            i = j
+
+    def _count_units(self, text: str, units: List[Tuple[int, int]]) -> Iterator[Span]:
+        counts = self.encoding.encode_ordinary_batch([text[s:e] for s, e in units])
+        for (start, end), tokens in zip(units, counts):
+            if len(tokens) > self.chunk_max_tok or end - start > self.max_chars:
+                yield from self._cut_long_unit(text, start, end)
+            else:
+                yield start, end, len(tokens)
+
+    def spans(self, text: str, units: Iterable[Tuple[int, int]] = None) -> Iterator[Span]:
+        """Token-counted units (ENCODE_BATCH per tiktoken call), none of them over the token or character budget"""
+        batch = []
+        for unit in (units if units is not None else self._iter_units(text)):
+            batch.append(unit)
+            if len(batch) == ENCODE_BATCH:
+                yield from self._count_units(text, batch)
+                batch = []
+        if batch:
+            yield from self._count_units(text, batch)
+
+    def iter_chunks(self, text: Union[str, Iterable[str]]) -> Iterator[str]:
+        """
+        Yield chunks as soon as they are complete. `text` is a string or a stream of pieces (e.g. page markdown);
+        only the current window and the unscanned tail are kept, so memory does not grow with the input.
+        A stream yields the same chunks as the joined string, wherever the pieces are cut.
+        """
+        pieces = iter([text] if isinstance(text, str) else text)
+        buffer = ""
+        scanned = 0  # buffer position up to which units have been packed
+        window: deque = deque()  # (start, end, tokens) spans of the current chunk, buffer positions
+        window_tokens = 0
+        final = False
+        while not final:
+            piece = next(pieces, None)
+            final = piece is None
+            if piece:
+                buffer = buffer + piece if buffer else piece
+
+            for start, end, n_tokens in self.spans(buffer, self._iter_units(buffer, scanned, final)):
+                if window and (window_tokens + n_tokens > self.chunk_max_tok or end - window[0][0] > self.max_chars):
+                    chunk = buffer[window[0][0]:window[-1][1]].strip()
+                    if chunk:
+                        yield chunk
+                    ## carry whole trailing units as overlap, as long as the next unit still fits
+                    while window and (window_tokens > self.overlap
+                                      or window_tokens + n_tokens > self.chunk_max_tok
+                                      or end - window[0][0] > self.max_chars):
+                        window_tokens -= window.popleft()[2]
+                window.append((start, end, n_tokens))
+                window_tokens += n_tokens
+                scanned = end
+
+            ## drop the text that can no longer be part of a chunk
+            keep_from = window[0][0] if window else scanned
+            if keep_from > 0 and not final:
+                buffer = buffer[keep_from:]
+                window = deque((s - keep_from, e - keep_from, n) for s, e, n in window)
+                scanned -= keep_from
+
+        if window:
+            chunk = buffer[window[0][0]:window[-1][1]].strip()
+            if chunk:
+                yield chunk
+
+    def split(self, text: str) -> List[str]:
+        return list(self.iter_chunks(text))
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+
+_splitter: Optional[TokenSplitter] = None
+
+
+def get_token_splitter() -> TokenSplitter:
+    global _splitter
+    if _splitter is None:
+        _splitter = TokenSplitter()
+    return _splitter
+
+
+def _load_corpus(paths: List[str]) -> List[str]:
+    """Markdown files, or parse cache JSON files (pages stitched in order), from files or directories"""
+    import json
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, name) for name in sorted(names) if name.endswith((".md", ".json"))]
+        else:
+            files.append(path)
+
+    texts = []
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            if file.endswith(".json"):
+                pages = json.load(f).get("pages")
+                if not isinstance(pages, dict):
+                    continue
+                text = "\n\n".join(pages[i].get("md", "") for i in sorted(pages, key=int))
+            else:
+                text = f.read()
+        if text.strip():
+            texts.append(text)
+    return texts
+
+
+def benchmark(texts: List[str]):
+    """Print a markdown table comparing the NLTK splitter and this splitter on `texts`"""
+    from src.utils.utils import Utils
+
+    splitter = get_token_splitter()
+    print(f"{len(texts)} documents, {sum(len(t) for t in texts) / 1e6:.1f}M chars, "
+          f"budget {splitter.chunk_max_tok} tokens / {splitter.overlap} overlap\n")
+    print("| splitter | time (s) | chunks | mean tokens | max tokens | over budget | stored/input chars |")
+    print("|---|---:|---:|---:|---:|---:|---:|")
+    for name, split in (("nltk (legacy)", Utils.split_nltk), ("tiktoken", splitter.split)):
+        started = time.perf_counter()
+        chunks = [chunk for text in texts for chunk in split(text)]
+        elapsed = time.perf_counter() - started
+        tokens = [splitter.count_tokens(chunk) for chunk in chunks]
+        stored_chars = sum(len(chunk) for chunk in chunks)
+        print(f"| {name} | {elapsed:.2f} | {len(chunks)} | {sum(tokens) / max(len(tokens), 1):.0f} "
+              f"| {max(tokens, default=0)} | {sum(t > splitter.chunk_max_tok for t in tokens)} "
+              f"| {stored_chars / max(sum(len(t) for t in texts), 1):.2f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the token splitter against the NLTK splitter")
+    parser.add_argument("paths", nargs="+", help="Markdown files, parse cache JSON files, or directories of them")
+    args = parser.parse_args()
+    benchmark(_load_corpus(args.paths))
@@ -2,12 +2,15 @@
 This script is written by my colleague: Liu Chang @ AIDF-NUS
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator, Union
 import re
-import httpx
-from src.config import EMB_URL
 import traceback
+import numpy as np
 from langchain_text_splitters import NLTKTextSplitter
+from src.config import CHUNK_CONFIG
+from src.utils.embedding_client import get_embedding_client
+from src.utils.structure_chunker import get_structure_chunker
+from src.utils.token_splitter import get_token_splitter
 
 class Utils:
 
@@ -30,37 +33,53 @@ class Utils:
         return unique_entity_list, unique_entity_id_list
 
     @staticmethod
-    async def a_embed_documents(texts: List[str]) -> Optional[List[List[float]]]:
-        data = {'input': texts, 'type': 'documents'}
-        timeout = httpx.Timeout(600, connect=10)
-        async with httpx.AsyncClient(verify=False, timeout=timeout) as client:
-            try:
-                print("Sending request")
-                response = await client.post(EMB_URL, json=data)
-                print("Received response")
-                return response.json()
-            except Exception as e:
-                print(str(e))
-                traceback.print_exc()
-                return None
+    async def a_embed_documents(texts: List[str]) -> Optional[Dict[str, List]]:
+        """{'text': [...], 'vector': [...]}, embedded in pooled micro-batches; None if a batch keeps failing"""
+        try:
+            return await get_embedding_client().embed_documents(texts)
+        except Exception as e:
+            print(str(e))
+            traceback.print_exc()
+            return None
 
     @staticmethod
-    async def a_embed_query(texts: str) -> Optional[List[List[float]]]:
-        data = {'input': texts, 'type': 'query'}
-        timeout = httpx.Timeout(600, connect=10)
-        async with httpx.AsyncClient(verify=False, timeout=timeout) as client:
-            try:
-                print("Sending request")
-                response = await client.post(EMB_URL, json=data)
-                print("Received response")
-                return response.json()["vector"]
-            except Exception as e:
-                print(str(e))
-                traceback.print_exc()
-                return None
+    async def a_embed_query(texts: str) -> Optional[np.ndarray]:
+        """Query vector as a shared read-only float32 array (cached, concurrent duplicates coalesced)"""
+        try:
+            return await get_embedding_client().embed_query(texts)
+        except Exception as e:
+            print(str(e))
+            traceback.print_exc()
+            return None
 
     @staticmethod
     def split(text_to_split) -> List[str]:
+        """Chunks within the CHUNK_CONFIG token budget; CHUNK_CONFIG["SPLITTER"] = "nltk" keeps the character splitter"""
+        if CHUNK_CONFIG["SPLITTER"] == "token":
+            return get_token_splitter().split(text_to_split)
+        return Utils.split_nltk(text_to_split)
+
+    @staticmethod
+    def iter_split(text_to_split: Union[str, Iterable[str]]) -> Iterator[str]:
+        """Lazy `split`: chunks are yielded as they complete, from a string or a stream of text pieces"""
+        if CHUNK_CONFIG["SPLITTER"] == "token":
+            return get_token_splitter().iter_chunks(text_to_split)
+        if not isinstance(text_to_split, str):
+            text_to_split = "".join(text_to_split)
+        return iter(Utils.split_nltk(text_to_split))
+
+    @staticmethod
+    def split_blocks(blocks: List[Dict]) -> List[Dict[str, str]]:
+        """{'content', 'heading_path'} chunks packed from whole MinerU content-list blocks, no overlap"""
+        return get_structure_chunker().chunk(blocks)
+
+    @staticmethod
+    def iter_split_blocks(blocks: Iterable[Dict]) -> Iterator[Dict[str, str]]:
+        """Lazy `split_blocks`"""
+        return get_structure_chunker().iter_chunks(blocks)
+
+    @staticmethod
+    def split_nltk(text_to_split) -> List[str]:
         text_splitter = NLTKTextSplitter(
             chunk_size=1500,
             chunk_overlap=500,
@@ -98,8 +117,11 @@ class Utils:
         # Strategy 1: Try splitting at sentence boundaries
         sentences = text.split('.')
         if len(sentences) > 1:
-            current_chunk = ""
+            # Collect parts and join once per chunk instead of concatenating strings repeatedly
+            current_parts: List[str] = []
+            current_length = 0
             chunks = []
+            last_sentence = sentences[-1].strip()
 
             for sentence in sentences:
                 sentence = sentence.strip()
@@ -107,20 +129,22 @@ class Utils:
                     continue
 
                 # Add period back except for last sentence
-                sentence_with_period = sentence + "." if sentence != sentences[-1].strip() else sentence
+                sentence_with_period = sentence + "." if sentence != last_sentence else sentence
 
                 # Check if adding this sentence would exceed limit
-                if len(current_chunk) + len(sentence_with_period) + 1 <= max_length:
-                    current_chunk += (" " + sentence_with_period if current_chunk else sentence_with_period)
+                if current_length + len(sentence_with_period) + 1 <= max_length:
+                    current_length += len(sentence_with_period) + (1 if current_parts else 0)
+                    current_parts.append(sentence_with_period)
                 else:
                     # Save current chunk and start new one
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = sentence_with_period
+                    if current_parts:
+                        chunks.append(" ".join(current_parts))
+                    current_parts = [sentence_with_period]
+                    current_length = len(sentence_with_period)
 
             # Add the last chunk
-            if current_chunk:
-                chunks.append(current_chunk)
+            if current_parts:
+                chunks.append(" ".join(current_parts))
 
             # Check if all chunks are now within limit
             all_fit = all(len(chunk) <= max_length for chunk in chunks)
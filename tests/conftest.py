@@ -0,0 +1,44 @@
+import os
+import re
+
+import pytest
+
+## src.config needs a key at import; keep the tests off the persistent LLM cache and the rate limiter
+os.environ.setdefault("LITE_LLM_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_RATE_LIMIT_ENABLED", "false")
+
+_STUB_TOKEN = re.compile(r"[\u3400-\u9fff]|[A-Za-z0-9]{1,4}|\s+|.", re.S)
+
+
+class StubEncoding:
+    """
+    Offline stand-in for a tiktoken encoding: words are cut every 4 characters, whitespace runs and punctuation
+    are one token, and a CJK character takes two tokens (the first one decodes to nothing), like multi-byte
+    characters in cl100k_base. Tokens are the decoded pieces.
+    """
+
+    def encode_ordinary(self, text):
+        tokens = []
+        for piece in _STUB_TOKEN.findall(text):
+            tokens += ["", piece] if "\u3400" <= piece <= "\u9fff" else [piece]
+        return tokens
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode_with_offsets(self, tokens):
+        offsets, position = [], 0
+        for token in tokens:
+            offsets.append(position)
+            position += len(token)
+        return "".join(tokens), offsets
+
+
+@pytest.fixture
+def stub_tiktoken(monkeypatch):
+    """Token splitters built in the test count tokens with `StubEncoding` (no encoding download)"""
+    import tiktoken
+
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda encoding_name: StubEncoding())
@@ -0,0 +1,106 @@
+"""
+BatchExpansionClient against the in-module Batch API stand-in, with a stubbed LLM behind it:
+upload -> submit -> poll -> output mapping, failed and expired batches, and the online fallback.
+"""
+
+import asyncio
+import json
+import re
+from functools import partial
+
+import httpx
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.advance_rag import AdvanceDocProcessor
+from src.advance_rag import batch_expansion
+from src.advance_rag.batch_expansion import (BatchExpansionClient, chunk_key, create_app, load_batch_expansions,
+                                             save_batch_expansions)
+
+CHUNK = re.compile(r"chunk-\w+")
+
+
+def expansion_of(prompt: str) -> dict:
+    """Stub LLM answer: the chunk name of the prompt as keywords, so results can be traced back to chunks"""
+    name = CHUNK.search(prompt).group(0)
+    return {"keywords": f"kw {name}", "qa_session": [f"What is {name}?"]}
+
+
+def stub_upstream(fail: set = frozenset(), delay: float = 0.0) -> httpx.MockTransport:
+    """Chat completions endpoint answering with `expansion_of`; chunks named in `fail` get a 500"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        if CHUNK.search(prompt).group(0) in fail:
+            return httpx.Response(500, json={"error": {"message": "upstream error"}})
+        content = json.dumps(expansion_of(prompt))
+        return httpx.Response(200, json={"id": "chatcmpl-test", "object": "chat.completion", "model": "stub",
+                                         "choices": [{"index": 0, "finish_reason": "stop",
+                                                      "message": {"role": "assistant", "content": content}}]})
+
+    return httpx.MockTransport(handler)
+
+
+def stand_in_client(batch_size: int = 2, **app_kwargs) -> BatchExpansionClient:
+    app = create_app(upstream_base_url="http://upstream", upstream_api_key=None, **app_kwargs)
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stand-in/v1")
+    return BatchExpansionClient(model="stub", api_key="test", base_url="http://stand-in/v1", batch_size=batch_size,
+                                completion_window="24h", poll_interval=0.01, http_client=http_client)
+
+
+def requests_for(*names: str) -> dict:
+    return {f"id-{name}": f"Text of chunk-{name}." for name in names}
+
+
+def test_expand_maps_outputs_back_to_custom_ids():
+    client = stand_in_client(upstream_transport=stub_upstream())
+    results = asyncio.run(client.expand(requests_for("a", "b", "c")))  # two batch files
+    assert results == {f"id-{name}": expansion_of(f"chunk-{name}") for name in ("a", "b", "c")}
+
+
+def test_failed_requests_are_missing_from_results():
+    client = stand_in_client(upstream_transport=stub_upstream(fail={"chunk-b"}))
+    results = asyncio.run(client.expand(requests_for("a", "b", "c")))
+    assert set(results) == {"id-a", "id-c"}
+
+
+def test_failed_batch_returns_nothing_for_its_requests():
+    client = stand_in_client(upstream_transport=stub_upstream())
+    build_requests = client.build_requests
+    ## an input file with a malformed line fails validation, like the real API
+    client.build_requests = lambda requests: (build_requests(requests) if requests[0][0] != "id-c"
+                                              else "not json\n")
+    results = asyncio.run(client.expand(requests_for("a", "b", "c")))
+    assert set(results) == {"id-a", "id-b"}
+
+
+def test_expired_batch_returns_nothing():
+    client = stand_in_client(upstream_transport=stub_upstream(delay=1.0), batch_timeout=0.05)
+    assert asyncio.run(client.expand(requests_for("a", "b"))) == {}
+
+
+def test_batch_mode_expands_missing_chunks_online(tmp_path, monkeypatch):
+    client = stand_in_client(upstream_transport=stub_upstream(fail={"chunk-b"}))
+    requests = requests_for("a", "b")
+    results = asyncio.run(client.expand(requests))
+    path = str(tmp_path / "batch_expansions.jsonl")
+    save_batch_expansions({chunk_key(requests[custom_id]): expansion for custom_id, expansion in results.items()},
+                          path=path)
+    monkeypatch.setattr(batch_expansion, "load_batch_expansions", partial(load_batch_expansions, path=path))
+
+    online_prompts = []
+
+    def online_llm(prompt_value):
+        online_prompts.append(prompt_value.to_string())
+        return AIMessage(content=json.dumps(expansion_of(prompt_value.to_string())))
+
+    processor = AdvanceDocProcessor()
+    processor.llm = RunnableLambda(online_llm)
+    original, modified = asyncio.run(processor.document_expansion(list(requests.values()), mode="batch"))
+
+    assert original == list(requests.values())
+    assert len(online_prompts) == 1 and "chunk-b" in online_prompts[0]
+    for chunk, expanded in zip(original, modified):
+        name = CHUNK.search(chunk).group(0)
+        assert expanded == f"{chunk}\n\n keywords: \nkw {name}\n\n qa session: \nWhat is {name}?"
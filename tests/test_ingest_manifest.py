@@ -0,0 +1,64 @@
+"""
+IngestManifest: a document is skipped only once every section is stored and `complete` recorded it, with the
+same content hash and pipeline fingerprint.
+"""
+
+from src.pdf_processor.ingest_manifest import IngestManifest, content_hash
+
+SECTION = {"hash": content_hash("section text"), "fingerprint": "fp1", "chunk_count": 3}
+
+
+def manifest(tmp_path) -> IngestManifest:
+    return IngestManifest(str(tmp_path / "manifest.json"))
+
+
+def test_new_document_is_not_skipped(tmp_path):
+    assert not manifest(tmp_path).is_unchanged("doc_2024", "pdf1", "fp1")
+
+
+def test_document_is_skipped_only_after_complete(tmp_path):
+    ingest_manifest = manifest(tmp_path)
+    ingest_manifest.update_section("doc_2024", "Risk Factors", SECTION)
+    assert not ingest_manifest.is_unchanged("doc_2024", "pdf1", "fp1")
+    ingest_manifest.complete("doc_2024", "pdf1", "fp1")
+    assert ingest_manifest.is_unchanged("doc_2024", "pdf1", "fp1")
+
+
+def test_changed_pdf_or_fingerprint_is_not_skipped(tmp_path):
+    ingest_manifest = manifest(tmp_path)
+    ingest_manifest.complete("doc_2024", "pdf1", "fp1")
+    assert not ingest_manifest.is_unchanged("doc_2024", "pdf2", "fp1")
+    assert not ingest_manifest.is_unchanged("doc_2024", "pdf1", "fp2")
+
+
+def test_storing_a_section_reopens_a_completed_document(tmp_path):
+    ingest_manifest = manifest(tmp_path)
+    ingest_manifest.complete("doc_2024", "pdf1", "fp1")
+    ingest_manifest.update_section("doc_2024", "Risk Factors", SECTION)
+    assert not ingest_manifest.is_unchanged("doc_2024", "pdf1", "fp1")
+
+
+def test_unchanged_sections(tmp_path):
+    ingest_manifest = manifest(tmp_path)
+    ingest_manifest.update_section("doc_2024", "Risk Factors", SECTION)
+    sections = ingest_manifest.get("doc_2024")["sections"]
+    assert IngestManifest.section_unchanged(sections.get("Risk Factors"), content_hash("section text"), "fp1")
+    assert not IngestManifest.section_unchanged(sections.get("Risk Factors"), content_hash("edited"), "fp1")
+    assert not IngestManifest.section_unchanged(sections.get("Risk Factors"), content_hash("section text"), "fp2")
+    assert not IngestManifest.section_unchanged(sections.get("Outlook"), content_hash("section text"), "fp1")
+
+
+def test_changes_are_saved_and_applied_to_the_latest_contents(tmp_path):
+    first, second = manifest(tmp_path), manifest(tmp_path)  ## two ingestion workers
+    first.update_section("doc_2024", "Risk Factors", SECTION)
+    second.update_section("doc_2024", "Outlook", SECTION)
+    first.remove_sections("doc_2024", ["Risk Factors"])
+    first.complete("doc_2024", "pdf1", "fp1")
+
+    reloaded = manifest(tmp_path)
+    assert set(reloaded.get("doc_2024")["sections"]) == {"Outlook"}
+    assert reloaded.is_unchanged("doc_2024", "pdf1", "fp1")
+
+
+def test_content_hash_of_a_stream_matches_the_string():
+    assert content_hash(["sec", "tion ", "text"]) == content_hash("section text") == content_hash(b"section text")
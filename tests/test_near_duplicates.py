@@ -0,0 +1,89 @@
+"""
+DocumentDeduplicator: duplicates within the document and against the corpus index, commit and discard of a
+section's kept chunks.
+"""
+
+import numpy as np
+
+from src.pdf_processor.near_duplicates import DocumentDeduplicator, MinHasher, MinHashIndex, lsh_bands
+
+BOILERPLATE = ("This annual report may contain forward-looking statements that involve assumptions, risks and "
+               "uncertainties. Actual future performance could differ materially from these statements.")
+OTHER = ("Gross revenue for the financial year increased by eight per cent, driven by higher occupancy at the "
+         "suburban malls and positive rental reversions on renewed leases.")
+
+
+def vector(value: float) -> np.ndarray:
+    return np.full(4, value, dtype=np.float32)
+
+
+def deduplicator(doc_id: str = "doc_2024", index: MinHashIndex = None, kept_sections=()) -> DocumentDeduplicator:
+    fetched = {"other_2023#0": vector(9.0), "doc_2024#old": vector(8.0)}
+    return DocumentDeduplicator(doc_id, MinHasher(), index,
+                                lambda chunk_ids: {chunk_id: fetched[chunk_id] for chunk_id in chunk_ids
+                                                   if chunk_id in fetched},
+                                kept_sections=kept_sections)
+
+
+def corpus_index(tmp_path) -> MinHashIndex:
+    hasher = MinHasher()
+    index = MinHashIndex(str(tmp_path / "minhash.sqlite"), *lsh_bands(0.85, hasher.num_perm))
+    signature = hasher.signature(BOILERPLATE).tobytes()
+    index.add([("other_2023#0", "other_2023", "Notice", signature),
+               ("doc_2024#old", "doc_2024", "Cover", signature)])
+    return index
+
+
+def test_duplicate_within_the_document_links_to_the_kept_chunk():
+    dedup = deduplicator()
+    assert dedup.match(["a#0", "a#1"], [BOILERPLATE, OTHER], "A") == [None, None]
+    dedup.commit(["a#0", "a#1"], [vector(1.0), vector(2.0)])
+    assert dedup.match(["b#0", "b#1"], [BOILERPLATE.upper(), "too short"], "B") == ["a#0", None]
+    assert np.array_equal(dedup.vectors["a#0"], vector(1.0))
+    assert dedup.stats["doc_duplicates"] == 1
+
+
+def test_commit_queues_index_entries_once():
+    dedup = deduplicator()
+    dedup.match(["a#0", "a#1"], [BOILERPLATE, "too short"], "A")
+    assert dedup.take_entries() == []  ## not embedded yet
+    dedup.commit(["a#0", "a#1"], [vector(1.0), vector(2.0)])
+    assert [entry[:3] for entry in dedup.take_entries()] == [("a#0", "doc_2024", "A")]
+    assert dedup.take_entries() == []
+
+
+def test_discard_forgets_committed_and_pending_chunks_of_the_section():
+    dedup = deduplicator()
+    dedup.match(["a#0"], [BOILERPLATE], "A")
+    dedup.commit(["a#0"], [vector(1.0)])  ## an earlier micro-batch of the section was embedded
+    dedup.match(["a#1"], [OTHER], "A")
+    dedup.discard("A")
+
+    assert dedup.take_entries() == []
+    assert "a#0" not in dedup.vectors
+    ## nothing of the failed section is a canonical any more
+    assert dedup.match(["b#0", "b#1"], [BOILERPLATE, OTHER], "B") == [None, None]
+
+
+def test_discard_keeps_the_other_sections():
+    dedup = deduplicator()
+    dedup.match(["a#0"], [BOILERPLATE], "A")
+    dedup.commit(["a#0"], [vector(1.0)])
+    dedup.match(["b#0"], [OTHER], "B")
+    dedup.discard("B")
+    assert [entry[0] for entry in dedup.take_entries()] == ["a#0"]
+    assert dedup.match(["c#0"], [BOILERPLATE], "C") == ["a#0"]
+
+
+def test_corpus_match_reuses_the_stored_vector(tmp_path):
+    dedup = deduplicator(index=corpus_index(tmp_path))
+    assert dedup.match(["a#0"], [BOILERPLATE], "A") == ["other_2023#0"]
+    assert np.array_equal(dedup.vectors["other_2023#0"], vector(9.0))
+    assert dedup.stats["corpus_duplicates"] == 1
+
+
+def test_corpus_chunks_of_the_document_match_only_in_kept_sections(tmp_path):
+    index = corpus_index(tmp_path)
+    index.remove_sections("other_2023", ["Notice"])
+    assert deduplicator(index=index).match(["a#0"], [BOILERPLATE], "A") == [None]
+    assert deduplicator(index=index, kept_sections=["Cover"]).match(["a#0"], [BOILERPLATE], "A") == ["doc_2024#old"]
@@ -0,0 +1,63 @@
+"""
+StructureChunker with the offline stub encoding: whole blocks packed under their headings, blocks over the
+budget split within it.
+"""
+
+from src.utils.structure_chunker import StructureChunker
+
+
+def heading(text: str, level: int = 1) -> dict:
+    return {"type": "text", "text": text, "text_level": level}
+
+
+def paragraph(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+
+BLOCKS = [
+    heading("Annual Report"),
+    heading("Risk Factors", 2),
+    paragraph("Interest rates may rise."),
+    paragraph("Tenants may not renew their leases."),
+    paragraph("Long paragraph about credit risk. " * 20),
+    {"type": "table", "table_caption": ["Portfolio"],
+     "table_body": "<table>" + "<tr><td>Mall</td><td>97.5%</td></tr>" * 30 + "</table>"},
+    heading("风险因素", 2),
+    paragraph("没有标点的长段落" * 30),
+    {"type": "image", "img_caption": ["Figure 1: occupancy"]},
+]
+
+
+def chunker(chunk_max_tok: int = 40) -> StructureChunker:
+    return StructureChunker(chunk_max_tok=chunk_max_tok, max_chars=150)
+
+
+def test_chunks_stay_within_the_budgets(stub_tiktoken):
+    structure_chunker = chunker()
+    chunks = structure_chunker.chunk(BLOCKS)
+    assert len(chunks) > 3
+    ## the first blocks fit the budget only without their blank-line separators
+    assert chunks[0]["content"] == "# Annual Report\n\n## Risk Factors\n\nInterest rates may rise."
+    for chunk in chunks:
+        assert structure_chunker.splitter.count_tokens(chunk["content"]) <= structure_chunker.chunk_max_tok
+        assert len(chunk["content"]) <= structure_chunker.max_chars
+
+
+def test_small_blocks_are_packed_whole_under_their_headings(stub_tiktoken):
+    first = chunker(chunk_max_tok=60).chunk(BLOCKS)[0]
+    assert first == {"content": "# Annual Report\n\n## Risk Factors\n\nInterest rates may rise.\n\n"
+                                "Tenants may not renew their leases.",
+                     "heading_path": "Annual Report > Risk Factors"}
+
+
+def test_a_heading_starts_a_new_chunk(stub_tiktoken):
+    chunks = chunker().chunk(BLOCKS)
+    cjk = [chunk for chunk in chunks if chunk["heading_path"] == "Annual Report > 风险因素"]
+    assert cjk and cjk[0]["content"].startswith("## 风险因素")
+    assert all("Risk Factors" not in chunk["content"] and "Mall" not in chunk["content"] for chunk in cjk)
+    assert chunks[-1]["content"].endswith("Figure 1: occupancy")
+
+
+def test_streamed_blocks_chunk_like_the_list(stub_tiktoken):
+    structure_chunker = chunker()
+    assert list(structure_chunker.iter_chunks(iter(BLOCKS))) == structure_chunker.chunk(BLOCKS)
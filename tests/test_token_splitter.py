@@ -0,0 +1,70 @@
+"""
+TokenSplitter with the offline stub encoding: a stream splits like the joined string, and every chunk stays
+within the token and character budgets, latin and CJK.
+"""
+
+import random
+
+import pytest
+
+from src.utils.token_splitter import TokenSplitter
+
+LATIN = ("The Manager reviewed the portfolio. Occupancy rose to 97.5% across the malls!\n"
+         "Net property income grew; distributions per unit were stable.\n\n"
+         "Supercalifragilisticexpialidocious-style unbroken tokens appear in tables: "
+         + "x" * 400 + "\n\n")
+CJK = ("本基金的物业组合在本年度保持稳定。出租率维持在百分之九十以上！" * 3 + "\n"
+       + "没有标点的长段落" * 40 + "\n\n")
+TEXT = (LATIN + CJK) * 4
+
+
+def splitter(chunk_max_tok=40, overlap=8, max_chars=120) -> TokenSplitter:
+    return TokenSplitter(chunk_max_tok=chunk_max_tok, overlap=overlap, max_chars=max_chars)
+
+
+def cut(text: str, positions) -> list:
+    positions = [0] + sorted(positions) + [len(text)]
+    return [text[start:end] for start, end in zip(positions, positions[1:])]
+
+
+@pytest.mark.parametrize("piece_size", [1, 7, 64, 1000])
+def test_stream_splits_like_the_joined_string(stub_tiktoken, piece_size):
+    token_splitter = splitter()
+    pieces = [TEXT[i:i + piece_size] for i in range(0, len(TEXT), piece_size)]
+    assert list(token_splitter.iter_chunks(iter(pieces))) == token_splitter.split(TEXT)
+
+
+def test_stream_cut_anywhere_splits_like_the_joined_string(stub_tiktoken):
+    token_splitter = splitter()
+    expected = token_splitter.split(TEXT)
+    rng = random.Random(0)
+    for _ in range(20):
+        pieces = cut(TEXT, rng.sample(range(1, len(TEXT)), 30))
+        assert list(token_splitter.iter_chunks(pieces)) == expected
+
+
+@pytest.mark.parametrize("text", [LATIN * 3, CJK * 3, TEXT], ids=["latin", "cjk", "mixed"])
+def test_chunks_stay_within_the_budgets(stub_tiktoken, text):
+    token_splitter = splitter()
+    chunks = token_splitter.split(text)
+    assert chunks
+    for chunk in chunks:
+        assert token_splitter.count_tokens(chunk) <= token_splitter.chunk_max_tok
+        assert len(chunk) <= token_splitter.max_chars
+
+
+def test_character_budget_binds_before_the_token_budget(stub_tiktoken):
+    ## 4-character tokens: 100 tokens would be 400 characters, the character cap cuts first
+    token_splitter = splitter(chunk_max_tok=100, overlap=10, max_chars=50)
+    for chunk in token_splitter.split("abcd " * 200):
+        assert len(chunk) <= 50
+
+
+def test_chunks_cover_the_text(stub_tiktoken):
+    token_splitter = splitter(overlap=0)
+    assert "".join(token_splitter.split(CJK)) == "".join(CJK.split())
+
+
+def test_overlap_must_be_smaller_than_the_chunk(stub_tiktoken):
+    with pytest.raises(ValueError):
+        splitter(chunk_max_tok=10, overlap=10)